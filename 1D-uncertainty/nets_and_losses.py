@@ -75,6 +75,12 @@ def build_hydra(num_heads, num_outputs=1, direct_variance_head=False):
     return net
 
 
+#Softplus with a threshold (same as positive_fn in the top-level utils.py)
+def positive_fn(x):
+    large_num = 10
+    eps = 1e-12
+    return torch.where(x < large_num, torch.log(1. + eps + torch.exp(x.clamp(max=large_num))), x)
+
 #NLL loss for single-headed NN
 class GaussianLoss(torch.nn.Module):
     def __init__(self):
@@ -83,7 +89,7 @@ class GaussianLoss(torch.nn.Module):
     #Based on negative log of normal distribution
     def forward(self, input, target):
         mean = input[:, 0]
-        sigma2 = torch.log(1. + torch.exp(input[:, 1])) + 1e-6
+        sigma2 = positive_fn(input[:, 1]) + 1e-6
         #sigma2 = torch.nn.functional.softplus(input[:, 1]) + 1e-4
         loss = torch.mean(0.5*(mean - target.squeeze())*((mean - target.squeeze())/sigma2) + 0.5*torch.log(sigma2))
         return loss
@@ -97,7 +103,7 @@ class GaussianHydraLoss(torch.nn.Module):
     def forward(self, input, target):
 
         mean = input[:, :-1]
-        sigma2 = torch.log(1. + torch.exp(input[:, [-1]])) + 1e-6 #torch.abs(input[:, [-1]]) + 1e-6
+        sigma2 = positive_fn(input[:, [-1]]) + 1e-6 #torch.abs(input[:, [-1]]) + 1e-6
 
         sigma2 = sigma2.repeat([1, mean.shape[1]])
         #sigma2 = torch.nn.functional.softplus(input[:, :, 1]) + 1e-4
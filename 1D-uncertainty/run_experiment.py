@@ -10,6 +10,8 @@ import csv
 from visualize import *
 import os
 
+#Pinned on purpose, like train_and_test.py (tiny 1D MLPs, not covered by runtime_profile / autotune.py). Overrides its
+#single thread with the 4 the 100-run experiment was produced with, so reruns stay comparable across machines.
 os.environ['OMP_NUM_THREADS'] = '4'
 torch.set_num_threads(4)
 
@@ -5,6 +5,9 @@ from nets_and_losses import *
 from visualize import *
 import os
 
+#Pinned on purpose, not read from runtime_profile (autotune.py does not cover these scripts): the nets are tiny 1D MLPs
+#trained on ~100 samples, where spawning intra-op threads costs more than the matmuls they split.
+#run_experiment.py raises this to 4 after importing this module.
 os.environ['OMP_NUM_THREADS'] = '1'
 torch.set_num_threads(1)
 
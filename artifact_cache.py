@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+
+#Derived artifacts of the pipeline (trajectory .mat files -> dataset manifests -> frame stores -> hydranet outputs -> fusion results)
+#are keyed by a hash of their input files and build parameters. Builder scripts check the cache and skip outputs whose key is unchanged.
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifact_cache.json')
+
+class ArtifactCache(object):
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, force=False):
+        """
+          :param cache_file: json file that records the key of every built artifact (shared by all builder scripts)
+          :param force: treat every artifact as stale
+        """
+        self.cache_file = cache_file
+        self.force = force
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        else:
+            cache = {}
+        self.artifacts = cache.get('artifacts', {})
+        self.files = cache.get('files', {})
+
+    def file_hash(self, path, content=True):
+        """Content hash of a file (recomputed only when its size or mtime changes).
+        With content=False, only the size and mtime are used (e.g., for thousands of raw images)."""
+        if not os.path.exists(path):
+            return 'missing'
+        st = os.stat(path)
+        if not content:
+            return '{}:{}'.format(st.st_size, st.st_mtime_ns)
+
+        path = os.path.abspath(path)
+        cached = self.files.get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.files[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def key(self, inputs=None, params=None, content=True):
+        h = hashlib.sha1()
+        h.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        for path in inputs or []:
+            h.update(path.encode())
+            h.update(self.file_hash(path, content).encode())
+        return h.hexdigest()
+
+    def status(self, output, inputs=None, params=None, content=True):
+        """Returns None if output is up to date, otherwise the reason it needs rebuilding"""
+        if self.force:
+            return 'forced'
+        if not os.path.exists(output):
+            return 'missing'
+        recorded = self.artifacts.get(os.path.abspath(output))
+        if recorded is None:
+            return 'not tracked'
+        if recorded != self.key(inputs, params, content):
+            return 'inputs changed'
+        return None
+
+    def is_fresh(self, output, inputs=None, params=None, content=True):
+        return self.status(output, inputs, params, content) is None
+
+    def record(self, output, inputs=None, params=None, content=True):
+        self.artifacts[os.path.abspath(output)] = self.key(inputs, params, content)
+        self.save()
+
+    def plan(self, jobs):
+        """jobs: list of (output, inputs, params) or (output, inputs, params, content).
+        Returns (output, reason) for every job, with reason None if the output is up to date (see status)."""
+        build_plan = [(job[0], self.status(*job)) for job in jobs]
+        self.save()
+        return build_plan
+
+    def save(self):
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'artifacts': self.artifacts, 'files': self.files}, f, indent=1)
+        os.replace(tmp_file, self.cache_file)
+
+def report_plan(build_plan):
+    """Prints a plan returned by ArtifactCache.plan. Returns the outputs that are stale."""
+    print('Build plan:')
+    for output, reason in build_plan:
+        print('  {:<16} {}'.format('up to date' if reason is None else 'rebuild (' + reason + ')', output))
+    stale = [output for output, reason in build_plan if reason is not None]
+    print('{} / {} artifacts to rebuild.'.format(len(stale), len(build_plan)))
+    return stale
@@ -0,0 +1,83 @@
+import os
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+
+#Plots and checkpoints written off the training thread. Arguments are snapshotted to the CPU (so training can keep
+#updating the model) and the work runs in a small pool of spawned processes. At most max_pending jobs are in flight:
+#a further submit blocks until the oldest one is done. Errors in a job are re-raised on the next submit / flush, and
+#everything is flushed on close() (or at exit), e.g.:
+#writer = ArtifactWriter()
+#writer.submit(plot_errors_with_sigmas, *predict_history, filename=sigma_filename)
+#writer.save({'full_model': model.state_dict(), 'epoch': epoch + 1}, model_filename)
+
+def snapshot(x):
+    """CPU copies of all tensors in nested dicts / lists / tuples"""
+    if torch.is_tensor(x):
+        return x.detach().to('cpu', copy=True)
+    if isinstance(x, dict):
+        return type(x)((k, snapshot(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return type(x)(snapshot(v) for v in x)
+    return x
+
+def save_atomic(obj, path):
+    """torch.save to a temporary file that is renamed into place (readers never see a partial checkpoint)"""
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def _run(fn, args, kwargs):
+    #Plots are rendered off-screen in the workers
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    try:
+        fn(*args, **kwargs)
+    finally:
+        plt.close('all')
+
+class ArtifactWriter(object):
+    def __init__(self, num_workers=2, max_pending=4):
+        """
+          :param num_workers: worker processes (0: run every job synchronously on the calling thread)
+          :param max_pending: maximum number of submitted jobs that are not done
+        """
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.pool = None
+        self.pending = []
+        atexit.register(self.close)
+
+    def _check(self, block_until=None):
+        #Collects finished jobs (re-raising their errors), waiting until at most block_until jobs are pending
+        while self.pending and (self.pending[0].done() or (block_until is not None and len(self.pending) > block_until)):
+            self.pending.pop(0).result()
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in a worker (fn must be importable, e.g. a function in vis.py)"""
+        args, kwargs = snapshot(args), snapshot(kwargs)
+        if self.num_workers == 0:
+            _run(fn, args, kwargs)
+            return
+        if self.pool is None:
+            #Spawned (not forked) workers: forking a process with live OpenMP / CUDA state is unsafe
+            self.pool = ProcessPoolExecutor(self.num_workers, mp_context=multiprocessing.get_context('spawn'))
+        self._check(block_until=self.max_pending - 1)
+        self.pending.append(self.pool.submit(_run, fn, args, kwargs))
+
+    def save(self, obj, path):
+        self.submit(save_atomic, obj, path)
+
+    def flush(self):
+        self._check(block_until=0)
+
+    def close(self):
+        if self.pool is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown()
+            self.pool = None
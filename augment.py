@@ -0,0 +1,88 @@
+import torch
+import math
+import torch.nn.functional as F
+
+#Batch-level augmentation of uint8 N x C x H x W image batches (e.g., from SevenScenesCachedData), applied after the
+#device transfer instead of per-image PIL transforms in the DataLoader workers. Every sample gets its own random parameters.
+
+class BatchAugment(object):
+    """Random affine warp (rotation and x-shear about the image center, as transforms.RandomAffine), colour jitter
+    and normalization of a whole uint8 batch, with grid_sample / affine_grid.
+
+      :param degrees: rotation angles are drawn from [-degrees, degrees]
+      :param shear: x-shear angles (degrees) are drawn from [-shear, shear]
+      :param brightness, contrast, saturation: jitter factors are drawn from [1 - value, 1 + value]
+      :param crop_size: optional center crop, applied before the warp
+      :param seed: seeds the generator of the random parameters, so that the sequence of augmented batches is reproducible
+    """
+
+    def __init__(self, degrees=0., shear=0., brightness=0., contrast=0., saturation=0., mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225], crop_size=None, seed=None):
+        self.degrees = degrees
+        self.shear = shear
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.crop_size = crop_size
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+
+    def uniform(self, n, low, high):
+        return low + (high - low)*torch.rand(n, generator=self.generator, dtype=torch.float64)
+
+    def affine_theta(self, n, h, w):
+        """N x 2 x 3 affine_grid matrices mapping output to input (normalized) coordinates"""
+        angle = self.uniform(n, -self.degrees, self.degrees)*math.pi/180.
+        shear = self.uniform(n, -self.shear, self.shear)*math.pi/180.
+
+        #Forward warp in pixel coordinates centered on the image: rotation followed by x-shear
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        rot = torch.stack((torch.stack((cos, -sin), 1), torch.stack((sin, cos), 1)), 1)
+        shear_mat = torch.eye(2, dtype=torch.float64).repeat(n, 1, 1)
+        shear_mat[:, 0, 1] = -torch.tan(shear)
+        A = rot.bmm(shear_mat)
+
+        #Sampling needs the inverse warp, expressed in normalized [-1, 1] coordinates
+        scale = torch.tensor([w/2., h/2.], dtype=torch.float64)
+        A_inv = torch.inverse(A)
+        theta = torch.zeros(n, 2, 3, dtype=torch.float64)
+        theta[:, :, :2] = A_inv*scale.view(1, 1, 2)/scale.view(1, 2, 1)
+        return theta
+
+    def jitter(self, imgs):
+        n = imgs.shape[0]
+        if self.brightness > 0:
+            imgs = imgs*self.uniform(n, 1 - self.brightness, 1 + self.brightness).to(imgs).view(-1, 1, 1, 1)
+        if self.contrast > 0 or self.saturation > 0:
+            gray = (0.299*imgs[:, 0:1] + 0.587*imgs[:, 1:2] + 0.114*imgs[:, 2:3])
+        if self.contrast > 0:
+            factor = self.uniform(n, 1 - self.contrast, 1 + self.contrast).to(imgs).view(-1, 1, 1, 1)
+            mean = gray.mean(dim=(1, 2, 3), keepdim=True)
+            imgs = (imgs - mean)*factor + mean
+            gray = (gray - mean)*factor + mean
+        if self.saturation > 0:
+            factor = self.uniform(n, 1 - self.saturation, 1 + self.saturation).to(imgs).view(-1, 1, 1, 1)
+            imgs = (imgs - gray)*factor + gray
+        return imgs.clamp_(0., 1.)
+
+    def __call__(self, imgs):
+        if self.crop_size is not None:
+            top = (imgs.shape[2] - self.crop_size) // 2
+            left = (imgs.shape[3] - self.crop_size) // 2
+            imgs = imgs[:, :, top:top + self.crop_size, left:left + self.crop_size]
+        imgs = imgs.float().div_(255.)
+        n, _, h, w = imgs.shape
+
+        if self.degrees > 0 or self.shear > 0:
+            theta = self.affine_theta(n, h, w).to(imgs)
+            grid = F.affine_grid(theta, imgs.shape, align_corners=False)
+            imgs = F.grid_sample(imgs, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+        if self.brightness > 0 or self.contrast > 0 or self.saturation > 0:
+            imgs = self.jitter(imgs)
+
+        return (imgs - self.mean.to(imgs.device)).div_(self.std.to(imgs.device))
@@ -0,0 +1,150 @@
+import os, sys
+import json
+import time
+import subprocess
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from models import QuaternionCNN
+from loss import QuatNLLLoss
+from utils import perturb_quat_for_hydranet, normalize_vecs
+from train_test import prepare_batch
+from runtime_profile import save_runtime_profile, set_threads, loader_kwargs, DEFAULT_PROFILE_FILE
+
+#Finds the fastest stable intra-op / inter-op threads, DataLoader workers, prefetch factor and batch size for the
+#training loop of an experiment on this machine, and writes them to the runtime profile loaded by the run scripts.
+#Every setting is timed in a fresh process (torch fixes the inter-op thread count once per process) over several windows
+#of training steps. A setting is stable if the windows' samples/s vary by less than --max_cv. The dimensions are tuned one
+#at a time (threads, workers, prefetch factor, inter-op threads, batch size), starting from the best values so far, e.g.:
+#python autotune.py --experiment kitti --seq 00 --gray_store gray
+#python autotune.py --experiment 7scenes --store_path 7scenes/store --batch_sizes 16 32
+
+DEFAULT_BATCH_SIZE = {'kitti': 32, '7scenes': 16}
+
+def build_dataset(args):
+    """Model, training dataset and batch transform of the experiment (synthetic inputs with --synthetic)"""
+    if args.experiment == 'kitti':
+        model = QuaternionCNN(num_hydra_heads=args.num_heads)
+        if args.synthetic:
+            return model, TensorDataset(torch.randn(args.synthetic, 2, 120, 400), normalize_vecs(torch.randn(args.synthetic, 4))), None
+        from loaders import KITTIVODatasetPreTransformed
+        from kitti.manifest import manifest_filename
+        kitti_data_pickle_file = manifest_filename(args.seq)
+        return model, KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path='kitti/data', run_type='train', seq_prefix='seq_', gray_store=args.gray_store), None
+
+    model = QuaternionCNN(num_hydra_heads=args.num_heads, resnet=True)
+    if args.synthetic:
+        return model, TensorDataset(torch.randn(args.synthetic, 3, 224, 224), normalize_vecs(torch.randn(args.synthetic, 4))), None
+    from loaders import SevenScenesCachedData, BatchNormalizeImages
+    return model, SevenScenesCachedData(args.scene, args.store_path, train=True), BatchNormalizeImages(crop_size=224)
+
+def batches(loader):
+    while True:
+        for batch in loader:
+            yield batch
+
+def run_trial(trial, args):
+    """samples/s of each timed window of args.steps training steps (after one warm-up window)"""
+    set_threads(trial['threads'], trial['inter_threads'])
+    torch.manual_seed(0)
+    model, dataset, batch_transform = build_dataset(args)
+    loader = DataLoader(dataset, batch_size=trial['batch_size'], shuffle=True, drop_last=True, pin_memory=False,
+                        **loader_kwargs(trial['num_workers'], trial['prefetch_factor']))
+    loss_fn = QuatNLLLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    config = {'device': torch.device('cpu'), 'batch_transform': batch_transform}
+
+    model.train()
+    batch_iter = batches(loader)
+    rates = []
+    for window in range(args.windows + 1):
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            y_obs, q_gt = next(batch_iter)
+            y_obs, q_gt = prepare_batch(loader, y_obs, q_gt, config, train=True)
+            q_est, Rinv = model(y_obs)
+            loss = loss_fn(q_est, perturb_quat_for_hydranet(q_gt, model.num_hydra_heads, 0.), Rinv).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        if window > 0:
+            rates.append(args.steps*trial['batch_size'] / (time.perf_counter() - start))
+    return rates
+
+def time_trial(trial, argv, timeout):
+    """Runs a trial in a new process. Returns (median samples/s, coefficient of variation), or None if it failed."""
+    try:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__)] + argv + ['--trial', json.dumps(trial)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        return None
+    if out.returncode != 0:
+        print(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'exit code {}'.format(out.returncode))
+        return None
+    rates = np.array(json.loads(out.stdout.strip().splitlines()[-1]))
+    return float(np.median(rates)), float(rates.std() / rates.mean())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune threads, DataLoader workers and batch size for an experiment.')
+    parser.add_argument('--experiment', type=str, default='kitti', choices=['kitti', '7scenes'])
+    parser.add_argument('--num_heads', type=int, default=25)
+    parser.add_argument('--seq', type=str, default='00')
+    parser.add_argument('--gray_store', type=str, default=None, choices=['gray'])
+    parser.add_argument('--scene', type=str, default='chess')
+    parser.add_argument('--store_path', type=str, default=None, help='7-Scenes frame store (create_7scenes_store.py)')
+    parser.add_argument('--synthetic', type=int, default=0, help='Use this many random inputs instead of the dataset (times the model only)')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=None, help='Batch sizes to try (default: the script default only)')
+    parser.add_argument('--steps', type=int, default=10, help='Training steps per timed window')
+    parser.add_argument('--windows', type=int, default=3, help='Timed windows per setting')
+    parser.add_argument('--max_cv', type=float, default=0.1, help='Maximum coefficient of variation of a stable setting')
+    parser.add_argument('--timeout', type=float, default=1800.)
+    parser.add_argument('--profile_file', type=str, default=DEFAULT_PROFILE_FILE)
+    parser.add_argument('--trial', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.experiment == '7scenes' and args.store_path is None and not args.synthetic:
+        parser.error('--experiment 7scenes needs --store_path or --synthetic')
+
+    if args.trial is not None:
+        print(json.dumps(run_trial(json.loads(args.trial), args)))
+        sys.exit(0)
+
+    argv = sys.argv[1:]
+    cores = len(os.sched_getaffinity(0))
+    batch_sizes = args.batch_sizes or [DEFAULT_BATCH_SIZE[args.experiment]]
+    candidates = [
+        ('threads', sorted(set([cores, max(cores // 2, 1), max(cores // 4, 1)]), reverse=True)),
+        ('num_workers', [w for w in [0, 2, 4, 8, 12] if w < cores]),
+        ('prefetch_factor', [2, 4]),
+        ('inter_threads', [1, 2, 4]),
+        ('batch_size', batch_sizes),
+    ]
+    best = {'threads': cores, 'inter_threads': 1, 'num_workers': 4 if cores > 4 else 0, 'prefetch_factor': 2, 'batch_size': batch_sizes[0]}
+    results = {}
+
+    for key, values in candidates:
+        if key == 'prefetch_factor' and best['num_workers'] == 0:
+            continue
+        stable = []
+        for value in values:
+            trial = dict(best, **{key: value})
+            trial_key = json.dumps(trial, sort_keys=True)
+            if trial_key not in results:
+                results[trial_key] = time_trial(trial, argv, args.timeout)
+            result = results[trial_key]
+            if result is None:
+                print('{:<16} {:>4}: failed'.format(key, value))
+                continue
+            print('{:<16} {:>4}: {:8.1f} samples/s (cv {:.3f}){}'.format(key, value, result[0], result[1], '' if result[1] <= args.max_cv else ' unstable'))
+            if result[1] <= args.max_cv:
+                stable.append((result[0], value))
+        if len(stable) > 0:
+            best[key] = max(stable)[1]
+
+    best_result = results.get(json.dumps(best, sort_keys=True))
+    if best_result is None:
+        print('No stable setting found; the runtime profile is unchanged.')
+        sys.exit(1)
+    save_runtime_profile(args.experiment, best, best_result[0], args.profile_file)
+    print('Best: {} ({:.1f} samples/s), written to {}'.format(best, best_result[0], args.profile_file))
@@ -0,0 +1,68 @@
+import torch
+import time, sys, os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models import QuaternionCNN
+from loss import QuatNLLLoss
+from utils import autocast, quat_ang_error, perturb_quat_for_hydranet, normalize_vecs
+
+#fp32 vs. bf16 autocast (--amp bf16) on the CPU: training / inference throughput of the HydraNet CNNs, and the deviation
+#of the bf16 outputs from the fp32 outputs of the same weights, e.g.:
+#python benchmarks/bench_amp.py --model basic --batch_size 32 --threads 16
+
+def time_steps(model, loss_fn, optimizer, y_obs, q_gt, amp, steps, train):
+    device = torch.device('cpu')
+    model.train(train)
+    start = None
+    for step in range(steps + 1):
+        if step == 1:
+            start = time.perf_counter()
+        if train:
+            with autocast(device, amp):
+                q_est, Rinv = model(y_obs)
+            loss = loss_fn(q_est, perturb_quat_for_hydranet(q_gt, model.num_hydra_heads, 0.), Rinv).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad(), autocast(device, amp):
+                model(y_obs)
+    return steps*y_obs.shape[0] / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bf16 autocast benchmark.')
+    parser.add_argument('--model', type=str, default='basic', choices=['basic', 'resnet'], help='BasicCNN (KITTI flow) or CustomResNet (7-Scenes)')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_heads', type=int, default=25)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    if args.model == 'basic':
+        model = QuaternionCNN(num_hydra_heads=args.num_heads, channels=2)
+        y_obs = torch.randn(args.batch_size, 2, 120, 400)
+    else:
+        model = QuaternionCNN(num_hydra_heads=args.num_heads, resnet=True)
+        y_obs = torch.randn(args.batch_size, 3, 224, 224)
+    q_gt = normalize_vecs(torch.randn(args.batch_size, 4))
+    loss_fn = QuatNLLLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+
+    #Deviation of the bf16 outputs from fp32 (same weights, eval mode)
+    model.eval()
+    with torch.no_grad():
+        q_32, Rinv_32, _ = model(y_obs)
+        with autocast(torch.device('cpu'), 'bf16'):
+            q_16, Rinv_16, _ = model(y_obs)
+    print('Output dtypes under bf16 autocast: {} / {}'.format(q_16.dtype, Rinv_16.dtype))
+    print('bf16 vs fp32: mean angle between head means {:.4f} deg, max relative Rinv difference {:.2E}'.format(
+        quat_ang_error(q_16, q_32).mean().item()*180./3.1415, ((Rinv_16 - Rinv_32).norm(dim=(1, 2)) / Rinv_32.norm(dim=(1, 2))).max().item()))
+
+    for amp in [None, 'bf16']:
+        train_rate = time_steps(model, loss_fn, optimizer, y_obs, q_gt, amp, args.steps, train=True)
+        eval_rate = time_steps(model, loss_fn, optimizer, y_obs, q_gt, amp, args.steps, train=False)
+        print('{:>4}: train {:8.1f} samples/s | inference {:8.1f} samples/s'.format('fp32' if amp is None else amp, train_rate, eval_rate))
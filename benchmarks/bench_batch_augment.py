@@ -0,0 +1,51 @@
+import torch
+import numpy as np
+import time, sys, os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from augment import BatchAugment
+from PIL import Image
+import torchvision.transforms as transforms
+
+#Per-image PIL augmentation (transform_jitter of run_7scenes_experiment.py, minus the resize) vs. augment.BatchAugment
+#on whole uint8 batches, e.g.:
+#python benchmarks/bench_batch_augment.py --batch_size 32 --threads 1 2 4
+
+def pil_augment(imgs, transform):
+    return torch.stack([transform(Image.fromarray(img.permute(1, 2, 0).numpy())) for img in imgs])
+
+def time_fn(fn, imgs, reps):
+    fn(imgs)
+    start = time.perf_counter()
+    for _ in range(reps):
+        fn(imgs)
+    return 1e3*(time.perf_counter() - start) / reps
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch augmentation benchmark.')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--size', type=int, default=256, help='Stored frame size (cropped to 224)')
+    parser.add_argument('--reps', type=int, default=10)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    imgs = torch.from_numpy(np.random.RandomState(0).randint(0, 256, (args.batch_size, 3, args.size, args.size), dtype=np.uint8))
+
+    pil_transform = transforms.Compose([
+        transforms.CenterCrop(224),
+        transforms.RandomAffine(degrees=30, shear=10),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                             std=[0.229, 0.224, 0.225])
+    ])
+    batch_transform = BatchAugment(degrees=30, shear=10, crop_size=224, seed=0)
+
+    #Same seed, same batches
+    repeat = BatchAugment(degrees=30, shear=10, crop_size=224, seed=0)
+    print('Deterministic under seed: {}'.format(torch.equal(batch_transform(imgs), repeat(imgs))))
+
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        pil_ms = time_fn(lambda x: pil_augment(x, pil_transform), imgs, args.reps)
+        batch_ms = time_fn(batch_transform, imgs, args.reps)
+        print('threads={}: PIL {:.1f} ms / batch | BatchAugment {:.1f} ms / batch ({:.1f}x)'.format(threads, pil_ms, batch_ms, pil_ms / batch_ms))
@@ -0,0 +1,58 @@
+import torch
+import torch.multiprocessing as mp
+import time, sys, os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models import QuaternionCNN
+from loss import QuatNLLLoss
+from utils import perturb_quat_for_hydranet, normalize_vecs
+from distributed import setup_distributed, cleanup_distributed, wrap_model, is_main_process
+
+#Samples / second of gloo data-parallel CPU training (distributed.py) with 1 to N processes, on synthetic KITTI flow inputs.
+#The global batch size is fixed and split across the processes, each pinned to cores / N threads, e.g.:
+#python benchmarks/bench_ddp_scaling.py --procs 1 2 4 8 --batch_size 64
+
+def worker(rank, world_size, args, results):
+    os.environ.update({'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(args.port + world_size), 'RANK': str(rank),
+                       'WORLD_SIZE': str(world_size), 'LOCAL_RANK': str(rank), 'LOCAL_WORLD_SIZE': str(world_size)})
+    setup_distributed(threads=max(1, args.cores // world_size))
+
+    torch.manual_seed(rank)
+    model = QuaternionCNN(num_hydra_heads=args.num_heads, channels=2)
+    train_model = wrap_model(model)
+    loss_fn = QuatNLLLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    batch_size = args.batch_size // world_size
+    y_obs = torch.randn(batch_size, 2, 120, 400)
+    q_gt = normalize_vecs(torch.randn(batch_size, 4))
+
+    train_model.train()
+    for step in range(args.steps + 1):
+        if step == 1:
+            start = time.perf_counter()
+        q_est, Rinv = train_model(y_obs)
+        loss = loss_fn(q_est, perturb_quat_for_hydranet(q_gt, args.num_heads, 0.), Rinv).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    elapsed = time.perf_counter() - start
+
+    if is_main_process():
+        results[world_size] = args.steps*batch_size*world_size / elapsed
+    cleanup_distributed()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Data-parallel scaling benchmark.')
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--cores', type=int, default=len(os.sched_getaffinity(0)))
+    parser.add_argument('--batch_size', type=int, default=64, help='Global batch size')
+    parser.add_argument('--num_heads', type=int, default=25)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--port', type=int, default=29600)
+    args = parser.parse_args()
+
+    results = mp.Manager().dict()
+    for world_size in args.procs:
+        mp.spawn(worker, args=(world_size, args, results), nprocs=world_size, join=True)
+        print('{:3d} processes x {:3d} threads: {:8.1f} samples/s ({:.2f}x)'.format(
+            world_size, max(1, args.cores // world_size), results[world_size], results[world_size] / results[args.procs[0]]))
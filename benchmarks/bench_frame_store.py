@@ -0,0 +1,51 @@
+import torch
+import numpy as np
+import time, sys, os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loaders import CompressedFrames
+from kitti.create_single_dataset_file import KITTI_SEQS_DICT, encode_image
+
+#Footprint and decode throughput of the compressed frame store vs. raw uint8 tensors
+#Usage: python benchmarks/bench_frame_store.py --seq_file kitti/data/seq_00.pt
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Frame store footprint / throughput report.')
+    parser.add_argument('--seq_file', type=str, required=True)
+    parser.add_argument('--num_frames', type=int, default=500)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--ram_gb', type=float, default=16.)
+    args = parser.parse_args()
+
+    im_l = torch.load(args.seq_file)['im_l'][:args.num_frames]
+    num_frames = im_l.shape[0]
+    raw_frame_bytes = im_l[0].numel()
+    total_kitti_frames = sum([len(KITTI_SEQS_DICT[s]['frames']) for s in KITTI_SEQS_DICT])
+    avg_seq_frames = total_kitti_frames / len(KITTI_SEQS_DICT)
+
+    codecs = [('raw', None), ('.png', None), ('.webp', 100), ('.webp', 90), ('.jpg', 95), ('.jpg', 90)]
+
+    print('{} frames of {}. Batch size {}. RAM budget {:.1f} GB.'.format(num_frames, tuple(im_l.shape[1:]), args.batch_size, args.ram_gb))
+    print('{:>10} {:>8} | {:>10} {:>7} {:>10} | {:>13} {:>10}'.format(
+        'codec', 'quality', 'KB/frame', 'ratio', 'seqs fit', 'decode ms/bat', 'max abs err'))
+
+    for codec, quality in codecs:
+        if codec == 'raw':
+            frame_bytes = raw_frame_bytes
+            decode_ms = 0.
+            max_err = 0
+        else:
+            bufs = [encode_image(im_l[i], codec, quality) for i in range(num_frames)]
+            offsets = np.zeros(num_frames + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(b) for b in bufs])
+            frames = CompressedFrames(torch.from_numpy(np.concatenate(bufs)), torch.from_numpy(offsets))
+            frame_bytes = frames.nbytes / num_frames
+
+            start = time.perf_counter()
+            decoded = [frames[i] for i in range(num_frames)]
+            decode_ms = 1e3 * (time.perf_counter() - start) * args.batch_size / num_frames
+            max_err = max([(decoded[i].int() - im_l[i].int()).abs().max().item() for i in range(num_frames)])
+
+        seqs_fit = args.ram_gb * 1e9 / (frame_bytes * avg_seq_frames)
+        print('{:>10} {:>8} | {:>10.1f} {:>7.2f} {:>10.1f} | {:>13.2f} {:>10}'.format(
+            codec, str(quality), frame_bytes / 1e3, raw_frame_bytes / frame_bytes, seqs_fit, decode_ms, max_err))
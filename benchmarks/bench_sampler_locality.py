@@ -0,0 +1,56 @@
+import torch
+import numpy as np
+import time, sys, os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from loaders import KITTIVODatasetPreTransformed
+from samplers import SequenceBlockBatchSampler
+from torch.utils.data import DataLoader
+
+#Loader throughput of plain shuffling vs. block shuffling (SequenceBlockBatchSampler) against a cold page cache.
+#Needs .npy (memmap) frame stores so that frames are paged in lazily, e.g.:
+#python benchmarks/bench_sampler_locality.py --dataset_file kitti/datasets/obelisk/kitti_singlefile_data_sequence_00_delta_1_reverse_True_minta_0.02.npz --seqs_base_path kitti/data
+
+def drop_page_cache(file_paths):
+    for file_path in file_paths:
+        fd = os.open(file_path, os.O_RDONLY)
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+def time_loader(loader, num_batches):
+    start = time.perf_counter()
+    samples = 0
+    for batch_idx, (y_obs, q_gt) in enumerate(loader):
+        samples += q_gt.shape[0]
+        if batch_idx + 1 == num_batches:
+            break
+    return samples / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sampler locality benchmark.')
+    parser.add_argument('--dataset_file', type=str, required=True)
+    parser.add_argument('--seqs_base_path', type=str, default='kitti/data')
+    parser.add_argument('--seq_prefix', type=str, default='seq_noncropped_')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_batches', type=int, default=200)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--block_sizes', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--blocks_per_batch', type=int, default=4)
+    args = parser.parse_args()
+
+    dataset = KITTIVODatasetPreTransformed(args.dataset_file, seqs_base_path=args.seqs_base_path, run_type='train',
+                                           use_flow=False, seq_prefix=args.seq_prefix, seq_ext='.npy')
+    store_files = [args.seqs_base_path + '/' + args.seq_prefix + seq + '.npy' for seq in dataset.seq_images]
+
+    drop_page_cache(store_files)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, drop_last=True)
+    print('{:>28}: {:8.1f} samples/s'.format('shuffle=True', time_loader(loader, args.num_batches)))
+
+    for block_size in args.block_sizes:
+        drop_page_cache(store_files)
+        sampler = SequenceBlockBatchSampler(dataset.seqs, dataset.pose_indices, args.batch_size, block_size=block_size,
+                                            blocks_per_batch=args.blocks_per_batch, drop_last=True)
+        loader = DataLoader(dataset, batch_sampler=sampler, num_workers=args.num_workers)
+        label = 'block_size={} x {}'.format(block_size, args.blocks_per_batch)
+        print('{:>28}: {:8.1f} samples/s'.format(label, time_loader(loader, args.num_batches)))
@@ -0,0 +1,72 @@
+import os
+import glob
+import random
+import numpy as np
+import torch
+from artifact_writer import save_atomic
+
+#Resume checkpoints: model, optimizer, epoch, best validation metric, RNG states and sampler epoch, written at the end of
+#an epoch as checkpoint_dir/resume_epoch_{epoch}.pt (atomically, optionally through an ArtifactWriter). Only the latest
+#`keep` are kept. Separate from the best-model files, which only hold the model and its validation history.
+
+def rng_state():
+    #Plain python types / tensors only, so that the checkpoint also loads with torch.load(weights_only=True)
+    np_state = np.random.get_state()
+    state = {'torch': torch.get_rng_state(), 'numpy': (np_state[0], np_state[1].tolist()) + tuple(np_state[2:]), 'python': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def checkpoint_files(checkpoint_dir):
+    """Resume checkpoints in checkpoint_dir, oldest first"""
+    files = glob.glob(os.path.join(checkpoint_dir, 'resume_epoch_*.pt'))
+    return sorted(files, key=lambda f: int(os.path.basename(f)[len('resume_epoch_'):-len('.pt')]))
+
+def save_and_prune(state, path, keep):
+    save_atomic(state, path)
+    if keep > 0:
+        for old_file in checkpoint_files(os.path.dirname(path))[:-keep]:
+            #ArtifactWriter workers may prune for consecutive epochs at the same time
+            try:
+                os.remove(old_file)
+            except FileNotFoundError:
+                pass
+
+def save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch, best_metric, sampler=None, keep=2, writer=None):
+    """Saves the state after `epoch` epochs (training continues at this epoch index when resumed).
+    With a writer (artifact_writer.ArtifactWriter), the state is snapshotted and written in the background."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    state = {
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'epoch': epoch,
+        'best_metric': best_metric,
+        'rng': rng_state(),
+        'sampler_epoch': getattr(sampler, 'epoch', None),
+    }
+    path = os.path.join(checkpoint_dir, 'resume_epoch_{}.pt'.format(epoch))
+    if writer is None:
+        save_and_prune(state, path, keep)
+    else:
+        writer.submit(save_and_prune, state, path, keep)
+
+def load_resume_checkpoint(checkpoint_dir, model, optimizer, sampler=None, map_location='cpu'):
+    """Restores the latest resume checkpoint in checkpoint_dir. Returns (epoch, best_metric), or None if there is none."""
+    files = checkpoint_files(checkpoint_dir)
+    if len(files) == 0:
+        return None
+    state = torch.load(files[-1], map_location=map_location)
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    set_rng_state(state['rng'])
+    if sampler is not None and state['sampler_epoch'] is not None and hasattr(sampler, 'set_epoch'):
+        sampler.set_epoch(state['sampler_epoch'])
+    print('Resumed from {} (epoch {}).'.format(files[-1], state['epoch']))
+    return state['epoch'], state['best_metric']
@@ -0,0 +1,54 @@
+import numpy as np
+import torch
+import os
+import argparse
+import time
+from loaders import SevenScenesData, seven_scenes_store_paths
+from torch.utils.data import DataLoader
+import torchvision.transforms as transforms
+
+#One-time preprocessing: writes each 7-Scenes scene/split as a uint8 N x 3 x S x S memmap (resized and center cropped)
+#along with its poses, to be read by loaders.SevenScenesCachedData.
+
+def to_uint8_tensor(img):
+    return torch.from_numpy(np.array(img)).permute(2, 0, 1)
+
+def build_store(scene, data_path, store_path, train, crop_size=224, num_workers=8):
+    transform = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(crop_size),
+        to_uint8_tensor
+    ])
+    dataset = SevenScenesData(scene, data_path, train=train, transform=transform)
+    loader = DataLoader(dataset, batch_size=64, shuffle=False, num_workers=num_workers)
+
+    frames_file, poses_file = seven_scenes_store_paths(store_path, scene, train)
+    frames = np.lib.format.open_memmap(frames_file, mode='w+', dtype=np.uint8, shape=(len(dataset), 3, crop_size, crop_size))
+
+    idx = 0
+    for imgs, _ in loader:
+        frames[idx:idx + imgs.shape[0]] = imgs.numpy()
+        idx += imgs.shape[0]
+    frames.flush()
+    del frames
+
+    np.save(poses_file, dataset.poses.astype(np.float64))
+    print('Saved {} frames to {}.'.format(idx, frames_file))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='7-Scenes frame store builder.')
+    parser.add_argument('--data_path', type=str, default='/media/datasets/7scenes')
+    parser.add_argument('--store_path', type=str, default='7scenes/store')
+    parser.add_argument('--scenes', type=str, nargs='+', default=['chess', 'fire', 'heads', 'office', 'pumpkin', 'redkitchen', 'stairs'])
+    parser.add_argument('--crop_size', type=int, default=224, help='224 stores the final crop, 256 keeps room for random crops.')
+    parser.add_argument('--num_workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.store_path):
+        os.makedirs(args.store_path)
+
+    for scene in args.scenes:
+        for train in [True, False]:
+            start = time.time()
+            build_store(scene, args.data_path, args.store_path, train, args.crop_size, args.num_workers)
+            print('{} ({}) done in {:.1f} sec.'.format(scene, 'train' if train else 'test', time.time() - start))
@@ -0,0 +1,62 @@
+import os
+import torch
+import torch.distributed as dist
+
+#Data-parallel CPU training with the gloo backend. Scripts are launched with torchrun, e.g.:
+#torchrun --nproc_per_node 8 run_kitti_experiment.py --no_cuda
+#Every process pins itself to its own slice of the available cores, trains on a DistributedSampler shard, and
+#gradients are all-reduced by DistributedDataParallel. Validation, printing and checkpoints are done by rank 0.
+
+def setup_distributed(threads=None, pin_cores=True):
+    """Joins the process group described by the torchrun environment (single process if WORLD_SIZE is not set).
+      :param threads: intra-op threads per process (default: available cores / processes on this node)
+      :param pin_cores: restrict each process to its own contiguous slice of cores
+    Returns (rank, world_size)."""
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    rank = int(os.environ.get('RANK', 0))
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', world_size))
+
+    if world_size > 1:
+        cores = sorted(os.sched_getaffinity(0))
+        if threads is None:
+            threads = max(1, len(cores) // local_world_size)
+        if pin_cores and len(cores) >= threads*local_world_size:
+            os.sched_setaffinity(0, cores[local_rank*threads:(local_rank + 1)*threads])
+        dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    return rank, world_size
+
+def cleanup_distributed():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+def get_local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+def barrier():
+    """Waits for every process (e.g., while rank 0 validates and saves)"""
+    if dist.is_initialized():
+        dist.barrier()
+
+def wrap_model(model):
+    """DistributedDataParallel wrapper when running distributed (the unwrapped model is still used for validation and saving)"""
+    if not dist.is_initialized():
+        return model
+    return torch.nn.parallel.DistributedDataParallel(model)
+
+def all_reduce_sum(values):
+    """Sums a list of numbers over all processes"""
+    if not dist.is_initialized():
+        return values
+    t = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
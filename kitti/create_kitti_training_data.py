@@ -2,7 +2,8 @@ from pyslam.metrics import TrajectoryMetrics
 import pickle, csv, glob, os
 import random
 import numpy as np
-from liegroups.numpy import SE3
+from liegroups.numpy import SE3, SO3
+from create_kitti_training_data_single_memory import stack_poses, batch_relative_poses
 
 KITTI_SEQS_DICT = {'00': {'date': '2011_10_03',
                           'drive': '0027',
@@ -37,36 +38,31 @@ KITTI_SEQS_DICT = {'00': {'date': '2011_10_03',
 
 def compute_vo_pose_errors(tm, pose_deltas, eval_type='train', add_reverse=False):
     """Compute delta pose errors on VO estimates """
-    T_21_errs = []
+    T_w_gt = stack_poses(tm.Twv_gt)
+    T_w_est = stack_poses(tm.Twv_est)
     T_21_gts = []
     T_21_ests = []
 
     for p_delta in pose_deltas:
         if eval_type=='train':
-            pose_ids = range(len(tm.Twv_gt) - p_delta)
+            pose_ids = np.arange(len(T_w_gt) - p_delta)
         elif eval_type=='test':
-            pose_ids = range(0, len(tm.Twv_gt) - p_delta, p_delta)
-        for p_idx in pose_ids:
-            T_12_gt = tm.Twv_gt[p_idx].inv().dot(tm.Twv_gt[p_idx+p_delta])
-            T_12_est = tm.Twv_est[p_idx].inv().dot(tm.Twv_est[p_idx+p_delta])
-            T_12_corr = T_12_gt.dot(T_12_est.inv())
-            T_21_errs.append(T_12_corr.inv())
-            T_21_gts.append(T_12_gt.inv())
-            T_21_ests.append(T_12_est.inv())
+            pose_ids = np.arange(0, len(T_w_gt) - p_delta, p_delta)
+
+        T_21_gts.append(batch_relative_poses(T_w_gt[pose_ids], T_w_gt[pose_ids + p_delta]))
+        T_21_ests.append(batch_relative_poses(T_w_est[pose_ids], T_w_est[pose_ids + p_delta]))
 
         if add_reverse and eval_type=='train':
-            for p_idx in pose_ids:
-                T_12_gt = tm.Twv_gt[p_idx].inv().dot(tm.Twv_gt[p_idx+p_delta])
-                T_12_est = tm.Twv_est[p_idx].inv().dot(tm.Twv_est[p_idx+p_delta])
-                T_21_gt = T_12_gt.inv()
-                T_21_est = T_12_est.inv()
-                T_21_corr = T_21_gt.dot(T_21_est.inv())
-                T_21_errs.append(T_21_corr.inv())
-                T_21_gts.append(T_21_gt.inv())
-                T_21_ests.append(T_21_est.inv())
-
-
-    return (T_21_errs, T_21_gts, T_21_ests)
+            T_21_gts.append(batch_relative_poses(T_w_gt[pose_ids + p_delta], T_w_gt[pose_ids]))
+            T_21_ests.append(batch_relative_poses(T_w_est[pose_ids + p_delta], T_w_est[pose_ids]))
+
+    T_21_gts = np.concatenate(T_21_gts)
+    T_21_ests = np.concatenate(T_21_ests)
+    #Error transform: T_21_est^{-1} T_21_gt
+    T_21_errs = batch_relative_poses(T_21_gts, T_21_ests)
+
+    to_se3 = lambda T_stack: [SE3(SO3(T[:3, :3]), T[:3, 3]) for T in T_stack]
+    return (to_se3(T_21_errs), to_se3(T_21_gts), to_se3(T_21_ests))
 
 def get_image_paths(data_path, trial_str, pose_deltas, img_type='rgb', eval_type='train', add_reverse=False):
 
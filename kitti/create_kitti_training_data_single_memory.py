@@ -1,8 +1,12 @@
 from pyslam.metrics import TrajectoryMetrics
-import pickle, csv, glob, os
+import pickle, csv, glob, os, sys
+import argparse
 import random
 import numpy as np
 from liegroups.numpy import SE3
+from manifest import save_manifest, rotation_angles, manifest_filename, DATA_PATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from artifact_cache import ArtifactCache, report_plan
 
 KITTI_SEQS_DICT = {'00': {'date': '2011_10_03',
                           'drive': '0027',
@@ -35,47 +39,70 @@ KITTI_SEQS_DICT = {'00': {'date': '2011_10_03',
                           'drive': '0034',
                           'frames': range(0, 1201)}}
 
-def compute_vo_pose_errors(tm, pose_deltas, seq, eval_type='train', add_reverse=False, min_turning_angle=0.):
-    """Compute delta pose errors on VO estimates """
+def stack_poses(T_list):
+    """List of SE3 objects -> N x 4 x 4 array"""
+    return np.stack([T.as_matrix() for T in T_list])
+
+def batch_relative_poses(T_1, T_2):
+    """Computes T_2^{-1} T_1 for N x 4 x 4 stacks of poses"""
+    C_2_inv = T_2[:, :3, :3].transpose(0, 2, 1)
+    T_21 = np.zeros(T_1.shape)
+    T_21[:, :3, :3] = np.matmul(C_2_inv, T_1[:, :3, :3])
+    T_21[:, :3, 3] = np.matmul(C_2_inv, (T_1[:, :3, 3] - T_2[:, :3, 3])[:, :, None])[:, :, 0]
+    T_21[:, 3, 3] = 1.
+    return T_21
+
+def compute_vo_pose_errors(T_w_gt, T_w_est, pose_deltas, seq, eval_type='train', add_reverse=False, min_turning_angle=0.):
+    """Compute delta pose errors on VO estimates (T_w_gt and T_w_est are N x 4 x 4 stacks of poses)"""
     T_21_gts = []
     T_21_ests = []
     pair_pose_ids = []
-    seqs = []
-
 
     for p_delta in pose_deltas:
 
         if eval_type=='train':
-            pose_ids = range(len(tm.Twv_gt) - p_delta)
+            pose_ids = np.arange(len(T_w_gt) - p_delta)
         elif eval_type=='test':
-            pose_ids = range(0, len(tm.Twv_gt) - p_delta, p_delta)
+            pose_ids = np.arange(0, len(T_w_gt) - p_delta, p_delta)
 
         coin_flip = np.random.rand(len(pose_ids)) > 1
 
-        for i, p_idx in enumerate(pose_ids):
-            T_21_gt = tm.Twv_gt[p_idx + p_delta].inv().dot(tm.Twv_gt[p_idx])
-            T_21_est = tm.Twv_est[p_idx + p_delta].inv().dot(tm.Twv_est[p_idx])
+        T_21_gt = batch_relative_poses(T_w_gt[pose_ids], T_w_gt[pose_ids + p_delta])
+        T_21_est = batch_relative_poses(T_w_est[pose_ids], T_w_est[pose_ids + p_delta])
+
+        turning_angles = rotation_angles(T_21_gt)
+        keep = (turning_angles > min_turning_angle) | coin_flip | (eval_type == 'test')
 
-            turning_angle = np.linalg.norm(T_21_gt.rot.log())
-            if (turning_angle > min_turning_angle or coin_flip[i]) or eval_type == 'test':
-                T_21_gts.append(T_21_gt)
-                T_21_ests.append(T_21_est)
-                pair_pose_ids.append([p_idx, p_idx + p_delta])
-                seqs.append(seq)
+        T_21_gts.append(T_21_gt[keep])
+        T_21_ests.append(T_21_est[keep])
+        pair_pose_ids.append(np.stack((pose_ids, pose_ids + p_delta), axis=1)[keep])
 
         if add_reverse and eval_type=='train':
-            for i, p_idx in enumerate(pose_ids):
-                T_21_gt = tm.Twv_gt[p_idx].inv().dot(tm.Twv_gt[p_idx + p_delta])
-                T_21_est = tm.Twv_est[p_idx].inv().dot(tm.Twv_est[p_idx + p_delta])
+            keep = (turning_angles > min_turning_angle) | coin_flip
+            T_21_gts.append(batch_relative_poses(T_w_gt[pose_ids + p_delta], T_w_gt[pose_ids])[keep])
+            T_21_ests.append(batch_relative_poses(T_w_est[pose_ids + p_delta], T_w_est[pose_ids])[keep])
+            pair_pose_ids.append(np.stack((pose_ids + p_delta, pose_ids), axis=1)[keep])
+
+    pair_pose_ids = np.concatenate(pair_pose_ids)
+    seqs = [seq]*len(pair_pose_ids)
+
+    return (np.concatenate(T_21_gts), np.concatenate(T_21_ests), pair_pose_ids, seqs)
+
+_trajectory_cache = {}
 
-                turning_angle = np.linalg.norm(T_21_gt.rot.log())
-                if turning_angle > min_turning_angle or coin_flip[i]:
-                    T_21_gts.append(T_21_gt)
-                    T_21_ests.append(T_21_est)
-                    pair_pose_ids.append([p_idx + p_delta, p_idx])
-                    seqs.append(seq)
+def trajectory_file(tm_path, trial_str):
+    tm_mat_file = os.path.join(tm_path, KITTI_SEQS_DICT[trial_str]['date'] + '_drive_' + KITTI_SEQS_DICT[trial_str]['drive'] + '.mat')
+    if not os.path.isfile(tm_mat_file):
+        tm_mat_file = os.path.join(tm_path, trial_str + '.mat')
+    return tm_mat_file
 
-    return (T_21_gts, T_21_ests, pair_pose_ids, seqs)
+def load_trajectory(tm_path, trial_str):
+    """Loads the ground truth and VO poses of a trial as N x 4 x 4 arrays (cached, since every fold reuses them)"""
+    if (tm_path, trial_str) not in _trajectory_cache:
+        tm_mat_file = trajectory_file(tm_path, trial_str)
+        tm = TrajectoryMetrics.loadmat(tm_mat_file)
+        _trajectory_cache[(tm_path, trial_str)] = (stack_poses(tm.Twv_gt), stack_poses(tm.Twv_est), tm_mat_file)
+    return _trajectory_cache[(tm_path, trial_str)]
 
 def process_ground_truth(trial_strs, tm_path, pose_deltas, eval_type='train', add_reverse=False, min_turning_angle=0.):
     
@@ -87,29 +114,30 @@ def process_ground_truth(trial_strs, tm_path, pose_deltas, eval_type='train', ad
 
     for t_id, trial_str in enumerate(trial_strs):
 
-        tm_mat_file = os.path.join(tm_path, KITTI_SEQS_DICT[trial_str]['date'] + '_drive_' + KITTI_SEQS_DICT[trial_str]['drive'] + '.mat')
+        T_w_gt, T_w_est, tm_mat_file = load_trajectory(tm_path, trial_str)
 
-        try:
-            tm = TrajectoryMetrics.loadmat(tm_mat_file)
-        except FileNotFoundError:
-            tm_mat_file = os.path.join(tm_path, trial_str + '.mat')
-            tm = TrajectoryMetrics.loadmat(tm_mat_file)
+        (T_21_gt, T_21_est, pair_pose_ids, seqs) = compute_vo_pose_errors(T_w_gt, T_w_est, pose_deltas, trial_str, eval_type, add_reverse, min_turning_angle)
 
-
-        (T_21_gt, T_21_est, pair_pose_ids, seqs) = compute_vo_pose_errors(tm, pose_deltas, trial_str, eval_type, add_reverse, min_turning_angle)
-
-        T_21_gt_all.extend(T_21_gt)
-        T_21_est_all.extend(T_21_est)
-        pose_ids.extend(pair_pose_ids)
+        T_21_gt_all.append(T_21_gt)
+        T_21_est_all.append(T_21_est)
+        pose_ids.append(pair_pose_ids)
         sequences.extend(seqs)
         tm_mat_files.extend(tm_mat_file)
 
 
-    return (pose_ids, sequences, T_21_gt_all, T_21_est_all, tm_mat_files)
+    return (np.concatenate(pose_ids), sequences, np.concatenate(T_21_gt_all), np.concatenate(T_21_est_all), tm_mat_files)
 
 
 
-def main():
+def fold_artifact(data_path, tm_path, test_trial, train_trials, train_pose_deltas, test_pose_delta, add_reverse, min_turning_angle):
+    """(output file, input trajectory files, build parameters) of one leave-one-out dataset, for the artifact cache"""
+    data_filename = manifest_filename(test_trial, test_pose_delta, add_reverse, min_turning_angle, data_path)
+    inputs = [trajectory_file(tm_path, trial_str) for trial_str in train_trials + [test_trial]]
+    params = {'test_trial': test_trial, 'train_trials': train_trials, 'train_pose_deltas': train_pose_deltas,
+              'test_pose_delta': test_pose_delta, 'add_reverse': add_reverse, 'min_turning_angle': min_turning_angle}
+    return (data_filename, inputs, params)
+
+def main(args):
     # test_trials = ['00']    
     # val_trials = ['01']
     # train_trials = ['04', '02', '05', '06', '07', '08', '09', '10']
@@ -122,7 +150,10 @@ def main():
     train_pose_deltas = [1] #How far apart should each quad image be? (KITTI is at 10hz, can input multiple)
     test_pose_delta = 1
     add_reverse = True #Add reverse transformations
-    min_turning_angle = 0.02
+    #Training pairs that turn less than this (rad) are dropped (all of them: the coin flip in compute_vo_pose_errors never
+    #keeps one). With --unfiltered every pair is kept (min_turning_angle 0.) for samplers.TurningAngleSampler, which
+    #down-weights low-rotation pairs at train time instead. The _minta_ tag of the output file says which variant it is.
+    min_turning_angle = 0. if args.unfiltered else 0.02
 
     #Where is the KITTI data?
 
@@ -136,18 +167,23 @@ def main():
     #tm_path = '/media/raid5-array/experiments/Deep-PC/stereo_vo_results/baseline'
 
     #Where should we output the training files?
-    data_path = './datasets/obelisk'
+    data_path = DATA_PATH
 
     #custom_training = [[['09','10'],['00', '01', '02', '04', '05', '06', '07', '08']]]
 
-    for t_i, test_trial in enumerate(all_trials):
-        if t_i > 2:
-            break #Only produce trials for 00, 02 and 05
-
+    #Only produce trials for 00, 02 and 05
+    folds = [(test_trial, all_trials[:t_i] + all_trials[t_i+1:]) for t_i, test_trial in enumerate(all_trials[:3])]
 
-        train_trials = all_trials[:t_i] + all_trials[t_i+1:]
+    #Skip datasets whose trajectories and parameters have not changed
+    cache = ArtifactCache(force=args.force)
+    artifacts = [fold_artifact(data_path, tm_path, test_trial, train_trials, train_pose_deltas, test_pose_delta, add_reverse, min_turning_angle)
+                 for test_trial, train_trials in folds]
+    stale = report_plan(cache.plan(artifacts))
 
     #for test_trials, train_trials in custom_training:
+    for (test_trial, train_trials), artifact in zip(folds, artifacts):
+        if artifact[0] not in stale:
+            continue
 
         print('Processing.. Test: {}. Train: {}.'.format(test_trial, train_trials))
 
@@ -180,16 +216,20 @@ def main():
         kitti_data['test_tm_mat_paths'] = test_tm_mat_files
         kitti_data['test_pose_delta'] = test_pose_delta
 
-        data_filename = os.path.join(data_path, 'kitti_singlefile_data_sequence_{}_delta_{}_reverse_{}_minta_{}.pickle'.format(test_trial, test_pose_delta, add_reverse, min_turning_angle))
-        #data_filename = os.path.join(data_path, 'kitti_singlefile_data_sequence_0910_delta_{}_reverse_{}.pickle'.format(test_pose_delta, add_reverse))
+        data_filename = artifact[0]
+        #data_filename = os.path.join(data_path, 'kitti_singlefile_data_sequence_0910_delta_{}_reverse_{}.npz'.format(test_pose_delta, add_reverse))
 
         print('Saving to {} ....'.format(data_filename))
 
-        with open(data_filename, 'wb') as f:
-            pickle.dump(kitti_data, f, pickle.HIGHEST_PROTOCOL)
+        #Columnar manifest (old pickles can be converted with manifest.py)
+        save_manifest(kitti_data, data_filename)
+        cache.record(*artifact)
 
         print('Saved.')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Leave-one-out KITTI training manifests (see manifest.py).')
+    parser.add_argument('--unfiltered', action='store_true', default=False, help='Keep low-rotation training pairs (min_turning_angle 0., for samplers.TurningAngleSampler)')
+    parser.add_argument('--force', action='store_true', default=False, help='Rebuild manifests that are up to date')
+    main(parser.parse_args())
\ No newline at end of file
@@ -1,8 +1,15 @@
 import numpy as np
 import torch
-import pickle, csv, glob, os
+import pickle, csv, glob, os, sys
+import json
+import argparse
 import torchvision.transforms as transforms
 from PIL import Image
+import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from artifact_cache import ArtifactCache, report_plan
+from loaders import load_frame_store, gray_store_path, GRAY_STORE_BLUR
 
 KITTI_SEQS_DICT = {'00': {'date': '2011_10_03',
                           'drive': '0027',
@@ -76,7 +83,146 @@ def save_images(image_paths_rgb, transform, img_dims, file_name):
         #'im_r': right_image_data
     }, file_name)
 
-def main():
+def encode_image(img, codec='.png', quality=None):
+    """Encode a C x H x W RGB uint8 tensor into a flat uint8 array with OpenCV"""
+    params = []
+    if quality is not None:
+        if codec == '.jpg':
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif codec == '.webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    img_bgr = cv2.cvtColor(img.permute(1, 2, 0).numpy(), cv2.COLOR_RGB2BGR)
+    success, buf = cv2.imencode(codec, img_bgr, params)
+    if not success:
+        raise ValueError('Could not encode image with codec {}'.format(codec))
+    return buf.flatten()
+
+def save_images_compressed(image_paths_rgb, transform, img_dims, file_name, codec='.png', quality=None):
+    """Like save_images, but keeps every frame as an encoded blob in one byte buffer indexed by offsets.
+    Frames are decoded on access by loaders.CompressedFrames (i.e., inside the DataLoader workers)."""
+
+    num_images = len(image_paths_rgb[0])
+    blobs = []
+    offsets = np.zeros(num_images + 1, dtype=np.int64)
+
+    for idx, im_l in enumerate(image_paths_rgb[0]):
+        if idx%100==0:
+            print(idx)
+        buf = encode_image(read_and_transform(im_l, transform), codec, quality)
+        blobs.append(buf)
+        offsets[idx + 1] = offsets[idx] + len(buf)
+
+    raw_bytes = num_images * 3 * img_dims[0] * img_dims[1]
+    print('Encoded {} frames with {}: {:.1f} MB (raw: {:.1f} MB).'.format(num_images, codec, offsets[-1] / 1e6, raw_bytes / 1e6))
+
+    torch.save({
+        'im_l_blobs': torch.from_numpy(np.concatenate(blobs)),
+        'im_l_offsets': torch.from_numpy(offsets),
+        'codec': codec,
+        'img_dims': img_dims
+    }, file_name)
+
+def _fill_memmap_chunk(file_name, image_paths, start, transform):
+    """Worker: decodes and resizes a chunk of frames straight into their slots of the preallocated memmap"""
+    frames = np.load(file_name, mmap_mode='r+')
+    for i, img_path in enumerate(image_paths):
+        frames[start + i] = read_and_transform(img_path, transform).numpy()
+    frames.flush()
+    del frames
+    return file_name, start
+
+def progress_path(file_name):
+    return file_name + '.progress.npz'
+
+def save_progress(progress_file, done, shape, params):
+    """Finished chunks, plus the store shape and build parameters they were written with (replaced atomically)"""
+    np.savez(progress_file + '.tmp.npz', done=done, shape=np.array(shape, dtype=np.int64), params=np.array(params))
+    os.replace(progress_file + '.tmp.npz', progress_file)
+
+def load_progress(progress_file):
+    with np.load(progress_file, allow_pickle=False) as progress:
+        return progress['done'], tuple(progress['shape'].tolist()), str(progress['params'])
+
+def build_memmap_stores(seq_image_paths, transform, img_dims, file_names, num_workers=8, chunk_size=200, params=None):
+    """Writes the left images of several sequences into preallocated N x C x H x W uint8 .npy memmaps.
+    Chunks of all sequences are processed concurrently by a process pool. Finished chunks are recorded in a
+    <file_name>.progress.npz file (with the shape and params of the build), so an interrupted build resumes where it
+    stopped. Partial stores built with another shape or params are discarded."""
+
+    params = json.dumps(params or {}, sort_keys=True, default=str)
+    progress = {}
+    shapes = {}
+    tasks = []
+    for image_paths, file_name in zip(seq_image_paths, file_names):
+        progress_file = progress_path(file_name)
+        num_chunks = int(np.ceil(len(image_paths) / chunk_size))
+        shape = (len(image_paths), 3, img_dims[0], img_dims[1])
+
+        #Partial stores of older builds (.progress.npy, without shape and params) are rebuilt
+        if os.path.isfile(file_name + '.progress.npy'):
+            os.remove(file_name + '.progress.npy')
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+        if os.path.isfile(file_name) and not os.path.isfile(progress_file):
+            print('{} is complete, skipping.'.format(file_name))
+            continue
+
+        done = None
+        if os.path.isfile(progress_file):
+            done, progress_shape, progress_params = load_progress(progress_file)
+            if progress_shape != shape or progress_params != params or len(done) != num_chunks or not os.path.isfile(file_name):
+                print('Discarding partial {} (built with other parameters, or never allocated).'.format(file_name))
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+                done = None
+
+        if done is None:
+            #The progress file is written first: a store without one is taken to be complete
+            done = np.zeros(num_chunks, dtype=bool)
+            save_progress(progress_file, done, shape, params)
+            frames = np.lib.format.open_memmap(file_name, mode='w+', dtype=np.uint8, shape=shape)
+            del frames
+
+        progress[file_name] = done
+        shapes[file_name] = shape
+        print('{}: {} / {} chunks done.'.format(file_name, done.sum(), num_chunks))
+        for c in np.where(~done)[0]:
+            tasks.append((file_name, image_paths[c*chunk_size:(c+1)*chunk_size], c*chunk_size, transform))
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(_fill_memmap_chunk, *task) for task in tasks]
+        for future in as_completed(futures):
+            file_name, start = future.result()
+            progress_file = progress_path(file_name)
+            progress[file_name][start // chunk_size] = True
+
+            #Progress is only written by this process
+            save_progress(progress_file, progress[file_name], shapes[file_name], params)
+
+            if progress[file_name].all():
+                os.remove(progress_file)
+                print('Finished {}.'.format(file_name))
+
+def save_gray_variants(file_name, variants):
+    """Writes single-channel N x H x W uint8 .npy variants of a finished frame store (see loaders.GRAY_STORE_BLUR),
+    so that the flow datasets skip the per-sample colour conversion (and blur)."""
+    frames = load_frame_store(file_name)
+    img_dims = frames[0].shape[1:]
+    outputs = {variant: np.lib.format.open_memmap(gray_store_path(file_name, variant), mode='w+', dtype=np.uint8, shape=(len(frames), img_dims[0], img_dims[1]))
+               for variant in variants}
+
+    for idx in range(len(frames)):
+        gray = cv2.cvtColor(frames[idx].permute(1, 2, 0).numpy(), cv2.COLOR_RGB2GRAY)
+        for variant, out in outputs.items():
+            ksize = GRAY_STORE_BLUR[variant]
+            out[idx] = gray if ksize is None else cv2.GaussianBlur(gray, ksize, 0)
+
+    for variant, out in outputs.items():
+        out.flush()
+        print('Saved {}.'.format(gray_store_path(file_name, variant)))
+
+def main(args):
     # Obelisk
     kitti_path = '/media/datasets/KITTI/raw'
     trial_strs = ['01', '04','00','02','05','06', '07', '08', '09', '10']
@@ -90,15 +236,74 @@ def main():
         #                       std=[0.229, 0.224, 0.225])
     ])
 
-    for t_id, trial_str in enumerate(trial_strs):
+    #None stores raw uint8 tensors. Otherwise an OpenCV codec ('.png' is lossless, '.webp' / '.jpg' are lossy with the given quality)
+    codec = None
+    quality = None
 
+    #Build all sequences as .npy memmaps with a resumable process pool (read with seq_ext='.npy' in the loaders)
+    use_memmap = False
+
+    #Single-channel variants for the flow path, written next to each store (read with gray_store=... in the loaders)
+    gray_variants = ['gray', 'gray_blur']
+
+    img_dims = [120, 400]
+    if use_memmap:
+        file_pattern = 'data/seq_noncropped_{}.npy'
+    elif codec is None:
+        file_pattern = 'data/seq_noncropped_{}.pt'
+    else:
+        file_pattern = 'data/seq_compressed_{}.pt'
+
+    seq_image_paths = {}
+    artifacts = []
+    params = {'img_dims': img_dims, 'codec': codec, 'quality': quality, 'memmap': use_memmap}
+    for trial_str in trial_strs:
         drive_folder = KITTI_SEQS_DICT[trial_str]['date'] + '_drive_' + KITTI_SEQS_DICT[trial_str]['drive'] + '_sync'
         data_path = os.path.join(kitti_path, KITTI_SEQS_DICT[trial_str]['date'], drive_folder)
+        seq_image_paths[trial_str] = get_image_paths(data_path, trial_str, 'rgb')
+
+        #Raw images are fingerprinted by size and mtime only
+        artifacts.append((file_pattern.format(trial_str), seq_image_paths[trial_str][0], params, False))
+
+    #Gray variants depend on the RGB store they are converted from
+    gray_artifacts = [(gray_store_path(artifact[0], variant), [artifact[0]], {'variant': variant, 'blur': GRAY_STORE_BLUR[variant]}, False)
+                      for artifact in artifacts for variant in gray_variants]
+
+    #Skip frame stores whose images and parameters have not changed
+    cache = ArtifactCache(force=args.force)
+    stale = report_plan(cache.plan(artifacts))
+    trial_strs = [trial_str for trial_str, artifact in zip(trial_strs, artifacts) if artifact[0] in stale]
+    stale_artifacts = [artifact for artifact in artifacts if artifact[0] in stale]
+
+    if use_memmap:
+        for file_name, _, _, _ in stale_artifacts:
+            #Complete but outdated stores are rebuilt from scratch; partial ones resume if their shape and params match
+            if os.path.isfile(file_name) and not os.path.isfile(progress_path(file_name)):
+                os.remove(file_name)
+        build_memmap_stores([seq_image_paths[trial_str][0] for trial_str in trial_strs], transform, img_dims, [a[0] for a in stale_artifacts], params=params)
+        for artifact in stale_artifacts:
+            cache.record(*artifact)
+    else:
+        for trial_str, artifact in zip(trial_strs, stale_artifacts):
+            file_name = artifact[0]
+            if codec is None:
+                save_images(seq_image_paths[trial_str], transform, img_dims, file_name)
+            else:
+                save_images_compressed(seq_image_paths[trial_str], transform, img_dims, file_name, codec, quality)
+            cache.record(*artifact)
 
-        image_paths_rgb = get_image_paths(data_path, trial_str, 'rgb')
-        file_name = 'data/seq_noncropped_{}.pt'.format(trial_str)
-        save_images(image_paths_rgb, transform, [120, 400], file_name)
+    if len(gray_artifacts) > 0:
+        stale_gray = report_plan(cache.plan(gray_artifacts))
+        for artifact in artifacts:
+            variants = [variant for variant in gray_variants if gray_store_path(artifact[0], variant) in stale_gray]
+            if len(variants) > 0:
+                save_gray_variants(artifact[0], variants)
+        for artifact in gray_artifacts:
+            if artifact[0] in stale_gray:
+                cache.record(*artifact)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='KITTI frame stores (and their grayscale variants) for the loaders.')
+    parser.add_argument('--force', action='store_true', default=False, help='Rebuild stores that are up to date')
+    main(parser.parse_args())
\ No newline at end of file
@@ -10,19 +10,35 @@ import matplotlib.pyplot as plt
 import scipy.io as sio
 import math
 import sys
-sys.path.insert(0,'..')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from models import *
 from loss import *
 import time, sys
 import argparse
 import datetime
 from train_test import *
-from loaders import KITTIVODatasetPreTransformed
+from loaders import KITTIVODatasetPreTransformed, gray_store_path
 from torch.utils.data import Dataset, DataLoader
 from vis import *
+from artifact_cache import ArtifactCache, report_plan
+from manifest import manifest_filename
 import torchvision.transforms as transforms
 
 
+#Frame stores read by the test loaders
+SEQS_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SEQ_PREFIX = 'seq_'
+#Preconverted grayscale store for the flow input ('gray', or 'gray_blur' with apply_blur), None converts the RGB frames
+GRAY_STORE = None
+
+def frame_store_file(seq):
+    """File the test loaders read the frames of seq from"""
+    file_path = os.path.join(SEQS_BASE_PATH, SEQ_PREFIX + seq + '.pt')
+    return file_path if GRAY_STORE is None else gray_store_path(file_path, GRAY_STORE)
+
+def hydranet_output_file(seq):
+    return 'fusion/hydranet_output_reverse_model_seq_{}.pt'.format(seq)
+
 def run_so3_hydranet(trained_file_path, seq, kitti_data_file=None):
     # Float or Double?
     tensor_type = torch.float
@@ -45,18 +61,19 @@ def run_so3_hydranet(trained_file_path, seq, kitti_data_file=None):
     # ])
 
     apply_blur = False
-    seqs_base_path = './data'
-    seq_prefix = 'seq_'
+    gray_store = GRAY_STORE
+    seqs_base_path = SEQS_BASE_PATH
+    seq_prefix = SEQ_PREFIX
     kitti_data_pickle_file = kitti_data_file
     transform = None
 
     test_loader = DataLoader(KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform,
-                                                          run_type='test', apply_blur=apply_blur, seq_prefix=seq_prefix, use_only_seq=seq),
+                                                          run_type='test', apply_blur=apply_blur, seq_prefix=seq_prefix, use_only_seq=seq, gray_store=gray_store),
                               batch_size=batch_size, pin_memory=False,
                               shuffle=False, num_workers=4, drop_last=False)
 
     test_loader_reverse = DataLoader(KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform,
-                                                                  run_type='test', apply_blur=apply_blur,seq_prefix=seq_prefix, reverse_images=True, use_only_seq=seq),
+                                                                  run_type='test', apply_blur=apply_blur,seq_prefix=seq_prefix, reverse_images=True, use_only_seq=seq, gray_store=gray_store),
                               batch_size=batch_size, pin_memory=False,
                               shuffle=False, num_workers=0, drop_last=False)
 
@@ -91,7 +108,7 @@ def run_so3_hydranet(trained_file_path, seq, kitti_data_file=None):
     Sigma_21 = predict_history[2]
     Sigma_12 = predict_history_reverse[2]
 
-    file_name = 'fusion/hydranet_output_reverse_model_seq_{}.pt'.format(seq)
+    file_name = hydranet_output_file(seq)
     print('Outputting: {}'.format(file_name))
     torch.save({
         'Rot_21': C_21,
@@ -103,6 +120,9 @@ def run_so3_hydranet(trained_file_path, seq, kitti_data_file=None):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HydraNet rotation estimates of the test sequences, for the fusion scripts.')
+    parser.add_argument('--force', action='store_true', default=False, help='Recompute outputs that are up to date')
+    args = parser.parse_args()
     #Reproducibility
     #torch.manual_seed(7)
     #random.seed(72)
@@ -120,7 +140,18 @@ if __name__ == '__main__':
     # trained_models_paths = ['best_model_seq_0910_delta_1_heads_25_epoch_18.pt',
     #                         'best_model_seq_0910_delta_1_heads_25_epoch_18.pt']
 
+    #Skip outputs whose model, dataset manifest and frame store have not changed
+    cache = ArtifactCache(force=args.force)
+    artifacts = []
     for model_path, seq in zip(trained_models_paths, seqs):
-        kitti_data_file = 'datasets/obelisk/kitti_singlefile_data_sequence_{}_delta_1_reverse_True.pickle'.format(seq)
+        kitti_data_file = manifest_filename(seq)
+        artifacts.append((hydranet_output_file(seq), [base_path + model_path, kitti_data_file, frame_store_file(seq)], {'seq': seq, 'gray_store': GRAY_STORE}))
+    stale = report_plan(cache.plan(artifacts))
+
+    for model_path, seq, artifact in zip(trained_models_paths, seqs, artifacts):
+        if artifact[0] not in stale:
+            continue
+        kitti_data_file = artifact[1][1]
         run_so3_hydranet(base_path + model_path, seq, kitti_data_file=kitti_data_file)
+        cache.record(*artifact)
 
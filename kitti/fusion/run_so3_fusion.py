@@ -11,15 +11,18 @@ from pyslam.visualizers import TrajectoryVisualizer
 
 import copy
 import time
-import os, glob
+import os, glob, sys
 import pickle
 import csv
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from artifact_cache import ArtifactCache
 
 import argparse
 
 parser = argparse.ArgumentParser(description='SO(3) Fusion')
 parser.add_argument('--seq', '-s', default='00', type=str,
                     help='which sequence to test')
+parser.add_argument('--force', action='store_true', default=False, help='Rerun fusions that are up to date')
 
 
 def run_fusion(baseline_metrics_file, hydranet_output_file, add_reverse_factor):
@@ -95,7 +98,7 @@ def make_segment_err_plot(tm, segs, outfile=None):
     return f, ax
 
 
-def main():
+def main(args):
     # Odometry sequences
     # Nr.     Sequence name     Start   End
     # ---------------------------------------
@@ -145,6 +148,8 @@ def main():
     process_seqs = {'00', '02', '05'}
     add_reverse_factor = False
 
+    cache = ArtifactCache(force=args.force)
+
     for seq in process_seqs:
         tm_path = '../svo/baseline_tm/'
         fusion_tm_output_path = 'fusion_tms/'
@@ -153,6 +158,12 @@ def main():
         fusion_metrics_file = os.path.join(fusion_tm_output_path, 'SO3_fused_single_{}_drive_{}.mat'.format(seqs[seq]['date'], seqs[seq]['drive']))
         orig_metrics_file = os.path.join(tm_path, '{}_drive_{}.mat'.format(seqs[seq]['date'],seqs[seq]['drive']))
 
+        #Skip fusion if the VO trajectory, the hydranet outputs and the parameters have not changed
+        artifact = (fusion_metrics_file, [orig_metrics_file, hydranet_output_file], {'add_reverse_factor': add_reverse_factor})
+        if cache.is_fresh(*artifact):
+            print('{} is up to date, skipping.'.format(fusion_metrics_file))
+            continue
+
 
         tm_baseline = TrajectoryMetrics.loadmat(orig_metrics_file)
         tm_fusion = run_fusion(orig_metrics_file, hydranet_output_file, add_reverse_factor)
@@ -173,6 +184,7 @@ def main():
         # # Save to file
         print('Saving to {}'.format(fusion_metrics_file))
         tm_fusion.savemat(fusion_metrics_file)
+        cache.record(*artifact)
 
     # tm_dict = {'VO Only': tm_baseline, 'Fusion': tm_fusion}
     # vis = TrajectoryVisualizer(tm_dict)
@@ -189,6 +201,7 @@ if __name__ == '__main__':
     # s = pstats.Stats("{}.profile".format(__file__))
     # s.strip_dirs()
     # s.sort_stats("cumtime").print_stats(25)
+    args = parser.parse_args()
     np.random.seed(14)
-    main()
+    main(args)
 
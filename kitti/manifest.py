@@ -0,0 +1,92 @@
+import numpy as np
+import pickle, os, sys
+import time
+
+#Columnar KITTI dataset manifest: one uncompressed .npz holding, for each of the 'train' and 'test' splits,
+#   {split}_seqs          N      sequence codes ('00', '02', ...)
+#   {split}_pose_indices  N x 2  int32 frame indices of each image pair
+#   {split}_T_21_gt       N x 4 x 4 float64
+#   {split}_T_21_vo       N x 4 x 4 float64
+#   {split}_turning_angles N     rotation angle (rad) of T_21_gt
+#   {split}_directions    N      int8, +1 for forward pairs and -1 for reverse pairs
+#plus the pose deltas and trajectory file paths. Loading needs no unpickling, and selecting a sequence is a boolean mask.
+#The turning angles and directions drive samplers.TurningAngleSampler; they are filled in for older manifests and pickles on load.
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets', 'obelisk')
+POSE_KEYS = ['T_21_gt', 'T_21_vo']
+PAIR_KEYS = ['seqs', 'pose_indices', 'turning_angles', 'directions'] + POSE_KEYS
+
+def rotation_angles(T):
+    """Rotation angles (norm of the SO(3) log) of N x 4 x 4 poses"""
+    cos_angle = 0.5*(np.trace(T[:, :3, :3], axis1=1, axis2=2) - 1.)
+    return np.arccos(np.clip(cos_angle, -1., 1.))
+
+def add_pair_stats(kitti_data):
+    """Adds {split}_turning_angles and {split}_directions where they are missing"""
+    for split in ['train', 'test']:
+        if split + '_T_21_gt' not in kitti_data:
+            continue
+        if split + '_turning_angles' not in kitti_data:
+            kitti_data[split + '_turning_angles'] = rotation_angles(kitti_data[split + '_T_21_gt'])
+        if split + '_directions' not in kitti_data:
+            pose_indices = kitti_data[split + '_pose_indices']
+            kitti_data[split + '_directions'] = np.where(pose_indices[:, 1] > pose_indices[:, 0], 1, -1).astype(np.int8)
+    return kitti_data
+
+def to_columnar(kitti_data):
+    """Converts a kitti_singlefile_*.pickle dictionary (lists of liegroups SE3 objects) into numpy arrays"""
+    columnar = {}
+    for key, value in kitti_data.items():
+        if any([key.endswith(k) for k in POSE_KEYS]):
+            if len(value) > 0 and hasattr(value[0], 'as_matrix'):
+                value = [T.as_matrix() for T in value]
+            columnar[key] = np.asarray(value, dtype=np.float64).reshape(-1, 4, 4)
+        elif key.endswith('pose_indices'):
+            columnar[key] = np.asarray(value, dtype=np.int32).reshape(-1, 2)
+        elif key.endswith('seqs') or key.endswith('tm_mat_paths'):
+            columnar[key] = np.asarray(value, dtype=str)
+        else:
+            columnar[key] = np.asarray(value)
+    return add_pair_stats(columnar)
+
+def manifest_filename(test_trial, pose_delta=1, add_reverse=True, min_turning_angle=0.02, data_path=DATA_PATH):
+    """Manifest written by create_kitti_training_data_single_memory.py for the fold that tests on test_trial
+    (min_turning_angle 0. is the unfiltered manifest for samplers.TurningAngleSampler)"""
+    return os.path.join(data_path, 'kitti_singlefile_data_sequence_{}_delta_{}_reverse_{}_minta_{}.npz'.format(
+        test_trial, pose_delta, add_reverse, float(min_turning_angle)))
+
+def save_manifest(kitti_data, filename):
+    np.savez(filename, **to_columnar(kitti_data))
+
+def load_manifest(filename):
+    with np.load(filename, allow_pickle=False) as manifest:
+        kitti_data = {key: manifest[key] for key in manifest.files}
+    #Scalars (e.g., test_pose_delta) are stored as 0-d arrays
+    for key, value in kitti_data.items():
+        if value.ndim == 0:
+            kitti_data[key] = value.item()
+    return add_pair_stats(kitti_data)
+
+def select_seq(kitti_data, split, seq):
+    """Keeps only the pairs of split ('train' or 'test') that belong to sequence seq"""
+    mask = kitti_data[split + '_seqs'] == seq
+    for key in PAIR_KEYS:
+        kitti_data[split + '_' + key] = kitti_data[split + '_' + key][mask]
+    return kitti_data
+
+def convert_pickle_to_manifest(pickle_file, manifest_file=None):
+    if manifest_file is None:
+        manifest_file = os.path.splitext(pickle_file)[0] + '.npz'
+    with open(pickle_file, 'rb') as handle:
+        kitti_data = pickle.load(handle)
+    save_manifest(kitti_data, manifest_file)
+    return manifest_file
+
+
+if __name__ == '__main__':
+    #Usage: python manifest.py kitti_singlefile_data_sequence_00_delta_1_reverse_True.pickle [...]
+    for pickle_file in sys.argv[1:]:
+        manifest_file = convert_pickle_to_manifest(pickle_file)
+        start = time.perf_counter()
+        load_manifest(manifest_file)
+        print('Converted {} -> {} (loads in {:.1f} ms).'.format(pickle_file, manifest_file, 1e3*(time.perf_counter() - start)))
@@ -7,20 +7,22 @@ from pyslam.sensors import StereoCamera
 from pyslam.utils import invsqrt
 from pyslam.metrics import TrajectoryMetrics
 from sparse_stereo_vo_pipeline import SparseStereoPipeline, SparseStereoPipelineParams
-from optparse import OptionParser
+import argparse
 
 import copy
 import time
-import os
+import os, glob, sys
 import pickle
 import csv
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from artifact_cache import ArtifactCache
 
 import collections
 from pyslam.visualizers import TrajectoryVisualizer
 
 
 
-def run_sparse_vo(basedir, date, drive, im_range, metrics_filename=None, saved_tracks_filename=None, apply_blur=False):
+def run_sparse_vo(basedir, date, drive, im_range, metrics_filename=None, saved_tracks_filename=None, apply_blur=False, ransac_adaptive=False):
 
     #Observation Noise
     obs_var = [1, 1, 2]  # [u,v,d]
@@ -70,6 +72,7 @@ def run_sparse_vo(basedir, date, drive, im_range, metrics_filename=None, saved_t
     pipeline_params.dataset_date_drive = date + '_' + drive
     pipeline_params.saved_stereo_tracks_file = saved_tracks_filename
     pipeline_params.apply_gaussian_blur = apply_blur #Use to make estimates worse
+    pipeline_params.ransac_adaptive = ransac_adaptive
 
     svo = SparseStereoPipeline(pipeline_params)
     
@@ -88,7 +91,7 @@ def run_sparse_vo(basedir, date, drive, im_range, metrics_filename=None, saved_t
 
 
 
-def main():
+def main(args):
     # Odometry sequences
     # Nr.     Sequence name     Start   End
     # ---------------------------------------
@@ -150,6 +153,7 @@ def main():
     compute_seqs = ['05']#, '06', '07', '08', '09', '10']
     #compute_seqs = ['06']
     apply_blur = False
+    cache = ArtifactCache(force=args.force)
     for seq in compute_seqs:
 
         date = seqs[seq]['date']
@@ -161,13 +165,25 @@ def main():
             metrics_filename = os.path.join(export_dir, date + '_drive_' + drive + '_gaussian_blur.mat')
         else:
             metrics_filename = os.path.join(export_dir, date + '_drive_' + drive + '.mat')
+        #Adaptive RANSAC changes the trajectory, so it is kept apart from the baseline metrics
+        if args.ransac_adaptive:
+            metrics_filename = metrics_filename.replace('.mat', '_adaptive_ransac.mat')
 
         if saved_tracks_dir is None:
             saved_tracks_filename = None
         else:
             saved_tracks_filename = os.path.join(saved_tracks_dir, '{}_{}_frames_{}-{}_saved_tracks.pickle'.format(date, drive, frames[0], frames[-1]))
-        
-        tm = run_sparse_vo(kitti_basedir, date, drive, frames, metrics_filename, saved_tracks_filename, apply_blur=apply_blur)
+
+        #Skip sequences whose images (fingerprinted by size and mtime) and parameters have not changed
+        drive_dir = os.path.join(kitti_basedir, date, date + '_drive_' + drive + '_sync')
+        images = sorted(glob.glob(os.path.join(drive_dir, 'image_0[01]', 'data', '*.png')))
+        artifact = (metrics_filename, images, {'frames': [frames[0], frames[-1]], 'apply_blur': apply_blur, 'saved_tracks': saved_tracks_filename, 'ransac_adaptive': args.ransac_adaptive}, False)
+        if cache.is_fresh(*artifact):
+            print('{} is up to date, skipping.'.format(metrics_filename))
+            continue
+
+        tm = run_sparse_vo(kitti_basedir, date, drive, frames, metrics_filename, saved_tracks_filename, apply_blur=apply_blur, ransac_adaptive=args.ransac_adaptive)
+        cache.record(*artifact)
 
         # # Compute errors
         trans_err_norm, rot_err_norm = tm.mean_err(error_type='rel', rot_unit='deg')
@@ -193,6 +209,10 @@ if __name__ == '__main__':
     # s = pstats.Stats("{}.profile".format(__file__))
     # s.strip_dirs()
     # s.sort_stats("cumtime").print_stats(25)
+    parser = argparse.ArgumentParser(description='Sparse stereo VO on the KITTI odometry sequences.')
+    parser.add_argument('--ransac_adaptive', action='store_true', default=False, help='Stop RANSAC early once an all-inlier minimal set has been drawn with 99.9%% confidence (see outlier_rejection.FrameToFrameRANSAC)')
+    parser.add_argument('--force', action='store_true', default=False, help='Rerun sequences whose trajectory metrics are up to date')
+    args = parser.parse_args()
     np.random.seed(14)
-    main()
+    main(args)
 
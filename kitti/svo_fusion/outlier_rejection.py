@@ -91,57 +91,74 @@ def compute_ransac_cost_fast(T_21, pts_1, stereo_obs_2, cam_params, inlier_thres
 
 
 class FrameToFrameRANSAC(object):
-    def __init__(self, camera):
+    def __init__(self, camera, adaptive=False, confidence=0.999, chunk_size=50):
+        """
+          :param adaptive: evaluate the hypotheses in chunks of chunk_size and stop once an all-inlier minimal set has been
+                           drawn with probability confidence, given the best inlier ratio so far (ransac_iters is the cap)
+        """
         self.camera = camera
         self.ransac_iters = 400
         self.ransac_thresh = 5 #(1**2 + 1**2 + 1**2)
         self.num_min_set_pts = 3 
+        self.adaptive = adaptive
+        self.confidence = confidence
+        self.chunk_size = chunk_size
 
 
     def perform_ransac(self):
         """Main RANSAC Routine"""
-        max_inliers = 0
+        max_inliers = -1
 
         # Select random ids for minimal sets
         rand_ids = np.random.randint(self.num_pts, size=(self.ransac_iters, self.num_min_set_pts))
 
-        pts_1_sample_stacked = np.empty([self.ransac_iters, self.num_min_set_pts, 3])
-        pts_2_sample_stacked = np.empty([self.ransac_iters, self.num_min_set_pts, 3])
-        for ransac_i in range(self.ransac_iters):
-            pts_1_sample, pts_2_sample = self.pts_1[rand_ids[ransac_i]], self.pts_2[rand_ids[ransac_i]]
-            pts_1_sample_stacked[ransac_i, :, :] = pts_1_sample
-            pts_2_sample_stacked[ransac_i, :, :] = pts_2_sample
-
-        #Parallel transform computation  
-        #Compute transforms in parallel
-        #start = time.perf_counter()
-        T_21_stacked = compute_transform_fast(pts_1_sample_stacked, pts_2_sample_stacked, SE3_SHAPE)
-        #end = time.perf_counter()
-        #print('comp, transform | {}'.format(end - start))
-         
         cam_params = self.camera.cu, self.camera.cv, self.camera.fu, self.camera.fv, self.camera.b
         inlier_thresh = self.ransac_thresh
 
-        #Parallel cost computation        
-        #start = time.perf_counter()
-        inlier_masks_stacked = compute_ransac_cost_fast(T_21_stacked, self.pts_1, self.stereo_obs_2, cam_params, inlier_thresh)
-        #end = time.perf_counter()
-        #print('comp, masks | {}'.format(end - start))
-
-        #start = time.perf_counter()
-        inlier_nums = np.sum(inlier_masks_stacked, axis=1)
-        most_inliers_idx = np.argmax(inlier_nums)
-        T_21_best = SE3.from_matrix(T_21_stacked[most_inliers_idx, :, :])
-        max_inliers = inlier_nums[most_inliers_idx]
-        inlier_indices_best = np.where(inlier_masks_stacked[most_inliers_idx, :])[0]
-        #end = time.perf_counter()
-        #print('comp, rest | {}'.format(end - start))
+        #Without adaptive termination, all hypotheses form a single chunk
+        chunk_size = self.chunk_size if self.adaptive else self.ransac_iters
+        for chunk_start in range(0, self.ransac_iters, chunk_size):
+            chunk_ids = rand_ids[chunk_start:chunk_start + chunk_size]
+
+            #Minimal sets (iters x num_min_set_pts x 3) by fancy indexing
+            pts_1_sample_stacked = self.pts_1[chunk_ids]
+            pts_2_sample_stacked = self.pts_2[chunk_ids]
+
+            #Parallel transform computation  
+            #Compute transforms in parallel
+            #start = time.perf_counter()
+            T_21_stacked = compute_transform_fast(pts_1_sample_stacked, pts_2_sample_stacked, SE3_SHAPE)
+            #end = time.perf_counter()
+            #print('comp, transform | {}'.format(end - start))
+
+            #Parallel cost computation        
+            #start = time.perf_counter()
+            inlier_masks_stacked = compute_ransac_cost_fast(T_21_stacked, self.pts_1, self.stereo_obs_2, cam_params, inlier_thresh)
+            #end = time.perf_counter()
+            #print('comp, masks | {}'.format(end - start))
+
+            #The first hypothesis with the most inliers wins (as with a single argmax over all of them)
+            inlier_nums = np.sum(inlier_masks_stacked, axis=1)
+            most_inliers_idx = np.argmax(inlier_nums)
+            if inlier_nums[most_inliers_idx] > max_inliers:
+                max_inliers = inlier_nums[most_inliers_idx]
+                T_21_best_matrix = T_21_stacked[most_inliers_idx, :, :]
+                inlier_mask_best = inlier_masks_stacked[most_inliers_idx, :]
+
+            #Standard termination bound: P(at least one all-inlier minimal set) = 1 - (1 - w^3)^k
+            self.num_hypotheses = chunk_start + len(chunk_ids)
+            inlier_ratio = max_inliers / self.num_pts
+            if self.adaptive and 1. - (1. - inlier_ratio**self.num_min_set_pts)**self.num_hypotheses >= self.confidence:
+                break
+
+        T_21_best = SE3.from_matrix(T_21_best_matrix)
+        inlier_indices_best = np.where(inlier_mask_best)[0]
 
 
         if max_inliers < 5:
             raise ValueError(" RANSAC failed to find more than 5 inliers. Try adjusting the thresholds.")
 
-        #print('After {} RANSAC iters, found best transform with {} / {} inliers.'.format(self.ransac_iters, max_inliers, self.num_pts))
+        #print('After {} RANSAC iters, found best transform with {} / {} inliers.'.format(self.num_hypotheses, max_inliers, self.num_pts))
 
         stereo_obs_1_inliers = self.stereo_obs_1[inlier_indices_best]
         stereo_obs_2_inliers = self.stereo_obs_2[inlier_indices_best]
@@ -7,7 +7,7 @@ from pyslam.sensors import StereoCamera
 from pyslam.utils import invsqrt
 from pyslam.metrics import TrajectoryMetrics
 from sparse_stereo_vo_pipeline import SparseStereoPipeline, SparseStereoPipelineParams
-from optparse import OptionParser
+import argparse
 
 import copy
 import time
@@ -20,7 +20,7 @@ from pyslam.visualizers import TrajectoryVisualizer
 
 
 
-def run_sparse_vo(basedir, date, drive, im_range, hydranet_output_file, metrics_filename=None, saved_tracks_filename=None, apply_blur=False):
+def run_sparse_vo(basedir, date, drive, im_range, hydranet_output_file, metrics_filename=None, saved_tracks_filename=None, apply_blur=False, ransac_adaptive=False):
 
     #Observation Noise
     obs_var = [1, 1, 2]  # [u,v,d]
@@ -70,6 +70,7 @@ def run_sparse_vo(basedir, date, drive, im_range, hydranet_output_file, metrics_
     pipeline_params.dataset_date_drive = date + '_' + drive
     pipeline_params.saved_stereo_tracks_file = saved_tracks_filename
     pipeline_params.apply_gaussian_blur = False #Use to make estimates worse
+    pipeline_params.ransac_adaptive = ransac_adaptive
 
     svo = SparseStereoPipeline(hydranet_output_file, pipeline_params)
     
@@ -88,7 +89,7 @@ def run_sparse_vo(basedir, date, drive, im_range, hydranet_output_file, metrics_
 
 
 
-def main():
+def main(args):
     # Odometry sequences
     # Nr.     Sequence name     Start   End
     # ---------------------------------------
@@ -163,6 +164,9 @@ def main():
 
         print('Odometry sequence {} | {} {}'.format(seq, date, drive))
         metrics_filename = os.path.join(export_dir, date + '_drive_' + drive + '.mat')
+        #Adaptive RANSAC changes the trajectory, so it is kept apart from the default metrics
+        if args.ransac_adaptive:
+            metrics_filename = metrics_filename.replace('.mat', '_adaptive_ransac.mat')
 
         if saved_tracks_dir is None:
             saved_tracks_filename = None
@@ -170,7 +174,7 @@ def main():
             saved_tracks_filename = os.path.join(saved_tracks_dir, '{}_{}_frames_{}-{}_saved_tracks.pickle'.format(date, drive, frames[0], frames[-1]))
 
 
-        tm_fusion = run_sparse_vo(kitti_basedir, date, drive, frames, hydranet_output_file, metrics_filename, saved_tracks_filename, apply_blur=apply_blur)
+        tm_fusion = run_sparse_vo(kitti_basedir, date, drive, frames, hydranet_output_file, metrics_filename, saved_tracks_filename, apply_blur=apply_blur, ransac_adaptive=args.ransac_adaptive)
 
         tm_path = '../svo/baseline_tm/'
         orig_metrics_file = os.path.join(tm_path, '{}_drive_{}.mat'.format(seqs[seq]['date'], seqs[seq]['drive']))
@@ -213,6 +217,9 @@ if __name__ == '__main__':
     # s = pstats.Stats("{}.profile".format(__file__))
     # s.strip_dirs()
     # s.sort_stats("cumtime").print_stats(25)
+    parser = argparse.ArgumentParser(description='Sparse stereo VO fused with the HydraNet rotation estimates on the KITTI odometry sequences.')
+    parser.add_argument('--ransac_adaptive', action='store_true', default=False, help='Stop RANSAC early once an all-inlier minimal set has been drawn with 99.9%% confidence (see outlier_rejection.FrameToFrameRANSAC)')
+    args = parser.parse_args()
     np.random.seed(14)
-    main()
+    main(args)
 
@@ -33,6 +33,7 @@ class SparseStereoPipelineParams(object):
         self.motion_stiffness = []
         self.dataset_date_drive = ''
         self.saved_stereo_tracks_file = None
+        self.ransac_adaptive = False
 
 class SparseMatcherParams(object):
     def __init__(self):
@@ -52,7 +53,7 @@ class SparseStereoPipeline(object):
 
         matcher_params = SparseMatcherParams() 
         self.matcher = SparseStereoQuadMatcher(matcher_params, self.camera)
-        self.ransac_obj = FrameToFrameRANSAC(self.camera)
+        self.ransac_obj = FrameToFrameRANSAC(self.camera, adaptive=pipeline_params.ransac_adaptive)
 
         #Images for tracking
         self.img1_l = []
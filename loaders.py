@@ -11,6 +11,132 @@ from PIL import Image
 import pickle
 import time
 import cv2
+from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
+import threading, queue
+import weakref
+from kitti.manifest import load_manifest, to_columnar, select_seq
+
+class CompressedFrames(object):
+    """Sequence of frames kept as encoded byte blobs (see kitti/create_single_dataset_file.py).
+    Indexing decodes a single frame to a C x H x W RGB uint8 tensor, so decoding happens in the DataLoader workers."""
+
+    def __init__(self, blobs, offsets):
+        self.blobs = blobs.numpy()
+        self.offsets = offsets.numpy()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        buf = self.blobs[self.offsets[idx]:self.offsets[idx + 1]]
+        img = cv2.cvtColor(cv2.imdecode(buf, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        return torch.from_numpy(img).permute(2, 0, 1)
+
+    @property
+    def nbytes(self):
+        return self.blobs.nbytes + self.offsets.nbytes
+
+
+def load_frame_store(file_path):
+    """Loads the left images of a sequence file, either as a raw N x C x H x W uint8 tensor or as CompressedFrames.
+    .npy stores are memory mapped (copy-on-write), so frames are paged in on access and shared with DataLoader workers."""
+    if file_path.endswith('.npy'):
+        return torch.from_numpy(np.load(file_path, mmap_mode='c'))
+    data = torch.load(file_path)
+    if 'im_l_blobs' in data:
+        return CompressedFrames(data['im_l_blobs'], data['im_l_offsets'])
+    return data['im_l']
+
+
+def first_appearance_order(keys):
+    """Unique keys in the order they first appear (e.g., the order an unshuffled loader needs the sequences)"""
+    unique_keys, first_ids = np.unique(np.asarray(keys), return_index=True)
+    return unique_keys[np.argsort(first_ids)].tolist()
+
+
+#Live AsyncSequenceStores; every one is waited for before this process forks (see AsyncSequenceStore)
+_async_stores = weakref.WeakSet()
+
+def _wait_for_async_stores():
+    for store in list(_async_stores):
+        store.wait()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_wait_for_async_stores)
+
+
+class AsyncSequenceStore(object):
+    """Read-only mapping seq -> frames whose values are loaded by a background thread pool, in the order of keys.
+    Construction returns immediately; indexing blocks only until that sequence has loaded, so loading overlaps with
+    the rest of the setup (model, the other split's store) and with DataLoader(num_workers=0) iteration.
+
+    Forking while the threads are inside torch.load is unsafe, and a forked worker would have to reload every missing
+    sequence itself. So the process waits for all sequences before any fork (e.g. when a DataLoader starts its
+    workers), and pickling (spawned workers) waits as well: workers always get the complete store.
+    """
+
+    def __init__(self, load_fn, keys, num_threads=4):
+        self.load_fn = load_fn
+        self.keys = list(keys)
+        self.start_time = time.time()
+        self.loaded = {}
+        self.load_times = {}
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+        self.futures = {key: self.pool.submit(self._load, key) for key in self.keys}
+        self.pool.shutdown(wait=False)
+        _async_stores.add(self)
+
+    def _load(self, key):
+        start = time.time()
+        value = self.load_fn(key)
+        self.load_times[key] = time.time() - start
+        self.loaded[key] = value
+        print('Loaded sequence {} in {:.1f} sec. ({} / {} ready after {:.1f} sec.)'.format(
+            key, self.load_times[key], len(self.loaded), len(self.keys), time.time() - self.start_time))
+        return value
+
+    def __getitem__(self, key):
+        if key in self.loaded:
+            return self.loaded[key]
+        return self.futures[key].result()
+
+    def __getstate__(self):
+        self.wait()
+        state = self.__dict__.copy()
+        state['futures'] = None
+        state['pool'] = None
+        return state
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def wait(self):
+        """Blocks until every sequence has loaded"""
+        if len(self.loaded) < len(self.keys):
+            for key in self.keys:
+                self.futures[key].result()
+        return self
+
+
+#Single-channel variants of a frame store for the flow path, written next to it by kitti/create_single_dataset_file.py
+#(variant -> Gaussian blur kernel applied after the grayscale conversion)
+GRAY_STORE_BLUR = {'gray': None, 'gray_blur': (13, 13)}
+
+def gray_store_path(file_path, variant):
+    """seq_noncropped_00.pt -> seq_noncropped_00_gray.npy"""
+    return os.path.splitext(file_path)[0] + '_' + variant + '.npy'
+
+def load_gray_store(file_path, variant):
+    """N x H x W uint8 memmap; each frame is a contiguous array that OpenCV reads without a copy"""
+    return np.load(gray_store_path(file_path, variant), mmap_mode='r')
+
 
 class PlanetariumData(Dataset):
     """Synthetic data"""
@@ -35,28 +161,103 @@ class PlanetariumData(Dataset):
             raise Exception('Quaternions have nan at indices: {}'.format(torch.isnan(self.q_target[:,0]).nonzero()))
 
         y =  torch.from_numpy(self.dataset['y_k_j'][:, k_range, :]).float()
-        self.sensor_data = y
+        if self.norm is not None:
+            #Normalize all visible observations once (unseen landmarks keep their -1 sentinel)
+            visible = (y[0] > 0).unsqueeze(0).expand_as(y)
+            #Per-dimension (tensor) or scalar normalization
+            norm = torch.as_tensor(self.norm, dtype=y.dtype, device=y.device)
+            if norm.dim() > 0:
+                norm = norm.view(-1, 1, 1)
+            y = torch.where(visible, y / norm, y)
+
+        #Network inputs, one flattened (landmark x obs_dim) row per sample (the only copy of the observations kept)
+        self.inputs = y.permute(1, 2, 0).reshape(y.shape[1], -1).contiguous()
 
     def __len__(self):
         return len(self.q_target)
 
     def __getitem__(self, idx):
-        y = self.sensor_data[:, idx, :].clone()
-        if self.norm is not None:
-            y[:, y[0, :] > 0] = y[:, y[0, :] > 0]/self.norm
-
         if self.mat_targets:
-            target = self.C_target[idx].clone()
+            target = self.C_target[idx]
         else:
-            target = self.q_target[idx].clone()
-        return y.transpose(0,1).flatten(), target
+            target = self.q_target[idx]
+        return self.inputs[idx], target
+
+
+class PlanetariumBatchLoader(object):
+    """Drop-in replacement for a DataLoader over PlanetariumData.
+    The whole dataset stays resident (optionally on the training device) and batches are served by index slicing,
+    without worker processes or collation."""
+
+    def __init__(self, dataset, batch_size=1, shuffle=False, drop_last=False, device=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+        targets = dataset.C_target if dataset.mat_targets else dataset.q_target
+        self.inputs = dataset.inputs if device is None else dataset.inputs.to(device)
+        self.targets = targets if device is None else targets.to(device)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return int(math.ceil(len(self.dataset) / self.batch_size))
+
+    def __iter__(self):
+        num_samples = len(self.dataset)
+        if self.shuffle:
+            ids = torch.randperm(num_samples).to(self.inputs.device)
+
+        for b in range(len(self)):
+            start = b*self.batch_size
+            end = min(start + self.batch_size, num_samples)
+            if self.shuffle:
+                batch_ids = ids[start:end]
+                yield self.inputs[batch_ids], self.targets[batch_ids]
+            else:
+                yield self.inputs[start:end], self.targets[start:end]
+
+
+def load_seven_scenes_index(base_dir, seqs, index_file, num_threads=16):
+    """Returns (N x 16 poses, image paths) for the given sequences of a scene.
+    The result is cached in index_file and rebuilt (reading the sequences in parallel) whenever a sequence directory changes."""
+    seq_dirs = [osp.join(base_dir, 'seq-{:02d}'.format(seq)) for seq in seqs]
+    mtimes = np.array([os.stat(seq_dir).st_mtime for seq_dir in seq_dirs])
+
+    if osp.isfile(index_file):
+        index = np.load(index_file)
+        if np.array_equal(index['seqs'], seqs) and np.array_equal(index['mtimes'], mtimes):
+            return index['poses'], index['c_imgs'].tolist()
+
+    print('Building pose index {}...'.format(index_file))
+    pose_files = []
+    c_imgs = []
+    for seq_dir in seq_dirs:
+        p_filenames = [n for n in os.listdir(osp.join(seq_dir, '.')) if n.find('pose') >= 0]
+        pose_files.extend([osp.join(seq_dir, 'frame-{:06d}.pose.txt'.format(i)) for i in range(len(p_filenames))])
+        c_imgs.extend([osp.join(seq_dir, 'frame-{:06d}.color.png'.format(i)) for i in range(len(p_filenames))])
+
+    pool = ThreadPool(num_threads)
+    pss = pool.map(lambda f: np.loadtxt(f).flatten(), pose_files)
+    pool.close()
+    poses = np.asarray(pss).reshape(-1, 16)
+
+    try:
+        np.savez(index_file, seqs=np.array(seqs), mtimes=mtimes, poses=poses, c_imgs=np.array(c_imgs))
+    except OSError as e:
+        print('Could not save pose index {}: {}'.format(index_file, e))
+
+    return poses, c_imgs
+
 
 class SevenScenesData(Dataset):
-    def __init__(self, scene, data_path, train, transform=None, valid_jitter_transform=None):
+    def __init__(self, scene, data_path, train, transform=None, valid_jitter_transform=None, index_dir=None):
         
         """
           :param scene: scene name: 'chess', 'pumpkin', ...
           :param data_path: root 7scenes data directory.
+          :param index_dir: where to cache the pose index (defaults to the scene directory).
 
         """
         self.transform = transform
@@ -72,23 +273,10 @@ class SevenScenesData(Dataset):
         with open(split_file, 'r') as f:
             seqs = [int(l.split('sequence')[-1]) for l in f if not l.startswith('#')]
     
-          # read poses and collect image names
-        self.c_imgs = []
-        self.d_imgs = []
-        self.pose_files = []
-        self.gt_idx = np.empty((0,), dtype=np.int)
-        ps = {}
-        for seq in seqs:
-            seq_dir = osp.join(base_dir, 'seq-{:02d}'.format(seq))
-            p_filenames = [n for n in os.listdir(osp.join(seq_dir, '.')) if n.find('pose') >= 0]
-            frame_idx = np.array(range(len(p_filenames)), dtype=np.int)
-            pss = [np.loadtxt(osp.join(seq_dir, 'frame-{:06d}.pose.txt'.format(i))).flatten() for i in frame_idx]
-            ps[seq] = np.asarray(pss)
-            c_imgs = [osp.join(seq_dir, 'frame-{:06d}.color.png'.format(i)) for i in frame_idx]
-            self.c_imgs.extend(c_imgs)
-        self.poses = np.empty((0,16))
-        for seq in seqs:
-            self.poses = np.vstack((self.poses,ps[seq]))
+          # read poses and collect image names (cached in a single pose index file)
+        split = 'train' if train else 'test'
+        index_file = osp.join(base_dir if index_dir is None else index_dir, '{}_{}_pose_index.npz'.format(scene, split))
+        self.poses, self.c_imgs = load_seven_scenes_index(base_dir, seqs, index_file)
 
         print('Loaded {} poses'.format(self.poses.shape[0]))
 
@@ -121,6 +309,146 @@ class SevenScenesData(Dataset):
         return img
 
 
+def seven_scenes_store_paths(store_path, scene, train):
+    split = 'train' if train else 'test'
+    return (osp.join(store_path, '{}_{}_frames.npy'.format(scene, split)),
+            osp.join(store_path, '{}_{}_poses.npy'.format(scene, split)))
+
+class SevenScenesCachedData(Dataset):
+    def __init__(self, scene, store_path, train):
+        """
+          :param scene: scene name: 'chess', 'pumpkin', ...
+          :param store_path: directory written by create_7scenes_store.py
+
+          Returns uint8 images, normalization is applied to whole batches (see BatchNormalizeImages).
+        """
+        frames_file, poses_file = seven_scenes_store_paths(store_path, scene, train)
+        self.train = train
+        self.frames = np.load(frames_file, mmap_mode='r')
+        self.poses = np.load(poses_file)
+
+        #Poses are camera to world, we need world to camera
+        q_target = np.empty((self.poses.shape[0], 4))
+        for i in range(self.poses.shape[0]):
+            q_target[i] = quaternion_from_matrix(self.poses[i].reshape((4,4))[0:3,0:3].T)
+        self.q_target = torch.from_numpy(q_target).float()
+
+        print('Loaded {} poses'.format(self.poses.shape[0]))
+
+    def __getitem__(self, index):
+        img = torch.from_numpy(np.array(self.frames[index]))
+        return img, self.q_target[index]
+
+    def __len__(self):
+        return self.poses.shape[0]
+
+
+class BatchNormalizeImages(object):
+    """Deterministic image transform applied to a whole uint8 N x C x H x W batch:
+    optional center crop, scaling to [0, 1] and per-channel normalization"""
+
+    def __init__(self, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225], crop_size=None):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.crop_size = crop_size
+
+    def __call__(self, imgs):
+        if self.crop_size is not None:
+            top = (imgs.shape[2] - self.crop_size) // 2
+            left = (imgs.shape[3] - self.crop_size) // 2
+            imgs = imgs[:, :, top:top + self.crop_size, left:left + self.crop_size]
+        mean = self.mean.to(imgs.device)
+        std = self.std.to(imgs.device)
+        return (imgs.float().div_(255.) - mean).div_(std)
+
+
+def fixed_subset_loader(dataset, num_samples, batch_size, seed=0, num_workers=0):
+    """DataLoader over the same random subset of num_samples items every epoch (e.g., to evaluate on part of the training set)"""
+    ids = np.random.RandomState(seed).choice(len(dataset), min(num_samples, len(dataset)), replace=False)
+    return DataLoader(torch.utils.data.Subset(dataset, np.sort(ids).tolist()), batch_size=batch_size, shuffle=False,
+                      num_workers=num_workers, pin_memory=False, drop_last=False)
+
+
+class DevicePrefetcher(object):
+    """Wraps a DataLoader so that, on a background thread, the next batches are pinned (for CUDA devices),
+    transferred to config['device'] (including list inputs) and passed through config['batch_transform']
+    (config['train_batch_transform'] with train=True) while the current training step computes. train / validate use the batches as they are (see on_device)."""
+
+    on_device = True
+
+    def __init__(self, loader, config, depth=2, pin_memory=None, train=False):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.device = config['device']
+        #Training loaders use config['train_batch_transform'] when it is set
+        self.batch_transform = config.get('train_batch_transform') if train and config.get('train_batch_transform') is not None else config.get('batch_transform')
+        self.depth = depth
+        self.pin_memory = (self.device.type == 'cuda') if pin_memory is None else pin_memory
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _to_device(self, x):
+        if self.pin_memory and x.device.type == 'cpu' and not x.is_pinned():
+            x = x.pin_memory()
+        return x.to(self.device, non_blocking=self.pin_memory)
+
+    def _prepare(self, batch):
+        y_obs, q_gt = batch
+        if isinstance(y_obs, list):
+            y_obs = [self._to_device(y) for y in y_obs]
+        else:
+            y_obs = self._to_device(y_obs)
+
+        if self.batch_transform is not None:
+            if isinstance(y_obs, list):
+                y_obs = [self.batch_transform(y) for y in y_obs]
+            else:
+                y_obs = self.batch_transform(y_obs)
+        return y_obs, self._to_device(q_gt)
+
+    @staticmethod
+    def _put(batch_queue, item, stop):
+        #Gives up when the consumer has stopped, so the thread never blocks on a full queue
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self, loader_iter, batch_queue, stop):
+        try:
+            for batch in loader_iter:
+                if not self._put(batch_queue, self._prepare(batch), stop):
+                    return
+        except Exception as e:
+            self._put(batch_queue, e, stop)
+            return
+        self._put(batch_queue, None, stop)
+
+    def __iter__(self):
+        batch_queue = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        loader_iter = iter(self.loader)
+        thread = threading.Thread(target=self._fill, args=(loader_iter, batch_queue, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+            #Shuts down the DataLoader workers now rather than when the iterator is garbage collected
+            del loader_iter
+
+
 class KITTIVODataset(Dataset):
     """KITTI Odometry Benchmark dataset."""
 
@@ -188,19 +516,33 @@ class KITTIVODataset(Dataset):
 class KITTIVODatasetPreTransformed(Dataset):
     """KITTI Odometry Benchmark dataset with full memory read-ins."""
 
-    def __init__(self, kitti_dataset_file, seqs_base_path, transform_img=None, run_type='train', use_flow=True, apply_blur=False, reverse_images=False, seq_prefix='seq_', use_only_seq=None):
+    def __init__(self, kitti_dataset_file, seqs_base_path, transform_img=None, run_type='train', use_flow=True, apply_blur=False, reverse_images=False, seq_prefix='seq_', use_only_seq=None, seq_ext='.pt', gray_store=None, async_load=False):
         self.kitti_dataset_file = kitti_dataset_file
         self.seqs_base_path = seqs_base_path
         self.apply_blur = apply_blur
         self.transform_img = transform_img
         self.seq_prefix = seq_prefix
+        self.seq_ext = seq_ext
+        #With use_flow, read the 'gray' or 'gray_blur' store (see GRAY_STORE_BLUR) instead of converting RGB frames per sample
+        self.gray_store = gray_store if use_flow else None
+        if self.gray_store == 'gray_blur' and not apply_blur:
+            raise ValueError('gray_store=`gray_blur` holds blurred frames and needs apply_blur=True.')
+        #Load the sequence files on background threads (see AsyncSequenceStore)
+        self.async_load = async_load
         self.load_kitti_data(run_type, use_only_seq)  # Loads self.image_quad_paths and self.labels
         self.use_flow = use_flow
         self.reverse_images = reverse_images
 
     def load_kitti_data(self, run_type, use_only_seq):
-        with open(self.kitti_dataset_file, 'rb') as handle:
-            kitti_data = pickle.load(handle)
+        #Columnar .npz manifest (see kitti/manifest.py), or a legacy pickle of liegroups objects
+        if self.kitti_dataset_file.endswith('.npz'):
+            kitti_data = load_manifest(self.kitti_dataset_file)
+        else:
+            with open(self.kitti_dataset_file, 'rb') as handle:
+                kitti_data = to_columnar(pickle.load(handle))
+
+        if use_only_seq is not None and run_type in ['train', 'test']:
+            kitti_data = select_seq(kitti_data, run_type, use_only_seq)
 
         if run_type == 'train':
             self.seqs = kitti_data['train_seqs']
@@ -208,6 +550,8 @@ class KITTIVODatasetPreTransformed(Dataset):
             self.T_21_gt = kitti_data['train_T_21_gt']
             self.T_21_vo = kitti_data['train_T_21_vo']
             self.pose_deltas = kitti_data['train_pose_deltas']
+            self.turning_angles = kitti_data['train_turning_angles']
+            self.directions = kitti_data['train_directions']
 
         elif run_type == 'test':
             self.seqs = kitti_data['test_seqs']
@@ -215,29 +559,25 @@ class KITTIVODatasetPreTransformed(Dataset):
             self.T_21_gt = kitti_data['test_T_21_gt']
             self.T_21_vo = kitti_data['test_T_21_vo']
             self.pose_delta = kitti_data['test_pose_delta']
+            self.turning_angles = kitti_data['test_turning_angles']
+            self.directions = kitti_data['test_directions']
 
         else:
             raise ValueError('run_type must be set to `train`, or `test`. ')
 
-        if use_only_seq is not None:
-            self.pose_indices = [self.pose_indices[i] for i in range(len(self.seqs))
-                                 if self.seqs[i] ==  use_only_seq]
-            self.T_21_gt = [self.T_21_gt[i] for i in range(len(self.seqs))
-                                 if self.seqs[i] == use_only_seq]
-            self.T_21_vo = [self.T_21_vo[i] for i in range(len(self.seqs))
-                                 if self.seqs[i] == use_only_seq]
-            self.seqs = [self.seqs[i] for i in range(len(self.seqs))
-                                 if self.seqs[i] == use_only_seq]
-
-        print('Loading sequences...{}'.format(list(set(self.seqs))))
+        print('Loading sequences...{}'.format(np.unique(self.seqs).tolist()))
         print('Pose delta: {}'.format(self.pose_indices[0][1] - self.pose_indices[0][0]))
-        self.seq_images = {seq: self.import_seq(seq) for seq in list(set(self.seqs))}
+        if self.async_load:
+            self.seq_images = AsyncSequenceStore(self.import_seq, first_appearance_order(self.seqs))
+            return
+        self.seq_images = {seq: self.import_seq(seq) for seq in np.unique(self.seqs).tolist()}
         print('...done loading images into memory.')
 
     def import_seq(self, seq):
-        file_path = self.seqs_base_path + '/' + self.seq_prefix + '{}.pt'.format(seq)
-        data = torch.load(file_path)
-        return data['im_l']
+        file_path = self.seqs_base_path + '/' + self.seq_prefix + '{}'.format(seq) + self.seq_ext
+        if self.gray_store is not None:
+            return load_gray_store(file_path, self.gray_store)
+        return load_frame_store(file_path)
 
     def __len__(self):
         return len(self.T_21_gt)
@@ -248,14 +588,17 @@ class KITTIVODatasetPreTransformed(Dataset):
         else:
             return img.float() / 255.
 
-    def compute_flow(self, img1, img2, idx, apply_blur = False):
-        #Convert back to W x H x C
-        np_img1 = cv2.cvtColor(img1.permute(1,2,0).numpy(), cv2.COLOR_RGB2GRAY)
-        np_img2 = cv2.cvtColor(img2.permute(1,2,0).numpy(), cv2.COLOR_RGB2GRAY)
+    def gray_img(self, img, apply_blur=False):
+        if self.gray_store is None:
+            #Convert back to W x H x C
+            img = cv2.cvtColor(img.permute(1,2,0).numpy(), cv2.COLOR_RGB2GRAY)
+        if apply_blur and self.gray_store != 'gray_blur':
+            img = cv2.GaussianBlur(img, GRAY_STORE_BLUR['gray_blur'], 0)
+        return img
 
-        if apply_blur:
-            np_img1 = cv2.GaussianBlur(np_img1, (13, 13), 0)
-            np_img2 = cv2.GaussianBlur(np_img2, (13, 13), 0)
+    def compute_flow(self, img1, img2, idx, apply_blur = False):
+        np_img1 = self.gray_img(img1, apply_blur)
+        np_img2 = self.gray_img(img2, apply_blur)
 
         flow_cv2 = cv2.calcOpticalFlowFarneback(np_img1, np_img2, None, 0.5, 3, 15, 3, 5, 1.2, 0)
         flow_img = torch.from_numpy(flow_cv2).permute(2,0,1)
@@ -280,12 +623,12 @@ class KITTIVODatasetPreTransformed(Dataset):
     def __getitem__(self, idx):
         seq = self.seqs[idx]
         p_ids = self.pose_indices[idx]
-        C_21_gt = self.T_21_gt[idx].rot.as_matrix()
+        C_21_gt = self.T_21_gt[idx, :3, :3]
 
 
         if self.reverse_images:
             p_ids = [p_ids[1], p_ids[0]]
-            C_21_gt = self.T_21_gt[idx].rot.inv().as_matrix()
+            C_21_gt = C_21_gt.T
 
         #print('Loading seq: {}. ids: {}'.format(seq, p_ids))
 
@@ -307,10 +650,11 @@ class KITTIVODatasetPreTransformed(Dataset):
 class KITTIVODatasetPreTransformedAbs(Dataset):
     """KITTI Odometry Benchmark dataset with full memory read-ins."""
 
-    def __init__(self, kitti_dataset_file, seqs_base_path, transform_img=None, run_type='train'):
+    def __init__(self, kitti_dataset_file, seqs_base_path, transform_img=None, run_type='train', async_load=False):
         self.kitti_dataset_file = kitti_dataset_file
         self.seqs_base_path = seqs_base_path
         self.transform_img = transform_img
+        self.async_load = async_load
         self.load_kitti_data(run_type)  # Loads self.image_quad_paths and self.labels
 
     def load_kitti_data(self, run_type):
@@ -331,13 +675,15 @@ class KITTIVODatasetPreTransformedAbs(Dataset):
             raise ValueError('run_type must be set to `train`, or `test`. ')
 
         print('Loading sequences...{}'.format(list(set(self.seqs))))
+        if self.async_load:
+            self.seq_images = AsyncSequenceStore(self.import_seq, first_appearance_order(self.seqs))
+            return
         self.seq_images = {seq: self.import_seq(seq) for seq in list(set(self.seqs))}
         print('...done loading images into memory.')
 
     def import_seq(self, seq):
         file_path = self.seqs_base_path + '/seq_squished_{}.pt'.format(seq)
-        data = torch.load(file_path)
-        return data['im_l']
+        return load_frame_store(file_path)
 
     def __len__(self):
         return len(self.C_imu_w)
@@ -1,6 +1,6 @@
 import torch 
 from lie_algebra import so3_log
-from utils import normalize_vecs, quat_log_diff, batch_logdet3
+from utils import normalize_vecs, quat_log_diff, batch_logdet3, nll_quat_from_residual
 
 
 class SO3NLLLoss(torch.nn.Module):
@@ -64,9 +64,11 @@ class QuatNLLLoss(torch.nn.Module):
             q_est = q_est.unsqueeze(0)
             q_gt = q_gt.unsqueeze(0)
 
-        residual = quat_log_diff(q_est, q_gt).unsqueeze(2)
-        weighted_term = 0.5*residual.transpose(1,2).bmm(Rinv).bmm(residual)
-        nll = weighted_term.squeeze() - 0.5*batch_logdet3(Rinv)
+        return self.from_residual(quat_log_diff(q_est, q_gt), Rinv)
+
+    def from_residual(self, residual, Rinv):
+        #Same loss from a precomputed quat_log_diff(q_est, q_gt)
+        nll = nll_quat_from_residual(residual, Rinv)
 
         #nll = torch.min((q_est - q_gt).pow(2).sum(dim=1), (q_est + q_gt).pow(2).sum(dim=1))
         if self.reduce:
@@ -15,9 +15,13 @@ import time, sys
 import argparse
 import datetime
 from train_test import *
-from loaders import SevenScenesData
+from loaders import SevenScenesData, SevenScenesCachedData, BatchNormalizeImages, DevicePrefetcher, fixed_subset_loader
+from augment import BatchAugment
 from torch.utils.data import Dataset, DataLoader
 from vis import *
+from artifact_writer import ArtifactWriter
+from checkpoint import save_resume_checkpoint, load_resume_checkpoint
+from runtime_profile import load_runtime_profile, set_threads, loader_kwargs
 import torchvision.transforms as transforms
 
 if __name__ == '__main__':
@@ -27,6 +31,7 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='3D training arguments.')
     parser.add_argument('--cuda', action='store_true', default=True)
+    parser.add_argument('--no_cuda', dest='cuda', action='store_false', help='Train on the CPU (e.g., with --amp bf16)')
     parser.add_argument('--batch_size', type=int, default=16)
     parser.add_argument('--epoch_display', type=int, default=1)
     parser.add_argument('--lr', type=float, default=5e-5)
@@ -35,9 +40,28 @@ if __name__ == '__main__':
     parser.add_argument('--q_target_sigma', type=float, default=0.1)
     parser.add_argument('--scene', type=str, default='chess')
     parser.add_argument('--experiment_name', type=str, default='experiment')
-
+    parser.add_argument('--store_path', type=str, default=None, help='Read pre-resized frames written by create_7scenes_store.py')
+    parser.add_argument('--batch_augment', action='store_true', default=False, help='With --store_path, augment training batches (as transform_jitter) with augment.BatchAugment')
+    parser.add_argument('--train_eval_subset', type=int, default=0, help='Evaluate training metrics on a fixed random subset of this size (0: use the head-mean metrics collected by train())')
+    parser.add_argument('--amp', type=str, default=None, choices=['bf16'], help='Run the model forward passes under autocast (bf16 on CPU nodes with AVX512-BF16 / AMX)')
+    parser.add_argument('--skip_initial_validate', action='store_true', default=False, help='Start training without the validation pass at epoch 0')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--inter_threads', type=int, default=None, help='Inter-op threads')
+    parser.add_argument('--num_workers', type=int, default=None, help='DataLoader worker processes (default: 12 with raw images, 2 with --store_path)')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='Batches loaded in advance by each worker')
+    parser.add_argument('--artifact_workers', type=int, default=2, help='Processes that render plots and write checkpoints in the background (0: on the training thread)')
+    parser.add_argument('--resume', action='store_true', default=False, help='Continue from the latest resume checkpoint in 7scenes/<experiment>/<scene>/resume_heads_<heads>')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='Write a resume checkpoint every this many epochs (0: never)')
+    parser.add_argument('--keep_checkpoints', type=int, default=2, help='Number of resume checkpoints to keep')
+    parser.add_argument('--stage_log', type=str, default=None, help='Append per-epoch stage timings (data, transfer, forward, loss, backward, ...) to this JSONL file')
+    parser.add_argument('--profile_window', type=int, nargs=2, default=None, metavar=('SKIP', 'STEPS'), help='Record a torch.profiler trace of STEPS training steps after SKIP steps')
+    parser.add_argument('--profile_dir', type=str, default='7scenes/profiler_traces')
+
+    #Settings tuned by autotune.py for this machine replace the defaults above
+    parser.set_defaults(**load_runtime_profile('7scenes'))
     args = parser.parse_args()
     print(args)
+    set_threads(args.threads, args.inter_threads)
 
     if os.path.isdir('7scenes/{}/{}'.format(args.experiment_name, args.scene)) == False:
         os.makedirs('7scenes/{}/{}'.format(args.experiment_name, args.scene))
@@ -83,39 +107,91 @@ if __name__ == '__main__':
     ])
 
 
-    train_loader = DataLoader(SevenScenesData(args.scene, '/media/datasets/7scenes', train=True, transform=transform),
-                        batch_size=args.batch_size, pin_memory=True,
-                        shuffle=True, num_workers=12, drop_last=False)
-    valid_loader = DataLoader(SevenScenesData(args.scene, '/media/datasets/7scenes', train=False, transform=transform, valid_jitter_transform=None),
-                        batch_size=args.batch_size, pin_memory=True,
-                        shuffle=False, num_workers=12, drop_last=False)
+    if args.store_path is None:
+        train_dataset = SevenScenesData(args.scene, '/media/datasets/7scenes', train=True, transform=transform)
+        valid_dataset = SevenScenesData(args.scene, '/media/datasets/7scenes', train=False, transform=transform, valid_jitter_transform=None)
+        batch_transform = None
+        num_workers = 12 if args.num_workers is None else args.num_workers
+    else:
+        train_dataset = SevenScenesCachedData(args.scene, args.store_path, train=True)
+        valid_dataset = SevenScenesCachedData(args.scene, args.store_path, train=False)
+        #Equivalent of CenterCrop(224), ToTensor and Normalize above, applied to whole batches
+        batch_transform = BatchNormalizeImages(crop_size=224)
+        num_workers = 2 if args.num_workers is None else args.num_workers
+
+    #Random affine warps of whole training batches (rotation and shear as transform_jitter), seeded for reproducibility
+    train_batch_transform = None
+    if args.batch_augment:
+        if args.store_path is None:
+            parser.error('--batch_augment needs --store_path')
+        train_batch_transform = BatchAugment(degrees=30, shear=10, crop_size=224, seed=0)
+
+    train_loader = DataLoader(train_dataset,
+                        batch_size=args.batch_size, pin_memory=False,
+                        shuffle=True, **loader_kwargs(num_workers, args.prefetch_factor), drop_last=False)
+    valid_loader = DataLoader(valid_dataset,
+                        batch_size=args.batch_size, pin_memory=False,
+                        shuffle=False, **loader_kwargs(num_workers, args.prefetch_factor), drop_last=False)
     total_time = 0.
     now = datetime.datetime.now()
     start_datetime_str = '{}-{}-{}-{}-{}-{}'.format(now.year, now.month, now.day, now.hour, now.minute, now.second)
 
 
+    #Per-stage timing, printed every epoch
+    stage_timer = StageTimer(args.stage_log, sync_cuda=(device.type == 'cuda' and args.stage_log is not None))
+    if args.profile_window is not None:
+        stage_timer.profile_steps(args.profile_dir, *args.profile_window, cuda=(device.type == 'cuda'))
+
     #Configuration
     config = {
-        'device': device
+        'device': device,
+        'amp': args.amp,
+        'stage_timer': stage_timer,
+        'batch_transform': batch_transform,
+        'train_batch_transform': train_batch_transform
     }
+    #Pinning, device transfer and batch_transform happen on a background thread, one batch ahead
+    #Training metrics come from the training passes themselves (head mean, augmented batches),
+    #or from a fixed subset of the un-augmented training set
+    if args.train_eval_subset > 0:
+        train_eval_loader = DevicePrefetcher(fixed_subset_loader(train_dataset, args.train_eval_subset, args.batch_size, num_workers=num_workers), config)
+    else:
+        train_eval_loader = DevicePrefetcher(train_loader, config)
+    train_loader = DevicePrefetcher(train_loader, config, train=True)
+    valid_loader = DevicePrefetcher(valid_loader, config)
+    #Plots and checkpoints are written by background processes (see artifact_writer.py)
+    writer = ArtifactWriter(num_workers=args.artifact_workers)
     epoch_time = AverageMeter()
-    avg_train_loss, train_ang_error, train_nll = validate(model, train_loader, loss_fn, config)
-    avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
-
-    #Visualize
-    sigma_filename = '7scenes/{}/{}/saved_plots/sigma_plot_heads_{}_epoch_{}.pdf'.format(args.experiment_name, args.scene,model.num_hydra_heads, 0)
-    plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
-
-    print('Starting Training \t' 
-          'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'.format(
-            train_ang_error, train_nll, valid_ang_error, valid_nll))
-
-    best_valid_nll = valid_nll
-    for epoch in range(args.total_epochs):
+    #Resume checkpoints (see checkpoint.py)
+    checkpoint_dir = '7scenes/{}/{}/resume_heads_{}'.format(args.experiment_name, args.scene, num_hydra_heads)
+    resumed = load_resume_checkpoint(checkpoint_dir, model, optimizer) if args.resume else None
+    start_epoch = 0
+    if resumed is not None:
+        start_epoch, best_valid_nll = resumed
+    elif args.skip_initial_validate:
+        best_valid_nll = float('inf')
+    else:
+        avg_train_loss, train_ang_error, train_nll = validate(model, train_eval_loader, loss_fn, config)
+        avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
+
+        #Visualize
+        sigma_filename = '7scenes/{}/{}/saved_plots/sigma_plot_heads_{}_epoch_{}.pdf'.format(args.experiment_name, args.scene,model.num_hydra_heads, 0)
+        writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+
+        print('Starting Training \t' 
+              'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'.format(
+                train_ang_error, train_nll, valid_ang_error, valid_nll))
+
+        best_valid_nll = valid_nll
+    stage_timer.emit(epoch=0)
+
+    for epoch in range(start_epoch, args.total_epochs):
         end = time.time()
-        avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
-
-        _, train_ang_error, train_nll, predict_history_train = validate(model, train_loader, loss_fn, config, output_history=True)
+        if args.train_eval_subset > 0:
+            avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
+            _, train_ang_error, train_nll, predict_history_train = validate(model, train_eval_loader, loss_fn, config, output_history=True)
+        else:
+            avg_train_loss, train_ang_error, train_nll = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma, output_metrics=True)
         avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
 
         # Measure elapsed time
@@ -134,7 +210,8 @@ if __name__ == '__main__':
             sigma_filename_train = '7scenes/{}/{}/saved_plots/train_sigma_plot_{}_heads_{}_epoch_{}.pdf'.format(args.experiment_name, args.scene, args.scene, model.num_hydra_heads, epoch+1)
             nees_filename = '7scenes/{}/{}/saved_plots/nees_plot_{}_heads_{}_epoch_{}.pdf'.format(args.experiment_name, args.scene, args.scene, model.num_hydra_heads, epoch+1)
 
-            plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+            with stage_timer.stage('plot'):
+                writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
             # plot_errors_with_sigmas(predict_history_train[0], predict_history_train[1], predict_history_train[2], predict_history_train[3],
             #                         filename=sigma_filename_train)
 
@@ -143,27 +220,36 @@ if __name__ == '__main__':
             abs_filename_train = '7scenes/{}/{}/saved_plots/train_abs_sigma_plot_{}_heads_{}_epoch_{}.pdf'.format(args.experiment_name, args.scene, args.scene,
                                                                                               model.num_hydra_heads,
                                                                                               epoch + 1)
-            plot_abs_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3],
-                                    filename=abs_filename)
+            with stage_timer.stage('plot'):
+                writer.submit(plot_abs_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3],
+                                        filename=abs_filename)
             # plot_abs_with_sigmas(predict_history_train[0], predict_history_train[1], predict_history_train[2],
             #                         predict_history_train[3],
             #                         filename=abs_filename_train)
 
-            torch.save({
-                'full_model': model.state_dict(),
-                'sensor_net': model.sensor_net.state_dict(),
-                'direct_covar_head': model.direct_covar_head.state_dict(),
-                'predict_history': predict_history,
-                'epoch': epoch + 1,
-            }, '7scenes/{}/{}/best_model_{}_heads_{}_epoch_{}.pt'.format(args.experiment_name, args.scene, args.scene, model.num_hydra_heads, epoch + 1))
+            with stage_timer.stage('checkpoint'):
+                writer.save({
+                    'full_model': model.state_dict(),
+                    'sensor_net': model.sensor_net.state_dict(),
+                    'direct_covar_head': model.direct_covar_head.state_dict(),
+                    'predict_history': predict_history,
+                    'epoch': epoch + 1,
+                }, '7scenes/{}/{}/best_model_{}_heads_{}_epoch_{}.pt'.format(args.experiment_name, args.scene, args.scene, model.num_hydra_heads, epoch + 1))
 
 
             #plot_nees(predict_history[0], predict_history[1], predict_history[2], filename=nees_filename)
 
 
+        if args.checkpoint_every > 0 and (epoch + 1) % args.checkpoint_every == 0:
+            with stage_timer.stage('resume_checkpoint'):
+                save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch + 1, best_valid_nll, keep=args.keep_checkpoints, writer=writer)
+
         if epoch%args.epoch_display == 0:
             print('Epoch {}. Loss (Train/Valid) {:.3E} / {:.3E} \t'
             'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'
             'Epoch Time {epoch_time.val:.3f} (avg: {epoch_time.avg:.3f})'.format(
                 epoch+1, avg_train_loss, avg_valid_loss, train_ang_error, train_nll, valid_ang_error, valid_nll, epoch_time=epoch_time))
+        stage_timer.emit(epoch=epoch+1, train_loss=avg_train_loss, valid_loss=avg_valid_loss, epoch_time=epoch_time.val)
 
+    stage_timer.stop_profiler()
+    writer.close()
@@ -12,9 +12,12 @@ import time, sys
 import argparse
 import datetime
 from train_test import *
-from loaders import KITTIVODatasetPreTransformedAbs
+from loaders import KITTIVODatasetPreTransformedAbs, DevicePrefetcher
 from torch.utils.data import Dataset, DataLoader
 from vis import *
+from artifact_writer import ArtifactWriter
+from checkpoint import save_resume_checkpoint, load_resume_checkpoint
+from runtime_profile import load_runtime_profile, set_threads, loader_kwargs
 import torchvision.transforms as transforms
 
 if __name__ == '__main__':
@@ -25,6 +28,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='3D training arguments.')
     parser.add_argument('--seq', type=str, default='00')
     parser.add_argument('--cuda', action='store_true', default=True)
+    parser.add_argument('--no_cuda', dest='cuda', action='store_false', help='Train on the CPU (e.g., with --amp bf16)')
     parser.add_argument('--batch_size', type=int, default=32)
     parser.add_argument('--epoch_display', type=int, default=1)
     parser.add_argument('--lr', type=float, default=1e-4)
@@ -32,9 +36,23 @@ if __name__ == '__main__':
     parser.add_argument('--num_heads', type=int, default=25)
     parser.add_argument('--q_target_sigma', type=float, default=0.)
     parser.add_argument('--freeze_body', action='store_true', default=False)
-
+    parser.add_argument('--amp', type=str, default=None, choices=['bf16'], help='Run the model forward passes under autocast (bf16 on CPU nodes with AVX512-BF16 / AMX)')
+    parser.add_argument('--skip_initial_validate', action='store_true', default=False, help='Start training without the validation pass at epoch 0')
+    parser.add_argument('--async_load', action='store_true', default=False, help='Load the sequence files on background threads while the rest of the setup runs (completed before DataLoader workers start)')
+    parser.add_argument('--artifact_workers', type=int, default=2, help='Processes that render plots and write checkpoints in the background (0: on the training thread)')
+    parser.add_argument('--resume', action='store_true', default=False, help='Continue from the latest resume checkpoint in kitti/plots/abs/resume_seq_<seq>_heads_<heads>')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='Write a resume checkpoint every this many epochs (0: never)')
+    parser.add_argument('--keep_checkpoints', type=int, default=2, help='Number of resume checkpoints to keep')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--inter_threads', type=int, default=None, help='Inter-op threads')
+    parser.add_argument('--num_workers', type=int, default=4, help='DataLoader worker processes')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='Batches loaded in advance by each worker')
+
+    #This machine's runtime profile entry (see runtime_profile.py) replaces the defaults above
+    parser.set_defaults(**load_runtime_profile('kitti_abs'))
     args = parser.parse_args()
     print(args)
+    set_threads(args.threads, args.inter_threads)
 
 
     #loss_fn = SO3FrobNorm()
@@ -69,13 +87,13 @@ if __name__ == '__main__':
     kitti_data_pickle_file = 'kitti/datasets/obelisk/kitti_singlefile_data_sequence_{}_abs.pickle'.format(args.seq)
 
     seqs_base_path = 'kitti'
-    train_loader = DataLoader(KITTIVODatasetPreTransformedAbs(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='train'),
+    train_loader = DataLoader(KITTIVODatasetPreTransformedAbs(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='train', async_load=args.async_load),
                               batch_size=args.batch_size, pin_memory=False,
-                              shuffle=True, num_workers=4, drop_last=True)
+                              shuffle=True, **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=True)
 
-    valid_loader = DataLoader(KITTIVODatasetPreTransformedAbs(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='test'),
+    valid_loader = DataLoader(KITTIVODatasetPreTransformedAbs(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='test', async_load=args.async_load),
                               batch_size=args.batch_size, pin_memory=False,
-                              shuffle=False, num_workers=4, drop_last=False)
+                              shuffle=False, **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=False)
     total_time = 0.
     now = datetime.datetime.now()
     start_datetime_str = '{}-{}-{}-{}-{}-{}'.format(now.year, now.month, now.day, now.hour, now.minute, now.second)
@@ -83,17 +101,33 @@ if __name__ == '__main__':
 
     #Configuration
     config = {
-        'device': device
+        'device': device,
+        'amp': args.amp
     }
+    #Pinning, device transfer and batch_transform happen on a background thread, one batch ahead
+    train_loader = DevicePrefetcher(train_loader, config, train=True)
+    valid_loader = DevicePrefetcher(valid_loader, config)
+    #Plots and checkpoints are written by background processes (see artifact_writer.py)
+    writer = ArtifactWriter(num_workers=args.artifact_workers)
     epoch_time = AverageMeter()
-    avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
-
-    print('Starting Training \t' 
-          'Valid (Err/NLL) {:.3f} / {:3.3f}\t'.format(
-           valid_ang_error, valid_nll))
-
-    best_valid_loss = avg_valid_loss
-    for epoch in range(args.total_epochs):
+    #Resume checkpoints (see checkpoint.py)
+    checkpoint_dir = 'kitti/plots/abs/resume_seq_{}_heads_{}'.format(args.seq, num_hydra_heads)
+    resumed = load_resume_checkpoint(checkpoint_dir, model, optimizer) if args.resume else None
+    start_epoch = 0
+    if resumed is not None:
+        start_epoch, best_valid_loss = resumed
+    elif args.skip_initial_validate:
+        best_valid_loss = float('inf')
+    else:
+        avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
+
+        print('Starting Training \t' 
+              'Valid (Err/NLL) {:.3f} / {:3.3f}\t'.format(
+               valid_ang_error, valid_nll))
+
+        best_valid_loss = avg_valid_loss
+
+    for epoch in range(start_epoch, args.total_epochs):
         end = time.time()
         avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
         avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
@@ -109,14 +143,14 @@ if __name__ == '__main__':
 
             sigma_filename = 'kitti/plots/abs/error_sigma_plot_seq_{}_heads_{}_epoch_{}.pdf'.format(args.seq, model.num_hydra_heads, epoch+1)
 
-            plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+            writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
 
             abs_filename = 'kitti/plots/abs/abs_sigma_plot_seq_{}_heads_{}_epoch_{}.pdf'.format(args.seq, model.num_hydra_heads,
                                                                                   epoch + 1)
-            plot_abs_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3],
+            writer.submit(plot_abs_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3],
                                     filename=abs_filename)
 
-            torch.save({
+            writer.save({
                 'full_model': model.state_dict(),
                 'predict_history': predict_history,
                 'epoch': epoch + 1,
@@ -125,9 +159,13 @@ if __name__ == '__main__':
 
 
 
+        if args.checkpoint_every > 0 and (epoch + 1) % args.checkpoint_every == 0:
+            save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch + 1, best_valid_loss, keep=args.keep_checkpoints, writer=writer)
+
         if epoch%args.epoch_display == 0:
             print('Epoch {}. Loss (Train/Valid) {:.3E} / {:.3E} \t'
             ' Valid (Err/NLL) {:.3f} / {:3.3f}\t'
             'Epoch Time {epoch_time.val:.3f} (avg: {epoch_time.avg:.3f})'.format(
                 epoch+1, avg_train_loss, avg_valid_loss, valid_ang_error, valid_nll, epoch_time=epoch_time))
 
+    writer.close()
@@ -12,9 +12,16 @@ import time, sys
 import argparse
 import datetime
 from train_test import *
-from loaders import KITTIVODataset, KITTIVODatasetPreTransformed
+from loaders import KITTIVODataset, KITTIVODatasetPreTransformed, DevicePrefetcher
+from samplers import SequenceBlockBatchSampler, TurningAngleSampler
+from kitti.manifest import manifest_filename
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from distributed import setup_distributed, cleanup_distributed, is_main_process, get_local_rank, barrier, wrap_model
 from vis import *
+from artifact_writer import ArtifactWriter
+from checkpoint import save_resume_checkpoint, load_resume_checkpoint
+from runtime_profile import load_runtime_profile, set_threads, loader_kwargs
 import torchvision.transforms as transforms
 
 if __name__ == '__main__':
@@ -25,6 +32,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='3D training arguments.')
     parser.add_argument('--seq', type=str, default='00')
     parser.add_argument('--cuda', action='store_true', default=True)
+    parser.add_argument('--no_cuda', dest='cuda', action='store_false', help='Train on the CPU (e.g., with --amp bf16)')
     parser.add_argument('--batch_size', type=int, default=32)
     parser.add_argument('--epoch_display', type=int, default=1)
     parser.add_argument('--lr', type=float, default=1e-4)
@@ -32,10 +40,40 @@ if __name__ == '__main__':
     parser.add_argument('--num_heads', type=int, default=25)
     parser.add_argument('--q_target_sigma', type=float, default=0.)
     parser.add_argument('--freeze_body', action='store_true', default=False)
-
+    parser.add_argument('--block_size', type=int, default=0, help='Shuffle training pairs in blocks of contiguous frames (0: plain shuffle)')
+    parser.add_argument('--blocks_per_batch', type=int, default=4)
+    parser.add_argument('--epoch_samples', type=int, default=0, help='Draw this many training pairs per epoch with turning angle quotas (0: every pair once)')
+    parser.add_argument('--angle_bin_edges', type=float, nargs='+', default=[0.02], help='Turning angle bin edges (rad)')
+    parser.add_argument('--angle_bin_quotas', type=float, nargs='+', default=[0.2, 0.8], help='Fraction of each epoch drawn from each bin')
+    parser.add_argument('--gray_store', type=str, default=None, choices=['gray'], help='Compute flow from the preconverted grayscale frame store')
+    parser.add_argument('--reverse_fraction', type=float, default=None, help='Fraction of reverse pairs within each bin (default: as sampled)')
+    parser.add_argument('--amp', type=str, default=None, choices=['bf16'], help='Run the model forward passes under autocast (bf16 on CPU nodes with AVX512-BF16 / AMX)')
+    parser.add_argument('--skip_initial_validate', action='store_true', default=False, help='Start training without the validation pass at epoch 0')
+    parser.add_argument('--async_load', action='store_true', default=False, help='Load the sequence files on background threads while the rest of the setup runs (completed before DataLoader workers start)')
+    parser.add_argument('--artifact_workers', type=int, default=2, help='Processes that render plots and write checkpoints in the background (0: on the training thread)')
+    parser.add_argument('--resume', action='store_true', default=False, help='Continue from the latest resume checkpoint in kitti/plots_and_models/<folder>/resume_seq_<seq>_heads_<heads>')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='Write a resume checkpoint every this many epochs (0: never)')
+    parser.add_argument('--keep_checkpoints', type=int, default=2, help='Number of resume checkpoints to keep')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads (per process when launched with torchrun)')
+    parser.add_argument('--inter_threads', type=int, default=None, help='Inter-op threads')
+    parser.add_argument('--num_workers', type=int, default=4, help='DataLoader worker processes')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='Batches loaded in advance by each worker')
+    parser.add_argument('--stage_log', type=str, default=None, help='Append per-epoch stage timings (data, transfer, forward, loss, backward, ...) to this JSONL file')
+    parser.add_argument('--profile_window', type=int, nargs=2, default=None, metavar=('SKIP', 'STEPS'), help='Record a torch.profiler trace of STEPS training steps after SKIP steps')
+    parser.add_argument('--profile_dir', type=str, default='kitti/profiler_traces')
+
+    #Settings tuned by autotune.py for this machine replace the defaults above
+    parser.set_defaults(**load_runtime_profile('kitti'))
     args = parser.parse_args()
     print(args)
 
+    #Data-parallel training when launched with torchrun (see distributed.py); --batch_size is the global batch size
+    set_threads(inter_threads=args.inter_threads)
+    rank, world_size = setup_distributed(args.threads)
+    if world_size > 1 and (args.block_size > 0 or args.epoch_samples > 0):
+        parser.error('--block_size and --epoch_samples are not supported with distributed training')
+    batch_size = args.batch_size // world_size
+
 
     #loss_fn = SO3FrobNorm()
     #loss_fn = QuatLoss()
@@ -44,7 +82,9 @@ if __name__ == '__main__':
 
     #Float or Double?
     tensor_type = torch.float
-    device = torch.device('cuda:1') if args.cuda else torch.device('cpu')
+    #One GPU per process under torchrun
+    cuda_device = 'cuda:{}'.format(get_local_rank()) if world_size > 1 else 'cuda:1'
+    device = torch.device(cuda_device) if args.cuda else torch.device('cpu')
 
 
     num_hydra_heads=args.num_heads
@@ -54,6 +94,7 @@ if __name__ == '__main__':
 
     model.to(dtype=tensor_type, device=device)
     loss_fn.to(dtype=tensor_type, device=device)
+    train_model = wrap_model(model)
 
 
     optimizer = torch.optim.Adam(
@@ -86,41 +127,95 @@ if __name__ == '__main__':
     # transform = transforms.Normalize(mean=[0.485, 0.456, 0.406],
     #                           std=[0.229, 0.224, 0.225])
     transform = None
-    kitti_data_pickle_file = 'kitti/datasets/obelisk/kitti_singlefile_data_sequence_{}_delta_1_reverse_True.pickle'.format(args.seq)
+    #TurningAngleSampler weights the unfiltered manifest (create_kitti_training_data_single_memory.py --unfiltered)
+    kitti_data_pickle_file = manifest_filename(args.seq, min_turning_angle=0. if args.epoch_samples > 0 else 0.02)
 
     seqs_base_path = 'kitti/data'
     seq_prefix = 'seq_'
     output_folder = 'flow_large'
 
-    train_loader = DataLoader(KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='train', seq_prefix=seq_prefix),
+    train_dataset = KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='train', seq_prefix=seq_prefix, gray_store=args.gray_store, async_load=args.async_load)
+    if args.block_size > 0:
+        train_sampler = SequenceBlockBatchSampler(train_dataset.seqs, train_dataset.pose_indices, args.batch_size,
+                                                  block_size=args.block_size, blocks_per_batch=args.blocks_per_batch, drop_last=True)
+        train_loader = DataLoader(train_dataset, batch_sampler=train_sampler, pin_memory=False, **loader_kwargs(args.num_workers, args.prefetch_factor))
+    elif args.epoch_samples > 0:
+        train_sampler = TurningAngleSampler(train_dataset.turning_angles, args.epoch_samples, bin_edges=args.angle_bin_edges, bin_quotas=args.angle_bin_quotas,
+                                            directions=train_dataset.directions, reverse_fraction=args.reverse_fraction)
+        train_loader = DataLoader(train_dataset, sampler=train_sampler,
+                              batch_size=args.batch_size, pin_memory=False,
+                              **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=True)
+    elif world_size > 1:
+        train_sampler = DistributedSampler(train_dataset, shuffle=True, drop_last=True)
+        train_loader = DataLoader(train_dataset, sampler=train_sampler,
+                              batch_size=batch_size, pin_memory=False,
+                              **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=True)
+    else:
+        train_sampler = None
+        train_loader = DataLoader(train_dataset,
                               batch_size=args.batch_size, pin_memory=False,
-                              shuffle=True, num_workers=4, drop_last=True)
+                              shuffle=True, **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=True)
 
-    valid_loader = DataLoader(KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='test', seq_prefix=seq_prefix),
+    #Validation runs on rank 0 only
+    valid_loader = None
+    if is_main_process():
+        valid_loader = DataLoader(KITTIVODatasetPreTransformed(kitti_data_pickle_file, seqs_base_path=seqs_base_path, transform_img=transform, run_type='test', seq_prefix=seq_prefix, gray_store=args.gray_store, async_load=args.async_load),
                               batch_size=args.batch_size, pin_memory=False,
-                              shuffle=False, num_workers=4, drop_last=False)
+                              shuffle=False, **loader_kwargs(args.num_workers, args.prefetch_factor), drop_last=False)
     total_time = 0.
     now = datetime.datetime.now()
     start_datetime_str = '{}-{}-{}-{}-{}-{}'.format(now.year, now.month, now.day, now.hour, now.minute, now.second)
 
 
     #Configuration
+    #Per-stage timing, printed every epoch (rank 0 only)
+    stage_timer = StageTimer(args.stage_log, enabled=is_main_process(), sync_cuda=(device.type == 'cuda' and args.stage_log is not None))
+    if args.profile_window is not None and is_main_process():
+        stage_timer.profile_steps(args.profile_dir, *args.profile_window, cuda=(device.type == 'cuda'))
+
     config = {
-        'device': device
+        'device': device,
+        'amp': args.amp,
+        'stage_timer': stage_timer
     }
+    #Pinning, device transfer and batch_transform happen on a background thread, one batch ahead
+    train_loader = DevicePrefetcher(train_loader, config, train=True)
+    if valid_loader is not None:
+        valid_loader = DevicePrefetcher(valid_loader, config)
+    #Plots and checkpoints are written by background processes (see artifact_writer.py)
+    writer = ArtifactWriter(num_workers=args.artifact_workers)
     epoch_time = AverageMeter()
-    avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
-
-    #Visualize
-
-    print('Starting Training \t' 
-          'Valid (Err/NLL) {:.3f} / {:3.3f}\t'.format(
-            valid_ang_error, valid_nll))
-
-    best_valid_loss = avg_valid_loss
-    for epoch in range(args.total_epochs):
+    #Resume checkpoints (see checkpoint.py)
+    checkpoint_dir = 'kitti/plots_and_models/{}/resume_seq_{}_heads_{}'.format(output_folder, args.seq, num_hydra_heads)
+    resumed = load_resume_checkpoint(checkpoint_dir, model, optimizer, train_sampler) if args.resume else None
+    start_epoch = 0
+    if resumed is not None:
+        start_epoch, best_valid_loss = resumed
+    elif args.skip_initial_validate or not is_main_process():
+        best_valid_loss = float('inf')
+    else:
+        avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True, output_grid=True)
+
+        #Visualize
+
+        print('Starting Training \t' 
+              'Valid (Err/NLL) {:.3f} / {:3.3f}\t'.format(
+                valid_ang_error, valid_nll))
+
+        best_valid_loss = avg_valid_loss
+    stage_timer.emit(epoch=0)
+
+    for epoch in range(start_epoch, args.total_epochs):
+        #The other ranks wait here while rank 0 validates and saves, instead of in the first gradient all-reduce
+        barrier()
         end = time.time()
-        avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
+        if hasattr(train_sampler, 'set_epoch'):
+            train_sampler.set_epoch(epoch)
+        avg_train_loss = train(train_model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
+
+        #Validation, plots and checkpoints on rank 0 only
+        if not is_main_process():
+            continue
 
         avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
 
@@ -139,26 +234,35 @@ if __name__ == '__main__':
             sigma_filename = 'kitti/plots_and_models/{}/error_sigma_plot_seq_{}_heads_{}_epoch_{}.pdf'.format(output_folder, args.seq, model.num_hydra_heads, epoch+1)
             #nees_filename = 'kitti/plots/nees_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, epoch+1)
 
-            plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
-
             abs_filename = 'kitti/plots_and_models/{}/abs_sigma_plot_seq_{}_heads_{}_epoch_{}.pdf'.format(output_folder, args.seq, model.num_hydra_heads,
                                                                                   epoch + 1)
-            plot_abs_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3],
-                                    filename=abs_filename)
+            with stage_timer.stage('plot'):
+                writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+                writer.submit(plot_abs_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3],
+                                        filename=abs_filename)
 
-            torch.save({
-                'full_model': model.state_dict(),
-                'predict_history': predict_history,
-                'epoch': epoch + 1,
-            }, 'kitti/plots_and_models/{}/best_model_seq_{}_delta_{}_heads_{}_epoch_{}.pt'.format(output_folder, args.seq, valid_loader.dataset.pose_delta, model.num_hydra_heads, epoch + 1))
+            with stage_timer.stage('checkpoint'):
+                writer.save({
+                    'full_model': model.state_dict(),
+                    'predict_history': predict_history,
+                    'epoch': epoch + 1,
+                }, 'kitti/plots_and_models/{}/best_model_seq_{}_delta_{}_heads_{}_epoch_{}.pt'.format(output_folder, args.seq, valid_loader.dataset.pose_delta, model.num_hydra_heads, epoch + 1))
 
 
             #plot_nees(predict_history[0], predict_history[1], predict_history[2], filename=nees_filename)
 
 
+        if args.checkpoint_every > 0 and (epoch + 1) % args.checkpoint_every == 0:
+            with stage_timer.stage('resume_checkpoint'):
+                save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch + 1, best_valid_loss, train_sampler, keep=args.keep_checkpoints, writer=writer)
+
         if epoch%args.epoch_display == 0:
             print('Epoch {}. Loss (Train/Valid) {:.3E} / {:.3E} \t'
             'Valid (Err/NLL) {:.3f} / {:3.3f}\t'
             'Epoch Time {epoch_time.val:.3f} (avg: {epoch_time.avg:.3f})'.format(
                 epoch+1, avg_train_loss, avg_valid_loss, valid_ang_error, valid_nll, epoch_time=epoch_time))
+        stage_timer.emit(epoch=epoch+1, train_loss=avg_train_loss, valid_loss=avg_valid_loss, epoch_time=epoch_time.val)
 
+    stage_timer.stop_profiler()
+    writer.close()
+    cleanup_distributed()
@@ -17,10 +17,13 @@ import argparse
 import random
 import datetime
 from train_test import *
-from loaders import PlanetariumData
+from loaders import PlanetariumData, PlanetariumBatchLoader, fixed_subset_loader
 from torch.utils.data import Dataset, DataLoader
 from utils import AverageMeter, compute_normalization
 from vis import *
+from artifact_writer import ArtifactWriter
+from checkpoint import save_resume_checkpoint, load_resume_checkpoint
+from runtime_profile import load_runtime_profile, set_threads
 
 if __name__ == '__main__':
     #Reproducibility
@@ -35,9 +38,21 @@ if __name__ == '__main__':
     parser.add_argument('--total_epochs', type=int, default=100)
     parser.add_argument('--q_target_sigma', type=float, default=0.05)
     parser.add_argument('--num_heads', type=int, default=25)
-
+    parser.add_argument('--train_eval_subset', type=int, default=0, help='Evaluate training metrics on a fixed random subset of this size (0: use the head-mean metrics collected by train())')
+    parser.add_argument('--amp', type=str, default=None, choices=['bf16'], help='Run the model forward passes under autocast (bf16 on CPU nodes with AVX512-BF16 / AMX)')
+    parser.add_argument('--skip_initial_validate', action='store_true', default=False, help='Start training without the validation pass at epoch 0')
+    parser.add_argument('--artifact_workers', type=int, default=2, help='Processes that render plots and write checkpoints in the background (0: on the training thread)')
+    parser.add_argument('--resume', action='store_true', default=False, help='Continue from the latest resume checkpoint in simulation/saved_plots/resume_heads_<heads>')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='Write a resume checkpoint every this many epochs (0: never)')
+    parser.add_argument('--keep_checkpoints', type=int, default=2, help='Number of resume checkpoints to keep')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--inter_threads', type=int, default=None, help='Inter-op threads')
+
+    #This machine's runtime profile entry (see runtime_profile.py) replaces the defaults above
+    parser.set_defaults(**load_runtime_profile('sim'))
     args = parser.parse_args()
     print(args)
+    set_threads(args.threads, args.inter_threads)
     train_dataset_path = 'simulation/orbital/train_abs.mat'
     valid_dataset_path = 'simulation/orbital/valid_abs_ood.mat'
 
@@ -75,12 +90,11 @@ if __name__ == '__main__':
     #Load datasets
     normalization = compute_normalization(train_dataset).to(device)
 
-    train_loader = DataLoader(PlanetariumData(train_dataset, k_range=k_range_train, normalization=normalization, mat_targets=False),
-                        batch_size=args.batch_size, pin_memory=True, 
-                        shuffle=True, num_workers=8, drop_last=False)
-    valid_loader = DataLoader(PlanetariumData(valid_dataset, k_range=k_range_valid,normalization=normalization, mat_targets=False),
-                        batch_size=args.batch_size, pin_memory=True,
-                        shuffle=False, num_workers=8, drop_last=False)
+    #Data is normalized once and kept on the device, batches are index slices (no DataLoader workers)
+    train_loader = PlanetariumBatchLoader(PlanetariumData(train_dataset, k_range=k_range_train, normalization=normalization, mat_targets=False),
+                        batch_size=args.batch_size, shuffle=True, drop_last=False, device=device)
+    valid_loader = PlanetariumBatchLoader(PlanetariumData(valid_dataset, k_range=k_range_valid,normalization=normalization, mat_targets=False),
+                        batch_size=args.batch_size, shuffle=False, drop_last=False, device=device)
     total_time = 0.
     now = datetime.datetime.now()
     start_datetime_str = '{}-{}-{}-{}-{}-{}'.format(now.year, now.month, now.day, now.hour, now.minute, now.second)
@@ -88,26 +102,46 @@ if __name__ == '__main__':
 
     #Configuration
     config = {
-        'device': device
+        'device': device,
+        'amp': args.amp
     }
+    #Training metrics come from the training passes themselves, or from a fixed subset of the training set
+    if args.train_eval_subset > 0:
+        train_eval_loader = fixed_subset_loader(train_loader.dataset, args.train_eval_subset, args.batch_size)
+    else:
+        train_eval_loader = train_loader
+    #Plots and checkpoints are written by background processes (see artifact_writer.py)
+    writer = ArtifactWriter(num_workers=args.artifact_workers)
     epoch_time = AverageMeter()
-    avg_train_loss, train_ang_error, train_nll = validate(model, train_loader, loss_fn, config)
-    avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
+    #Resume checkpoints (see checkpoint.py)
+    checkpoint_dir = 'simulation/saved_plots/resume_heads_{}'.format(args.num_heads)
+    resumed = load_resume_checkpoint(checkpoint_dir, model, optimizer) if args.resume else None
+    start_epoch = 0
+    if resumed is not None:
+        start_epoch, best_valid_nll = resumed
+    elif args.skip_initial_validate:
+        best_valid_nll = float('inf')
+    else:
+        avg_train_loss, train_ang_error, train_nll = validate(model, train_eval_loader, loss_fn, config)
+        avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
 
-    #Visualize
-    sigma_filename = 'simulation/saved_plots/sigma_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, 0)
-    plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+        #Visualize
+        sigma_filename = 'simulation/saved_plots/sigma_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, 0)
+        writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
 
-    print('Starting Training \t' 
-          'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'.format(
-            train_ang_error, train_nll, valid_ang_error, valid_nll))
+        print('Starting Training \t' 
+              'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'.format(
+                train_ang_error, train_nll, valid_ang_error, valid_nll))
 
-    best_valid_nll = valid_nll
-    for epoch in range(args.total_epochs):
-        end = time.time()
-        avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
+        best_valid_nll = valid_nll
 
-        _, train_ang_error, train_nll = validate(model, train_loader, loss_fn, config)
+    for epoch in range(start_epoch, args.total_epochs):
+        end = time.time()
+        if args.train_eval_subset > 0:
+            avg_train_loss = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma)
+            _, train_ang_error, train_nll = validate(model, train_eval_loader, loss_fn, config)
+        else:
+            avg_train_loss, train_ang_error, train_nll = train(model, train_loader, loss_fn, optimizer, config, q_target_sigma=args.q_target_sigma, output_metrics=True)
         avg_valid_loss, valid_ang_error, valid_nll, predict_history = validate(model, valid_loader, loss_fn, config, output_history=True)
 
         # Measure elapsed time
@@ -121,13 +155,13 @@ if __name__ == '__main__':
             sigma_filename = 'simulation/saved_plots/sigma_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, epoch+1)
             nees_filename = 'simulation/saved_plots/nees_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, epoch+1)
 
-            plot_errors_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
-            plot_nees(predict_history[0], predict_history[1], predict_history[2], filename=nees_filename)
+            writer.submit(plot_errors_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3], filename=sigma_filename)
+            writer.submit(plot_nees, predict_history[0], predict_history[1], predict_history[2], filename=nees_filename)
 
             abs_filename = 'simulation/saved_plots/abs_sigma_plot_heads_{}_epoch_{}.pdf'.format(model.num_hydra_heads, epoch + 1)
-            plot_abs_with_sigmas(predict_history[0], predict_history[1], predict_history[2], predict_history[3],
+            writer.submit(plot_abs_with_sigmas, predict_history[0], predict_history[1], predict_history[2], predict_history[3],
                                     filename=abs_filename)
-            torch.save({
+            writer.save({
                 'full_model': model.state_dict(),
                 'sensor_net': model.sensor_net.state_dict(),
                 'direct_covar_head': model.direct_covar_head.state_dict(),
@@ -135,9 +169,13 @@ if __name__ == '__main__':
                 'epoch': epoch + 1,
             }, 'simulation/saved_plots/best_model_heads_{}_epoch_{}.pt'.format(model.num_hydra_heads, epoch + 1))
 
+        if args.checkpoint_every > 0 and (epoch + 1) % args.checkpoint_every == 0:
+            save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch + 1, best_valid_nll, keep=args.keep_checkpoints, writer=writer)
+
         if epoch%args.epoch_display == 0:     
             print('Epoch {}. Loss (Train/Valid) {:.3E} / {:.3E} \t'
             'Train (Err/NLL) | Valid (Err/NLL) {:3.3f} / {:3.3f} | {:.3f} / {:3.3f}\t'
             'Epoch Time {epoch_time.val:.3f} (avg: {epoch_time.avg:.3f})'.format(
                 epoch+1, avg_train_loss, avg_valid_loss, train_ang_error, train_nll, valid_ang_error, valid_nll, epoch_time=epoch_time))
 
+    writer.close()
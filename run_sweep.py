@@ -0,0 +1,197 @@
+import os, sys
+import json
+import signal
+import time
+import itertools
+import subprocess
+import argparse
+
+#Runs a sweep of experiment scripts in parallel on the local cores. Each job is pinned to its own set of cores
+#(sched_setaffinity + OMP/MKL thread counts), logs to its own file, and its state is recorded in a json file so that an
+#interrupted sweep can be resumed (finished jobs are skipped, interrupted ones are rerun, after stopping any of their
+#processes left running by a crashed scheduler). A spec looks like:
+#{
+#  "name": "kitti_folds",
+#  "script": "run_kitti_experiment.py",
+#  "threads": 8,
+#  "args": {"resume": true, "total_epochs": 25, "no_cuda": true, "gray_store": "gray"},
+#  "grid": {"seq": ["00", "02", "05"], "lr": [3e-5]}
+#}
+#Every combination of the grid values is a job. With "resume": true, rerun jobs continue from their last resume checkpoint. A spec file can also hold a list of specs, which are scheduled together.
+#Jobs reading the same memory-mapped stores (e.g. --gray_store) share them through the page cache, so packing several
+#folds onto one node costs little more memory than one. Usage:
+#python run_sweep.py sweeps/kitti_folds.json [--cores 0-31] [--max_jobs 4] [--dry_run]
+
+SWEEP_DIR = 'sweeps'
+
+def job_args(args):
+    """argparse flags from a dict (True -> bare flag, False / None -> omitted, lists -> nargs)"""
+    argv = []
+    for key, value in args.items():
+        if value is None or value is False:
+            continue
+        argv.append('--' + key)
+        if value is True:
+            continue
+        argv.extend([str(v) for v in value] if isinstance(value, list) else [str(value)])
+    return argv
+
+def expand_spec(spec):
+    """Returns a list of jobs (dicts with id, cmd, threads) for every combination of the grid values"""
+    grid = spec.get('grid', {})
+    keys = sorted(grid.keys())
+    script = spec['script']
+    jobs = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        args = dict(spec.get('args', {}))
+        args.update(zip(keys, values))
+        job_id = '_'.join([os.path.splitext(os.path.basename(script))[0]] + ['{}_{}'.format(k, v) for k, v in zip(keys, values)])
+        jobs.append({'id': job_id, 'cmd': [sys.executable, script] + job_args(args), 'threads': spec.get('threads', 1)})
+    return jobs
+
+def parse_cores(cores):
+    """'0-7,16-23' -> [0, ..., 7, 16, ..., 23]"""
+    core_list = []
+    for part in cores.split(','):
+        start, _, end = part.partition('-')
+        core_list.extend(range(int(start), int(end or start) + 1))
+    return core_list
+
+class SweepState(object):
+    def __init__(self, state_file):
+        self.state_file = state_file
+        if os.path.isfile(state_file):
+            with open(state_file, 'r') as f:
+                self.jobs = json.load(f)
+        else:
+            self.jobs = {}
+
+    def status(self, job_id):
+        return self.jobs.get(job_id, {}).get('status')
+
+    def update(self, job_id, **kwargs):
+        self.jobs.setdefault(job_id, {}).update(kwargs)
+        self.save()
+
+    def save(self):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(tmp_file, self.state_file)
+
+def job_pid(job_state):
+    """pid of a job started by an earlier scheduler if it is still running (its command line must match), else None"""
+    pid = job_state.get('pid')
+    if pid is None:
+        return None
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            cmdline = [arg.decode() for arg in f.read().split(b'\0')[:-1]]
+    except OSError:
+        return None
+    return pid if cmdline == job_state.get('cmd') else None
+
+def stop_orphan(pid, timeout=30.):
+    """Terminates the process group of a job (killed if it is still alive after timeout seconds)"""
+    for sig, wait in [(signal.SIGTERM, timeout), (signal.SIGKILL, 5.)]:
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return
+            time.sleep(0.5)
+
+def launch(job, cores, log_file):
+    env = dict(os.environ)
+    threads = str(len(cores))
+    env.update({'OMP_NUM_THREADS': threads, 'MKL_NUM_THREADS': threads})
+    with open(log_file, 'a') as log:
+        log.write('### {} {}\n### cores {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), ' '.join(job['cmd']), cores))
+        log.flush()
+        #Each job leads its own process group (with its DataLoader workers), so orphans can be stopped as a whole
+        return subprocess.Popen(job['cmd'], stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True,
+                                preexec_fn=lambda: os.sched_setaffinity(0, cores))
+
+def run_sweep(jobs, state, log_dir, cores, max_jobs=None, retry_failed=False, poll_interval=5.):
+    pending = []
+    for job in jobs:
+        status = state.status(job['id'])
+        if status == 'done' or (status == 'failed' and not retry_failed):
+            print('Skipping {} ({}).'.format(job['id'], status))
+            continue
+        #A 'running' job whose scheduler crashed may still be running: stop it before it is rerun
+        pid = job_pid(state.jobs[job['id']]) if status == 'running' else None
+        if pid is not None:
+            print('Stopping {} (pid {}) left running by a previous scheduler.'.format(job['id'], pid))
+            stop_orphan(pid)
+        job['threads'] = min(job['threads'], len(cores))
+        pending.append(job)
+
+    free_cores = list(cores)
+    running = {}
+    try:
+        while pending or running:
+            #Start every pending job that fits on the free cores (in spec order, smaller jobs may fill the gaps)
+            for job in list(pending):
+                if job['threads'] > len(free_cores) or (max_jobs is not None and len(running) >= max_jobs):
+                    continue
+                job_cores, free_cores = free_cores[:job['threads']], free_cores[job['threads']:]
+                log_file = os.path.join(log_dir, job['id'] + '.log')
+                proc = launch(job, job_cores, log_file)
+                running[job['id']] = (proc, job_cores, time.time())
+                state.update(job['id'], status='running', cmd=job['cmd'], cores=job_cores, log=log_file, pid=proc.pid)
+                pending.remove(job)
+                print('Started {} on cores {}.'.format(job['id'], job_cores))
+
+            time.sleep(poll_interval)
+            for job_id, (proc, job_cores, start) in list(running.items()):
+                returncode = proc.poll()
+                if returncode is None:
+                    continue
+                status = 'done' if returncode == 0 else 'failed'
+                state.update(job_id, status=status, returncode=returncode, duration=time.time() - start)
+                free_cores = sorted(free_cores + job_cores)
+                del running[job_id]
+                print('{} {} ({:.1f} min). {} running, {} pending.'.format(job_id, status, (time.time() - start)/60., len(running), len(pending)))
+    except KeyboardInterrupt:
+        #Jobs stay marked 'running' and are rerun on resume
+        for proc, _, _ in running.values():
+            proc.terminate()
+        for proc, _, _ in running.values():
+            proc.wait()
+        raise
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel experiment sweeps on the local cores.')
+    parser.add_argument('spec', type=str, help='Sweep spec (json)')
+    parser.add_argument('--cores', type=str, default=None, help='Cores to use, e.g. 0-31 (default: all available)')
+    parser.add_argument('--max_jobs', type=int, default=None, help='Maximum concurrent jobs (e.g., to bound memory)')
+    parser.add_argument('--retry_failed', action='store_true', default=False, help='Rerun jobs that failed in a previous run')
+    parser.add_argument('--dry_run', action='store_true', default=False)
+    args = parser.parse_args()
+
+    with open(args.spec, 'r') as f:
+        specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = [specs]
+    jobs = [job for spec in specs for job in expand_spec(spec)]
+
+    name = specs[0].get('name', os.path.splitext(os.path.basename(args.spec))[0])
+    sweep_dir = os.path.join(SWEEP_DIR, name)
+    log_dir = os.path.join(sweep_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    state = SweepState(os.path.join(sweep_dir, 'state.json'))
+    cores = parse_cores(args.cores) if args.cores is not None else sorted(os.sched_getaffinity(0))
+
+    if args.dry_run:
+        for job in jobs:
+            print('{:<8} {:2d} threads: {}'.format(state.status(job['id']) or 'new', job['threads'], ' '.join(job['cmd'])))
+        sys.exit(0)
+
+    print('{} jobs on {} cores.'.format(len(jobs), len(cores)))
+    run_sweep(jobs, state, log_dir, cores, args.max_jobs, args.retry_failed)
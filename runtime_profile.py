@@ -0,0 +1,60 @@
+import os
+import json
+import socket
+import time
+import torch
+
+#Thread / DataLoader settings measured by autotune.py on this machine, one entry per experiment:
+#{"kitti": {"threads": 16, "inter_threads": 2, "num_workers": 4, "prefetch_factor": 2, "batch_size": 32,
+#           "samples_per_s": 151.2, "host": "...", "cores": 32, "date": "..."}}
+#The experiment scripts use an entry as their argparse defaults (flags given on the command line still win).
+#autotune.py writes the 'kitti' and '7scenes' entries; run_kitti_abs/run_kitti_dual/run_sim_experiment.py read
+#'kitti_abs', 'kitti_dual' and 'sim', and keep their argparse defaults until such an entry exists.
+
+DEFAULT_PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime_profile.json')
+PROFILE_KEYS = ['threads', 'inter_threads', 'num_workers', 'prefetch_factor', 'batch_size']
+
+def load_runtime_profile(experiment, profile_file=DEFAULT_PROFILE_FILE):
+    """Tuned settings for experiment (dict of PROFILE_KEYS), or {} if there are none for this machine"""
+    if not os.path.isfile(profile_file):
+        return {}
+    with open(profile_file, 'r') as f:
+        entry = json.load(f).get(experiment)
+    if entry is None:
+        return {}
+    if entry.get('host') != socket.gethostname() or entry.get('cores') != len(os.sched_getaffinity(0)):
+        print('Ignoring the {} runtime profile: tuned on {} with {} cores.'.format(experiment, entry.get('host'), entry.get('cores')))
+        return {}
+    settings = {k: entry[k] for k in PROFILE_KEYS if k in entry}
+    #Tuned for a single process on the whole machine: torchrun processes split the cores between them (see distributed.py),
+    #and run_sweep.py jobs get OMP_NUM_THREADS for their share of the cores
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1 or 'OMP_NUM_THREADS' in os.environ:
+        settings.pop('threads', None)
+    print('Runtime profile ({}): {}'.format(experiment, settings))
+    return settings
+
+def save_runtime_profile(experiment, settings, samples_per_s, profile_file=DEFAULT_PROFILE_FILE):
+    profiles = {}
+    if os.path.isfile(profile_file):
+        with open(profile_file, 'r') as f:
+            profiles = json.load(f)
+    profiles[experiment] = dict({k: settings[k] for k in PROFILE_KEYS}, samples_per_s=samples_per_s, host=socket.gethostname(),
+                                cores=len(os.sched_getaffinity(0)), date=time.strftime('%Y-%m-%d %H:%M:%S'))
+    tmp_file = profile_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(profiles, f, indent=1)
+    os.replace(tmp_file, profile_file)
+
+def set_threads(threads=None, inter_threads=None):
+    """Must run before any parallel work (torch only accepts the inter-op thread count once)"""
+    if inter_threads is not None:
+        torch.set_num_interop_threads(inter_threads)
+    if threads is not None:
+        torch.set_num_threads(threads)
+
+def loader_kwargs(num_workers, prefetch_factor=None):
+    #prefetch_factor is only valid with worker processes
+    kwargs = {'num_workers': num_workers}
+    if num_workers > 0 and prefetch_factor is not None:
+        kwargs['prefetch_factor'] = prefetch_factor
+    return kwargs
@@ -0,0 +1,125 @@
+import numpy as np
+import math
+from torch.utils.data import Sampler
+
+
+class SequenceBlockBatchSampler(Sampler):
+    """Batch sampler for the KITTI pair datasets that shuffles at block granularity.
+
+    The samples of each sequence are ordered by frame and cut into blocks of block_size contiguous frames.
+    Every epoch the blocks are shuffled, blocks_per_batch of them are mixed together, and batches are cut from the
+    shuffled mix. Every sample is still seen exactly once per epoch, but each batch only touches a few frame windows,
+    which keeps the page cache (and lazy / memmap frame stores) warm.
+    block_size=1 recovers a fully random shuffle; larger blocks trade randomness for locality.
+    As with DistributedSampler, call set_epoch before each epoch (the order only depends on seed and epoch).
+    """
+
+    def __init__(self, seqs, pose_indices, batch_size, block_size=64, blocks_per_batch=4, drop_last=False, seed=0):
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.blocks_per_batch = blocks_per_batch
+        self.seed = seed
+        self.epoch = 0
+
+        seqs = np.asarray(seqs)
+        first_frames = np.asarray(pose_indices).reshape(len(seqs), -1).min(axis=1)
+        self.blocks = []
+        for seq in np.unique(seqs):
+            seq_ids = np.where(seqs == seq)[0]
+            seq_ids = seq_ids[np.argsort(first_frames[seq_ids], kind='stable')]
+            self.blocks.extend([seq_ids[i:i + block_size] for i in range(0, len(seq_ids), block_size)])
+        self.num_samples = len(seqs)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+
+        block_order = rng.permutation(len(self.blocks))
+        ids = []
+        for g in range(0, len(block_order), self.blocks_per_batch):
+            group = np.concatenate([self.blocks[b] for b in block_order[g:g + self.blocks_per_batch]])
+            ids.append(group[rng.permutation(len(group))])
+        ids = np.concatenate(ids)
+
+        for b in range(len(self)):
+            yield ids[b*self.batch_size:(b + 1)*self.batch_size].tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return int(math.ceil(self.num_samples / self.batch_size))
+
+
+class TurningAngleSampler(Sampler):
+    """Sampler for the KITTI pair datasets that sets the epoch length and balance at train time.
+
+    Pairs are binned by their turning angle (dataset.turning_angles, stored in the manifest) with bin_edges (rad).
+    Every epoch draws num_samples pairs, bin_quotas[b] of them from bin b (without replacement while a bin has enough
+    pairs), so near-identity pairs can be down-weighted without rebuilding the dataset. Quotas of empty bins are
+    spread over the others. With directions (+1 / -1 per pair) and reverse_fraction, that fraction of each bin's
+    draws comes from the reverse pairs. As with DistributedSampler, call set_epoch before each epoch.
+    """
+
+    def __init__(self, turning_angles, num_samples, bin_edges=[0.02], bin_quotas=[0.2, 0.8], directions=None, reverse_fraction=None, seed=0):
+        if len(bin_quotas) != len(bin_edges) + 1:
+            raise ValueError('bin_quotas needs one entry per bin (len(bin_edges) + 1).')
+        self.num_samples = num_samples
+        self.reverse_fraction = reverse_fraction if directions is not None else None
+        self.seed = seed
+        self.epoch = 0
+
+        bin_ids = np.digitize(np.asarray(turning_angles), bin_edges)
+        self.bins = []
+        for b in range(len(bin_quotas)):
+            ids = np.where(bin_ids == b)[0]
+            if self.reverse_fraction is None:
+                self.bins.append([ids])
+            else:
+                reverse = np.asarray(directions)[ids] < 0
+                self.bins.append([ids[~reverse], ids[reverse]])
+
+        quotas = np.array([q if sum([len(ids) for ids in group]) > 0 else 0. for q, group in zip(bin_quotas, self.bins)], dtype=np.float64)
+        if quotas.sum() == 0:
+            raise ValueError('All turning angle bins with a non-zero quota are empty.')
+        self.bin_counts = self.split_count(num_samples, quotas)
+
+    @staticmethod
+    def split_count(n, fractions):
+        """Splits n into integer counts proportional to fractions (largest remainder)"""
+        fractions = np.asarray(fractions, dtype=np.float64)
+        exact = n*fractions/fractions.sum()
+        counts = np.floor(exact).astype(int)
+        counts[np.argsort(counts - exact)[:n - counts.sum()]] += 1
+        return counts
+
+    def draw(self, rng, ids, n):
+        return rng.choice(ids, n, replace=n > len(ids))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+
+        samples = []
+        for group, n in zip(self.bins, self.bin_counts):
+            if n == 0:
+                continue
+            if len(group) == 1:
+                samples.append(self.draw(rng, group[0], n))
+                continue
+            #Forward / reverse split, falling back to whichever direction has pairs
+            counts = self.split_count(n, [1. - self.reverse_fraction, self.reverse_fraction])
+            if len(group[0]) == 0 or len(group[1]) == 0:
+                counts = [n, 0] if len(group[0]) > 0 else [0, n]
+            for ids, m in zip(group, counts):
+                if m > 0:
+                    samples.append(self.draw(rng, ids, m))
+
+        samples = np.concatenate(samples)
+        return iter(samples[rng.permutation(len(samples))].tolist())
+
+    def __len__(self):
+        return self.num_samples
@@ -0,0 +1,54 @@
+import torch
+import torch.nn.functional as F
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from augment import BatchAugment
+
+#augment.BatchAugment with zero jitter (zero angles, unit jitter factors) must only crop and normalize.
+
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, -1, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, -1, 1, 1)
+
+def random_batch(n=4, h=40, w=56):
+    torch.manual_seed(0)
+    return torch.randint(0, 256, (n, 3, h, w), dtype=torch.uint8)
+
+def normalized(imgs):
+    return (imgs.float()/255. - MEAN)/STD
+
+def test_identity_without_augmentation():
+    imgs = random_batch()
+    assert torch.allclose(BatchAugment(seed=0)(imgs), normalized(imgs), atol=1e-6)
+    cropped = BatchAugment(crop_size=32, seed=0)(imgs)
+    assert torch.allclose(cropped, normalized(imgs[:, :, 4:36, 12:44]), atol=1e-6)
+
+def test_zero_angle_warp_is_identity():
+    imgs = random_batch().float()/255.
+    aug = BatchAugment(seed=0)
+    n, _, h, w = imgs.shape
+    theta = aug.affine_theta(n, h, w)
+    assert torch.allclose(theta, torch.tensor([[1., 0., 0.], [0., 1., 0.]], dtype=torch.float64).expand(n, 2, 3))
+    grid = F.affine_grid(theta.to(imgs), imgs.shape, align_corners=False)
+    warped = F.grid_sample(imgs, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+    assert torch.allclose(warped, imgs, atol=1e-5)
+
+def test_unit_jitter_is_identity():
+    imgs = random_batch().float()/255.
+    aug = BatchAugment(brightness=0.4, contrast=0.4, saturation=0.4, seed=0)
+    #Jitter factors of exactly 1
+    aug.uniform = lambda n, low, high: torch.ones(n, dtype=torch.float64)
+    assert torch.allclose(aug.jitter(imgs.clone()), imgs, atol=1e-6)
+
+def test_seeded_batches_repeat():
+    imgs = random_batch()
+    aug_1 = BatchAugment(degrees=30, shear=10, brightness=0.2, seed=3)
+    aug_2 = BatchAugment(degrees=30, shear=10, brightness=0.2, seed=3)
+    for _ in range(2):
+        assert torch.equal(aug_1(imgs), aug_2(imgs))
+
+if __name__ == '__main__':
+    test_identity_without_augmentation()
+    test_zero_angle_warp_is_identity()
+    test_unit_jitter_is_identity()
+    test_seeded_batches_repeat()
+    print('BatchAugment is the identity (up to normalization) at zero jitter.')
@@ -0,0 +1,112 @@
+import torch
+import random
+import tempfile
+import threading
+import numpy as np
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import checkpoint
+from checkpoint import save_resume_checkpoint, load_resume_checkpoint, checkpoint_files, save_and_prune
+
+#Round trip of the resume checkpoints in checkpoint.py: pruning to the latest `keep`, restoring the model, optimizer,
+#RNG and sampler states, and loading with torch.load(weights_only=True).
+
+class EpochSampler(object):
+    def __init__(self):
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+def make_model():
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    return model, optimizer
+
+def train_step(model, optimizer):
+    loss = model(torch.randn(8, 4)).pow(2).sum()
+    optimizer.zero_grad()
+    loss.backward()
+    optimizer.step()
+
+def random_draws():
+    return torch.rand(3), np.random.rand(3), [random.random() for _ in range(3)]
+
+def test_save_prune_load():
+    torch.manual_seed(0)
+    np.random.seed(0)
+    random.seed(0)
+    model, optimizer = make_model()
+    sampler = EpochSampler()
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        for epoch in range(1, 4):
+            train_step(model, optimizer)
+            sampler.set_epoch(epoch)
+            save_resume_checkpoint(checkpoint_dir, model, optimizer, epoch, 1./epoch, sampler, keep=2)
+        files = checkpoint_files(checkpoint_dir)
+        assert [os.path.basename(f) for f in files] == ['resume_epoch_2.pt', 'resume_epoch_3.pt']
+        draws = random_draws()
+
+        resumed_model, resumed_optimizer = make_model()
+        resumed_sampler = EpochSampler()
+        assert load_resume_checkpoint(checkpoint_dir, resumed_model, resumed_optimizer, resumed_sampler) == (3, 1./3)
+
+    for p, p_resumed in zip(model.state_dict().values(), resumed_model.state_dict().values()):
+        assert torch.equal(p, p_resumed)
+    assert resumed_optimizer.state_dict()['state'].keys() == optimizer.state_dict()['state'].keys()
+    for state, state_resumed in zip(optimizer.state_dict()['state'].values(), resumed_optimizer.state_dict()['state'].values()):
+        for key in state:
+            assert torch.equal(torch.as_tensor(state[key]), torch.as_tensor(state_resumed[key]))
+    assert resumed_sampler.epoch == 3
+
+    #The RNG streams continue from where they were when the checkpoint was written
+    resumed_draws = random_draws()
+    assert torch.equal(draws[0], resumed_draws[0])
+    assert np.array_equal(draws[1], resumed_draws[1])
+    assert draws[2] == resumed_draws[2]
+
+def test_load_weights_only():
+    model, optimizer = make_model()
+    train_step(model, optimizer)
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        save_resume_checkpoint(checkpoint_dir, model, optimizer, 1, float('inf'), EpochSampler())
+        state = torch.load(checkpoint_files(checkpoint_dir)[-1], map_location='cpu', weights_only=True)
+    assert state['epoch'] == 1 and state['sampler_epoch'] == 0
+    assert torch.equal(state['model']['weight'], model.weight.detach())
+
+def test_overlapping_prunes():
+    #Two writers (as in the ArtifactWriter pool) both list the old checkpoints before either removes one
+    listed = threading.Barrier(2)
+    def checkpoint_files_together(checkpoint_dir):
+        files = checkpoint_files(checkpoint_dir)
+        listed.wait(timeout=10)
+        return files
+
+    errors = []
+    def save(state, path):
+        try:
+            save_and_prune(state, path, keep=2)
+        except Exception as e:
+            errors.append(e)
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        for epoch in range(1, 3):
+            save_and_prune({'epoch': epoch}, os.path.join(checkpoint_dir, 'resume_epoch_{}.pt'.format(epoch)), keep=2)
+        checkpoint.checkpoint_files = checkpoint_files_together
+        try:
+            threads = [threading.Thread(target=save, args=({'epoch': epoch}, os.path.join(checkpoint_dir, 'resume_epoch_{}.pt'.format(epoch))))
+                       for epoch in range(3, 5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            checkpoint.checkpoint_files = checkpoint_files
+        assert errors == []
+        assert [os.path.basename(f) for f in checkpoint_files(checkpoint_dir)][-2:] == ['resume_epoch_3.pt', 'resume_epoch_4.pt']
+
+if __name__ == '__main__':
+    test_save_prune_load()
+    test_load_weights_only()
+    test_overlapping_prunes()
+    print('Resume checkpoints round trip.')
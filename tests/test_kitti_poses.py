@@ -0,0 +1,78 @@
+import numpy as np
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kitti'))
+from liegroups.numpy import SE3
+from create_kitti_training_data_single_memory import stack_poses, batch_relative_poses, compute_vo_pose_errors
+
+#Regression test of the batched pose helpers of kitti/create_kitti_training_data_single_memory.py against the previous
+#per-pair SE3 loop.
+
+def compute_vo_pose_errors_loop(Twv_gt, Twv_est, pose_deltas, seq, eval_type='train', add_reverse=False, min_turning_angle=0.):
+    T_21_gts = []
+    T_21_ests = []
+    pair_pose_ids = []
+    seqs = []
+    for p_delta in pose_deltas:
+        if eval_type == 'train':
+            pose_ids = range(len(Twv_gt) - p_delta)
+        elif eval_type == 'test':
+            pose_ids = range(0, len(Twv_gt) - p_delta, p_delta)
+
+        for p_idx in pose_ids:
+            T_21_gt = Twv_gt[p_idx + p_delta].inv().dot(Twv_gt[p_idx])
+            T_21_est = Twv_est[p_idx + p_delta].inv().dot(Twv_est[p_idx])
+            turning_angle = np.linalg.norm(T_21_gt.rot.log())
+            if turning_angle > min_turning_angle or eval_type == 'test':
+                T_21_gts.append(T_21_gt)
+                T_21_ests.append(T_21_est)
+                pair_pose_ids.append([p_idx, p_idx + p_delta])
+                seqs.append(seq)
+
+        if add_reverse and eval_type == 'train':
+            for p_idx in pose_ids:
+                T_21_gt = Twv_gt[p_idx].inv().dot(Twv_gt[p_idx + p_delta])
+                T_21_est = Twv_est[p_idx].inv().dot(Twv_est[p_idx + p_delta])
+                turning_angle = np.linalg.norm(T_21_gt.rot.log())
+                if turning_angle > min_turning_angle:
+                    T_21_gts.append(T_21_gt)
+                    T_21_ests.append(T_21_est)
+                    pair_pose_ids.append([p_idx + p_delta, p_idx])
+                    seqs.append(seq)
+    return (T_21_gts, T_21_ests, pair_pose_ids, seqs)
+
+def random_trajectory(rng, n, rot_sigma=0.03):
+    """Random walk of n poses, with a mix of near-straight and turning steps"""
+    T = [SE3.identity()]
+    for _ in range(n - 1):
+        xi = np.concatenate((rng.randn(3), rot_sigma*rng.randn(3)))
+        T.append(T[-1].dot(SE3.exp(xi)))
+    return T
+
+def test_batch_relative_poses():
+    rng = np.random.RandomState(0)
+    T_1, T_2 = random_trajectory(rng, 20, 0.5), random_trajectory(rng, 20, 0.5)
+    T_21 = batch_relative_poses(stack_poses(T_1), stack_poses(T_2))
+    for i in range(len(T_1)):
+        assert np.allclose(T_21[i], T_2[i].inv().dot(T_1[i]).as_matrix(), atol=1e-10)
+
+def test_compute_vo_pose_errors_matches_loop():
+    rng = np.random.RandomState(1)
+    Twv_gt = random_trajectory(rng, 60)
+    Twv_est = [T.dot(SE3.exp(0.01*rng.randn(6))) for T in Twv_gt]
+    for eval_type, pose_deltas, add_reverse, min_turning_angle in [('train', [1], True, 0.02), ('train', [1, 2], False, 0.04),
+                                                                    ('train', [1], True, 0.), ('test', [2], True, 0.02)]:
+        T_21_gt, T_21_est, pair_pose_ids, seqs = compute_vo_pose_errors(stack_poses(Twv_gt), stack_poses(Twv_est), pose_deltas, '00',
+                                                                         eval_type, add_reverse, min_turning_angle)
+        T_21_gt_ref, T_21_est_ref, pair_pose_ids_ref, seqs_ref = compute_vo_pose_errors_loop(Twv_gt, Twv_est, pose_deltas, '00',
+                                                                                               eval_type, add_reverse, min_turning_angle)
+        assert len(T_21_gt_ref) > 0
+        assert np.array_equal(pair_pose_ids, np.array(pair_pose_ids_ref))
+        assert list(seqs) == seqs_ref
+        assert np.allclose(T_21_gt, stack_poses(T_21_gt_ref), atol=1e-10)
+        assert np.allclose(T_21_est, stack_poses(T_21_est_ref), atol=1e-10)
+
+if __name__ == '__main__':
+    test_batch_relative_poses()
+    test_compute_vo_pose_errors_matches_loop()
+    print('Batched relative poses match the per-pair SE3 loop.')
@@ -0,0 +1,84 @@
+import numpy as np
+import pickle
+import tempfile
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from liegroups.numpy import SE3
+from kitti.manifest import save_manifest, load_manifest, select_seq, convert_pickle_to_manifest, rotation_angles, PAIR_KEYS
+
+#Round trip of the columnar KITTI manifests (kitti/manifest.py): save / load, legacy pickle conversion and select_seq.
+
+def random_poses(rng, n):
+    return [SE3.exp(np.concatenate((rng.randn(3), 0.1*rng.randn(3)))) for _ in range(n)]
+
+def kitti_data_pickle(rng):
+    """Dictionary in the layout of the legacy kitti_singlefile_*.pickle files (lists of SE3 objects)"""
+    kitti_data = {}
+    for split, seqs in [('train', ['02']*5 + ['05']*4), ('test', ['00']*6)]:
+        n = len(seqs)
+        first = rng.randint(0, 100, n)
+        reverse = rng.rand(n) > 0.5
+        kitti_data[split + '_seqs'] = seqs
+        kitti_data[split + '_pose_indices'] = [[i + 1, i] if r else [i, i + 1] for i, r in zip(first, reverse)]
+        kitti_data[split + '_T_21_gt'] = random_poses(rng, n)
+        kitti_data[split + '_T_21_vo'] = random_poses(rng, n)
+        kitti_data[split + '_tm_mat_paths'] = ['/trajectories/{}.mat'.format(seq) for seq in sorted(set(seqs))]
+    kitti_data['train_pose_deltas'] = [1]
+    kitti_data['test_pose_delta'] = 1
+    return kitti_data
+
+def check_split(manifest, kitti_data, split):
+    assert manifest[split + '_seqs'].tolist() == kitti_data[split + '_seqs']
+    assert manifest[split + '_pose_indices'].dtype == np.int32
+    assert manifest[split + '_pose_indices'].tolist() == [list(p) for p in kitti_data[split + '_pose_indices']]
+    for key in ['T_21_gt', 'T_21_vo']:
+        assert np.array_equal(manifest[split + '_' + key], np.stack([T.as_matrix() for T in kitti_data[split + '_' + key]]))
+    angles = [np.linalg.norm(T.rot.log()) for T in kitti_data[split + '_T_21_gt']]
+    assert np.allclose(manifest[split + '_turning_angles'], angles, atol=1e-7)
+    directions = [1 if p[1] > p[0] else -1 for p in kitti_data[split + '_pose_indices']]
+    assert manifest[split + '_directions'].tolist() == directions
+
+def test_save_load_round_trip():
+    kitti_data = kitti_data_pickle(np.random.RandomState(0))
+    with tempfile.TemporaryDirectory() as data_path:
+        manifest_file = os.path.join(data_path, 'manifest.npz')
+        save_manifest(kitti_data, manifest_file)
+        manifest = load_manifest(manifest_file)
+    for split in ['train', 'test']:
+        check_split(manifest, kitti_data, split)
+    assert manifest['test_pose_delta'] == 1 and isinstance(manifest['test_pose_delta'], int)
+    assert manifest['train_pose_deltas'].tolist() == [1]
+    assert manifest['train_tm_mat_paths'].tolist() == ['/trajectories/02.mat', '/trajectories/05.mat']
+
+def test_convert_pickle():
+    kitti_data = kitti_data_pickle(np.random.RandomState(1))
+    with tempfile.TemporaryDirectory() as data_path:
+        pickle_file = os.path.join(data_path, 'kitti_singlefile_data_sequence_00_delta_1_reverse_True.pickle')
+        with open(pickle_file, 'wb') as handle:
+            pickle.dump(kitti_data, handle)
+        manifest_file = convert_pickle_to_manifest(pickle_file)
+        assert manifest_file == os.path.splitext(pickle_file)[0] + '.npz'
+        manifest = load_manifest(manifest_file)
+    for split in ['train', 'test']:
+        check_split(manifest, kitti_data, split)
+
+def test_select_seq():
+    kitti_data = kitti_data_pickle(np.random.RandomState(2))
+    with tempfile.TemporaryDirectory() as data_path:
+        manifest_file = os.path.join(data_path, 'manifest.npz')
+        save_manifest(kitti_data, manifest_file)
+        manifest = load_manifest(manifest_file)
+        full = load_manifest(manifest_file)
+    mask = full['train_seqs'] == '05'
+    select_seq(manifest, 'train', '05')
+    for key in PAIR_KEYS:
+        assert len(manifest['train_' + key]) == mask.sum()
+        assert np.array_equal(manifest['train_' + key], full['train_' + key][mask])
+    assert np.array_equal(manifest['test_T_21_gt'], full['test_T_21_gt'])
+    assert np.allclose(manifest['train_turning_angles'], rotation_angles(manifest['train_T_21_gt']))
+
+if __name__ == '__main__':
+    test_save_load_round_trip()
+    test_convert_pickle()
+    test_select_seq()
+    print('Manifests round trip.')
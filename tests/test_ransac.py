@@ -0,0 +1,71 @@
+import numpy as np
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kitti', 'svo'))
+from liegroups import SE3
+from pyslam.sensors import StereoCamera
+from outlier_rejection import FrameToFrameRANSAC, compute_transform_fast, compute_ransac_cost_fast, SE3_SHAPE
+
+#Regression test of FrameToFrameRANSAC (kitti/svo/outlier_rejection.py, identical in kitti/svo_fusion) against the
+#previous per-iteration implementation, with a fixed seed, and a check of adaptive termination on synthetic stereo matches.
+
+def perform_ransac_loop(ransac):
+    """Previous perform_ransac: minimal sets copied one iteration at a time, all hypotheses evaluated"""
+    rand_ids = np.random.randint(ransac.num_pts, size=(ransac.ransac_iters, ransac.num_min_set_pts))
+    pts_1_sample_stacked = np.empty([ransac.ransac_iters, ransac.num_min_set_pts, 3])
+    pts_2_sample_stacked = np.empty([ransac.ransac_iters, ransac.num_min_set_pts, 3])
+    for ransac_i in range(ransac.ransac_iters):
+        pts_1_sample_stacked[ransac_i, :, :] = ransac.pts_1[rand_ids[ransac_i]]
+        pts_2_sample_stacked[ransac_i, :, :] = ransac.pts_2[rand_ids[ransac_i]]
+    T_21_stacked = compute_transform_fast(pts_1_sample_stacked, pts_2_sample_stacked, SE3_SHAPE)
+    cam_params = ransac.camera.cu, ransac.camera.cv, ransac.camera.fu, ransac.camera.fv, ransac.camera.b
+    inlier_masks_stacked = compute_ransac_cost_fast(T_21_stacked, ransac.pts_1, ransac.stereo_obs_2, cam_params, ransac.ransac_thresh)
+    inlier_nums = np.sum(inlier_masks_stacked, axis=1)
+    most_inliers_idx = np.argmax(inlier_nums)
+    return T_21_stacked[most_inliers_idx], np.where(inlier_masks_stacked[most_inliers_idx, :])[0]
+
+def project(camera, pts):
+    return np.stack((camera.fu*pts[:, 0]/pts[:, 2] + camera.cu, camera.fv*pts[:, 1]/pts[:, 2] + camera.cv, camera.fu*camera.b/pts[:, 2]), axis=1)
+
+def synthetic_matches(seed=0, num_pts=200, outlier_ratio=0.2):
+    """KITTI-like stereo camera, matches under a known motion with a fraction of random (outlier) matches"""
+    rng = np.random.RandomState(seed)
+    camera = StereoCamera(609.6, 172.9, 721.5, 721.5, 0.537, 1242, 375)
+    pts_1 = np.stack((rng.uniform(-10., 10., num_pts), rng.uniform(-2., 2., num_pts), rng.uniform(5., 40., num_pts)), axis=1)
+    T_21 = SE3.exp(np.array([0.05, 0.01, -0.9, 0.002, 0.03, -0.001]))
+    pts_2 = pts_1.dot(T_21.rot.as_matrix().T) + T_21.trans
+    stereo_obs_1 = project(camera, pts_1)
+    stereo_obs_2 = project(camera, pts_2)
+    outliers = rng.choice(num_pts, int(outlier_ratio*num_pts), replace=False)
+    stereo_obs_2[outliers] = np.stack((rng.uniform(0., 1242., len(outliers)), rng.uniform(0., 375., len(outliers)), rng.uniform(1., 50., len(outliers))), axis=1)
+    inliers = np.setdiff1d(np.arange(num_pts), outliers)
+    return camera, stereo_obs_1, stereo_obs_2, T_21, inliers
+
+def test_matches_loop_implementation():
+    camera, stereo_obs_1, stereo_obs_2, _, _ = synthetic_matches()
+    ransac = FrameToFrameRANSAC(camera, adaptive=False)
+    ransac.set_obs(stereo_obs_1, stereo_obs_2)
+    for seed in [0, 1, 2]:
+        np.random.seed(seed)
+        T_21_best, obs_1_inliers, obs_2_inliers, inlier_indices = ransac.perform_ransac()
+        np.random.seed(seed)
+        T_21_loop, inlier_indices_loop = perform_ransac_loop(ransac)
+        assert np.allclose(T_21_best.as_matrix(), T_21_loop, atol=1e-12)
+        assert np.array_equal(inlier_indices, inlier_indices_loop)
+        assert np.array_equal(obs_2_inliers, ransac.stereo_obs_2[inlier_indices_loop])
+        assert ransac.num_hypotheses == ransac.ransac_iters
+
+def test_adaptive_termination():
+    camera, stereo_obs_1, stereo_obs_2, T_21, inliers = synthetic_matches(seed=1)
+    ransac = FrameToFrameRANSAC(camera, adaptive=True)
+    ransac.set_obs(stereo_obs_1, stereo_obs_2)
+    np.random.seed(0)
+    T_21_best, _, _, inlier_indices = ransac.perform_ransac()
+    #80% inliers: a few tens of hypotheses reach 99.9% confidence
+    assert ransac.num_hypotheses < ransac.ransac_iters
+    assert len(np.intersect1d(inlier_indices, inliers)) >= 0.9*len(inliers)
+    assert np.allclose(T_21_best.as_matrix(), T_21.as_matrix(), atol=1e-2)
+
+if __name__ == '__main__':
+    test_matches_loop_implementation()
+    test_adaptive_termination()
+    print('FrameToFrameRANSAC matches the per-iteration implementation; adaptive termination stops early.')
@@ -0,0 +1,67 @@
+import numpy as np
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from samplers import SequenceBlockBatchSampler, TurningAngleSampler
+
+#Quotas of samplers.TurningAngleSampler, and the epoch determinism of both KITTI samplers (the order only depends on
+#seed and set_epoch, as with DistributedSampler).
+
+def turning_angle_data(rng, n_low=100, n_high=300):
+    turning_angles = np.concatenate((0.02*rng.rand(n_low), 0.02 + 0.2*rng.rand(n_high)))
+    directions = np.where(rng.rand(n_low + n_high) > 0.5, 1, -1).astype(np.int8)
+    return turning_angles, directions
+
+def test_turning_angle_quotas():
+    turning_angles, directions = turning_angle_data(np.random.RandomState(0))
+    sampler = TurningAngleSampler(turning_angles, 200, bin_edges=[0.02], bin_quotas=[0.2, 0.8])
+    samples = np.array(list(sampler))
+    assert len(samples) == len(sampler) == 200
+    assert (turning_angles[samples] <= 0.02).sum() == 40
+    #Both bins have enough pairs, so there is no replacement
+    assert len(np.unique(samples)) == 200
+
+    sampler = TurningAngleSampler(turning_angles, 200, bin_edges=[0.02], bin_quotas=[0.2, 0.8], directions=directions, reverse_fraction=0.25)
+    samples = np.array(list(sampler))
+    low = turning_angles[samples] <= 0.02
+    assert low.sum() == 40
+    assert (directions[samples][low] < 0).sum() == 10
+    assert (directions[samples][~low] < 0).sum() == 40
+
+def test_turning_angle_empty_bin():
+    turning_angles = 0.02 + 0.2*np.random.RandomState(1).rand(50)
+    sampler = TurningAngleSampler(turning_angles, 120, bin_edges=[0.02], bin_quotas=[0.2, 0.8])
+    samples = np.array(list(sampler))
+    #The quota of the empty bin goes to the other one, drawn with replacement
+    assert len(samples) == 120
+    assert (turning_angles[samples] > 0.02).all()
+
+def check_epochs(sampler):
+    epoch_0 = list(sampler)
+    assert list(sampler) == epoch_0
+    sampler.set_epoch(1)
+    epoch_1 = list(sampler)
+    assert epoch_1 != epoch_0
+    assert list(sampler) == epoch_1
+    sampler.set_epoch(0)
+    assert list(sampler) == epoch_0
+
+def test_turning_angle_epochs():
+    turning_angles, directions = turning_angle_data(np.random.RandomState(2))
+    check_epochs(TurningAngleSampler(turning_angles, 200, directions=directions, reverse_fraction=0.5))
+
+def test_sequence_block_epochs():
+    seqs = np.array(['00']*150 + ['02']*90)
+    first_frames = np.concatenate((np.arange(150), np.arange(90)))
+    pose_indices = np.stack((first_frames, first_frames + 1), axis=1)
+    sampler = SequenceBlockBatchSampler(seqs, pose_indices, 16, block_size=8, blocks_per_batch=2, drop_last=False)
+    check_epochs(sampler)
+    #Every sample once per epoch
+    assert sorted(i for batch in sampler for i in batch) == list(range(len(seqs)))
+    assert len(list(sampler)) == len(sampler)
+
+if __name__ == '__main__':
+    test_turning_angle_quotas()
+    test_turning_angle_empty_bin()
+    test_turning_angle_epochs()
+    test_sequence_block_epochs()
+    print('Sampler quotas and epochs are as expected.')
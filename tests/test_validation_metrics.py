@@ -0,0 +1,73 @@
+import torch
+import tempfile
+import numpy as np
+import sys, os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from train_test import ValidationMetrics
+from loss import QuatNLLLoss, QuatLoss
+from utils import quat_ang_error, nll_quat, normalize_vecs
+
+#Regression test of train_test.ValidationMetrics against the previous per-batch computation of validate()
+#(loss, quat_ang_error and nll_quat per batch, history concatenated at the end).
+
+def random_batches(batch_sizes, seed=0):
+    torch.manual_seed(seed)
+    batches = []
+    for n in batch_sizes:
+        q_gt = normalize_vecs(torch.randn(n, 4, dtype=torch.double)).view(n, 4)
+        q_est = normalize_vecs(q_gt + 0.2*torch.randn(n, 4, dtype=torch.double)).view(n, 4)
+        A = torch.randn(n, 3, 3, dtype=torch.double)
+        Rinv = A.bmm(A.transpose(1, 2)) + torch.eye(3, dtype=torch.double)
+        B = torch.randn(n, 3, 3, dtype=torch.double)
+        Rinv_direct = B.bmm(B.transpose(1, 2)) + torch.eye(3, dtype=torch.double)
+        batches.append((q_est, q_gt, Rinv, Rinv_direct))
+    return batches
+
+def reference_metrics(loss_fn, batches):
+    loss = torch.tensor([0.], dtype=torch.double)
+    angular_error = 0.
+    nll = 0.
+    total_samples = 0.
+    for q_est, q_gt, Rinv, Rinv_direct in batches:
+        loss = loss + loss_fn(q_est, q_gt, Rinv).mean()
+        angular_error += quat_ang_error(q_est, q_gt).sum()
+        nll += nll_quat(q_est, q_gt, Rinv).sum()
+        total_samples += q_gt.shape[0]
+    history = tuple([torch.cat([b[i] if i < 2 else b[i].inverse() for b in batches], dim=0) for i in [1, 0, 2, 3]])
+    return (loss.item() / len(batches), float(angular_error/total_samples)*(180./3.1415), float(nll/total_samples), history)
+
+def check(loss_fn, batch_sizes, history_file=None):
+    batches = random_batches(batch_sizes)
+    metrics = ValidationMetrics(loss_fn, num_samples=sum(batch_sizes), history=True, history_file=history_file)
+    for batch in batches:
+        metrics.update(*batch)
+    avg_loss, avg_err, avg_nll, history = metrics.results()
+    ref_loss, ref_err, ref_nll, ref_history = reference_metrics(loss_fn, batches)
+    assert np.isclose(avg_loss, ref_loss, rtol=1e-10)
+    assert np.isclose(avg_err, ref_err, rtol=1e-10)
+    assert np.isclose(avg_nll, ref_nll, rtol=1e-10)
+    #History keeps the dtype of the estimates
+    for h, h_ref in zip(history, ref_history):
+        assert h.dtype == torch.double
+        assert torch.allclose(h, h_ref, rtol=1e-12, atol=1e-12)
+
+def test_matches_per_batch_metrics():
+    check(QuatNLLLoss(), [8, 5, 3])
+    check(QuatLoss(), [8, 5, 3])
+
+def test_memmap_history():
+    with tempfile.TemporaryDirectory() as history_dir:
+        check(QuatNLLLoss(), [4, 6], history_file=os.path.join(history_dir, 'valid'))
+        assert os.path.isfile(os.path.join(history_dir, 'valid_q_gt.npy'))
+
+def test_without_history():
+    metrics = ValidationMetrics(QuatNLLLoss())
+    for batch in random_batches([4, 1]):
+        metrics.update(*batch)
+    assert len(metrics.results()) == 3
+
+if __name__ == '__main__':
+    test_matches_per_batch_metrics()
+    test_memmap_history()
+    test_without_history()
+    print('ValidationMetrics matches the per-batch computation.')
@@ -3,100 +3,183 @@ import numpy as np
 from torch.utils.data import Dataset, DataLoader
 from liegroups.torch import SO3
 from lie_algebra import so3_log, so3_exp
-from utils import quat_norm_diff, nll_quat, quat_ang_error, perturb_quat_for_hydranet
+from utils import quat_norm_diff, nll_quat, quat_ang_error, perturb_quat_for_hydranet, quat_log_diff, nll_quat_from_residual, hydranet_quat_mean, autocast, StageTimer
 from vis import plot_errors_with_sigmas
+from distributed import all_reduce_sum
+from loss import QuatNLLLoss
 import torchvision
 
 
-def validate(model, loader, loss_fn, config, output_history=False, output_grid=False):
-    model.eval()
+#Disabled unless config['stage_timer'] is set
+NO_TIMER = StageTimer(enabled=False)
 
-    with torch.no_grad():
-        loss = torch.tensor([0.])
-        angular_error = 0.
-        nll = 0.        
-        total_samples = 0.
-
-        if output_history:
-            q_gt_hist = []
-            q_est_hist = []
-            R_est_hist = []
-            R_direct_hist = []
-
-        for batch_idx, (y_obs, q_gt) in enumerate(loader):
-
-            if isinstance(y_obs, list):
-                y_obs[0] = y_obs[0].to(config['device'])
-                y_obs[1] = y_obs[1].to(config['device'])
-            else:
-                y_obs = y_obs.to(config['device'])
+def get_stage_timer(config):
+    return config.get('stage_timer') or NO_TIMER
 
-            # if batch_idx == int(len(loader)/2) + 1 and output_grid:
-            #     print('SAVING IMAGE GRID')
-            #     torchvision.utils.save_image(torchvision.utils.make_grid(y_obs), '7scenes/jittered_image.png')
+def get_batch_transform(config, train=False):
+    #config['train_batch_transform'] (e.g., augment.BatchAugment) replaces config['batch_transform'] during training
+    if train and config.get('train_batch_transform') is not None:
+        return config['train_batch_transform']
+    return config.get('batch_transform')
 
-            q_gt = q_gt.to(config['device'])
-            batch_size = q_gt.shape[0]
+def prepare_batch(loader, y_obs, q_gt, config, train=False):
+    #Batches from a DevicePrefetcher are already on the device and transformed
+    if getattr(loader, 'on_device', False):
+        return y_obs, q_gt
 
-            q_est, Rinv, Rinv_direct = model(y_obs)
+    if isinstance(y_obs, list):
+        y_obs = [y.to(config['device']) for y in y_obs]
+    else:
+        y_obs = y_obs.to(config['device'])
 
-            loss_b = loss_fn(q_est, q_gt, Rinv).mean()
-            loss = loss + loss_b
-            angular_error += quat_ang_error(q_est, q_gt).sum()
-            nll += nll_quat(q_est, q_gt, Rinv).sum()
+    #Optional batch-level input transform (e.g., normalization of uint8 image batches), applied after the device transfer
+    batch_transform = get_batch_transform(config, train)
+    if batch_transform is not None:
+        if isinstance(y_obs, list):
+            y_obs = [batch_transform(y) for y in y_obs]
+        else:
+            y_obs = batch_transform(y_obs)
 
-            if output_history:
-                q_gt_hist.append(q_gt)
-                q_est_hist.append(q_est)
-                R_est_hist.append(Rinv.inverse())
-                R_direct_hist.append(Rinv_direct.inverse())
+    return y_obs, q_gt.to(config['device'])
 
-            total_samples += batch_size
 
+class ValidationMetrics(object):
+    """Running sums of the loss, angular error and NLL of validate(), computed from one quat_log_diff residual per batch.
+    With history=True, ground truth, estimates and covariances are copied into arrays preallocated for num_samples, in the
+    dtype of the first batch's estimates (or into .npy memmaps named history_file + '_{q_gt,q_est,R_est,R_direct}.npy'),
+    so memory stays flat."""
 
-    avg_loss = loss.item() / len(loader)
-    avg_err = (angular_error/total_samples)*(180./3.1415)
-    avg_nll = nll/total_samples
+    HISTORY_SHAPES = [('q_gt', (4,)), ('q_est', (4,)), ('R_est', (3, 3)), ('R_direct', (3, 3))]
 
-    if output_history:
-        q_gt_hist = torch.cat(q_gt_hist, dim=0).cpu()
-        q_est_hist = torch.cat(q_est_hist, dim=0).cpu()
-        R_est_hist = torch.cat(R_est_hist, dim=0).cpu()
-        R_direct_hist = torch.cat(R_direct_hist, dim=0).cpu()
+    def __init__(self, loss_fn, num_samples=0, history=False, history_file=None):
+        self.loss_fn = loss_fn
+        self.loss = 0.
+        self.angular_error = 0.
+        self.nll = 0.
+        self.num_batches = 0
+        self.total_samples = 0
 
-        return (avg_loss, avg_err, avg_nll, (q_gt_hist, q_est_hist, R_est_hist, R_direct_hist))
+        self.num_samples = num_samples
+        self.history_file = history_file
+        #Allocated on the first update
+        self.history = {} if history else None
 
-    else:
-        return (avg_loss, avg_err, avg_nll)
+    def allocate_history(self, dtype):
+        for name, shape in self.HISTORY_SHAPES:
+            if self.history_file is None:
+                self.history[name] = np.empty((self.num_samples,) + shape, dtype=dtype)
+            else:
+                self.history[name] = np.lib.format.open_memmap('{}_{}.npy'.format(self.history_file, name), mode='w+', dtype=dtype, shape=(self.num_samples,) + shape)
+
+    def update(self, q_est, q_gt, Rinv, Rinv_direct):
+        residual = quat_log_diff(q_est, q_gt).view(-1, 3)
+        nll = nll_quat_from_residual(residual, Rinv)
+        #QuatNLLLoss is the NLL itself; other losses are evaluated separately
+        if isinstance(self.loss_fn, QuatNLLLoss):
+            loss_b = nll.mean()
+        else:
+            loss_b = self.loss_fn(q_est, q_gt, Rinv).mean()
+
+        self.loss = self.loss + loss_b
+        self.angular_error = self.angular_error + residual.norm(dim=1).sum()
+        self.nll = self.nll + nll.sum()
+
+        batch_size = q_gt.shape[0]
+        if self.history is not None:
+            if len(self.history) == 0:
+                self.allocate_history(torch.empty(0, dtype=q_est.dtype).numpy().dtype)
+            idx = slice(self.total_samples, self.total_samples + batch_size)
+            if idx.stop > len(self.history['q_gt']):
+                raise ValueError('ValidationMetrics history is preallocated for {} samples.'.format(len(self.history['q_gt'])))
+            self.history['q_gt'][idx] = q_gt.cpu().numpy()
+            self.history['q_est'][idx] = q_est.cpu().numpy()
+            self.history['R_est'][idx] = Rinv.inverse().cpu().numpy()
+            self.history['R_direct'][idx] = Rinv_direct.inverse().cpu().numpy()
+
+        self.num_batches += 1
+        self.total_samples += batch_size
+
+    def results(self):
+        avg_loss = float(self.loss) / self.num_batches
+        avg_err = (float(self.angular_error)/self.total_samples)*(180./3.1415)
+        avg_nll = float(self.nll)/self.total_samples
+        if self.history is None:
+            return (avg_loss, avg_err, avg_nll)
+
+        history = tuple([torch.from_numpy(self.history[name][:self.total_samples]) for name, _ in self.HISTORY_SHAPES])
+        return (avg_loss, avg_err, avg_nll, history)
+
+
+def validate(model, loader, loss_fn, config, output_history=False, output_grid=False, history_file=None):
+    model.eval()
+    metrics = ValidationMetrics(loss_fn, num_samples=len(loader.dataset), history=output_history, history_file=history_file)
+
+    timer = get_stage_timer(config)
+
+    with torch.no_grad():
+        for batch_idx, (y_obs, q_gt) in enumerate(timer.timed_iter(loader, 'valid_data')):
+
+            with timer.stage('valid_transfer'):
+                y_obs, q_gt = prepare_batch(loader, y_obs, q_gt, config)
+
+            # if batch_idx == int(len(loader)/2) + 1 and output_grid:
+            #     print('SAVING IMAGE GRID')
+            #     torchvision.utils.save_image(torchvision.utils.make_grid(y_obs), '7scenes/jittered_image.png')
+
+            with timer.stage('valid_forward'), autocast(config['device'], config.get('amp')):
+                q_est, Rinv, Rinv_direct = model(y_obs)
+            with timer.stage('valid_metrics'):
+                metrics.update(q_est, q_gt, Rinv, Rinv_direct)
+
+    return metrics.results()
 
 
-def train(model, loader, loss_fn, optimizer, config, q_target_sigma=0.):
+def train(model, loader, loss_fn, optimizer, config, q_target_sigma=0., output_metrics=False):
 
     #Train!
     model.train()
+    #model may be wrapped in DistributedDataParallel
+    num_hydra_heads = getattr(model, 'module', model).num_hydra_heads
     total_batches = len(loader)
     total_loss = 0.
-    #Necessary to have the same noise at every epoch
-    torch.manual_seed(42)
+    #Target noise from its own generator, reseeded every epoch: the noise repeats by batch position, not per sample
+    #(shuffled samples get new noise every epoch). Reseeding the global RNG instead would repeat the shuffle order and
+    #dropout masks every epoch and undo the RNG state restored from a resume checkpoint.
+    noise_generator = torch.Generator().manual_seed(42)
+
+    #Angular error / NLL of the head mean, from the training forward passes (i.e., with the model in train mode)
+    angular_error = 0.
+    nll = 0.
+    total_samples = 0
+
+    #Per-stage wall time (config['stage_timer'], see utils.StageTimer)
+    timer = get_stage_timer(config)
+
+    for batch_idx, (y_obs, q_gt) in enumerate(timer.timed_iter(loader, 'data')):
+        with timer.stage('transfer'):
+            y_obs, q_gt = prepare_batch(loader, y_obs, q_gt, config, train=True)
+        #Only the forward pass runs under autocast (config['amp'], e.g. 'bf16'); the model returns fp32 outputs
+        with timer.stage('forward'), autocast(config['device'], config.get('amp')):
+            q_est, Rinv = model(y_obs)
+
+        if output_metrics:
+            with timer.stage('train_metrics'), torch.no_grad():
+                batch_size = q_gt.shape[0]
+                q_stack = q_est.detach().view(num_hydra_heads, batch_size, 4).clone()
+                q_mean, Rinv_mean, _ = hydranet_quat_mean(q_stack, Rinv[:batch_size].detach().diagonal(dim1=1, dim2=2))
+                residual = quat_log_diff(q_mean, q_gt).view(-1, 3)
+                angular_error = angular_error + residual.norm(dim=1).sum()
+                nll = nll + nll_quat_from_residual(residual, Rinv_mean).sum()
+                total_samples += batch_size
+
+        with timer.stage('loss'):
+            if num_hydra_heads == 1:
+                loss = loss_fn(q_est, q_gt, Rinv).mean()
 
-    for batch_idx, (y_obs, q_gt) in enumerate(loader):
-        #Identity matrix as the initialization
-        if isinstance(y_obs, list):
-            y_obs[0] = y_obs[0].to(config['device'])
-            y_obs[1] = y_obs[1].to(config['device'])
-        else:
-            y_obs = y_obs.to(config['device'])
-
-        q_gt = q_gt.to(config['device'])
-        q_est, Rinv = model(y_obs)
-
-        if model.num_hydra_heads == 1:
-            loss = loss_fn(q_est, q_gt, Rinv).mean()
-
-        else:
-            batch_size = q_gt.shape[0]
-            q_gt = perturb_quat_for_hydranet(q_gt, model.num_hydra_heads, q_target_sigma)
-            loss = loss_fn(q_est, q_gt, Rinv).mean()
+            else:
+                batch_size = q_gt.shape[0]
+                q_gt = perturb_quat_for_hydranet(q_gt, num_hydra_heads, q_target_sigma, generator=noise_generator)
+                loss = loss_fn(q_est, q_gt, Rinv).mean()
 
             # #Only select the heads that give the minimum loss
             # all_loss = loss_fn(q_est, q_gt, Rinv)
@@ -114,8 +197,16 @@ def train(model, loader, loss_fn, optimizer, config, q_target_sigma=0.):
             # loss = loss.mean()
 
         total_loss += loss.item()
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-    
+        with timer.stage('backward'):
+            optimizer.zero_grad()
+            loss.backward()
+        with timer.stage('optimizer'):
+            optimizer.step()
+        timer.step()
+
+    #Averages over all processes when training is distributed
+    total_loss, total_batches, angular_error, nll, total_samples = all_reduce_sum([total_loss, total_batches, angular_error, nll, total_samples])
+
+    if output_metrics:
+        return (total_loss/total_batches, (float(angular_error)/total_samples)*(180./3.1415), float(nll)/total_samples)
     return total_loss/total_batches
\ No newline at end of file
@@ -2,6 +2,8 @@ import torch
 import numpy as np
 import matplotlib.pyplot as plt
 import math
+import contextlib
+import json, time
 from lie_algebra import so3_wedge, so3_log
 
 class AverageMeter(object):
@@ -21,6 +23,91 @@ class AverageMeter(object):
         self.count += n
         self.avg = self.sum / self.count
 
+class StageTimer(object):
+    """Wall time per training stage, e.g. `with timer.stage('forward'): ...`, summed over an epoch and appended to a
+    JSONL file (one line per epoch) by emit(). With sync_cuda=True, CUDA is synchronized at the end of every stage so
+    that asynchronous kernels are charged to the stage that launched them. A disabled timer costs one branch per stage.
+    Optionally records a torch.profiler trace of a window of training steps (see profile_steps / step)."""
+
+    def __init__(self, log_file=None, enabled=True, sync_cuda=False):
+        self.log_file = log_file
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with torch.profiler.record_function(name):
+                    yield
+            else:
+                yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            self.add(name, time.perf_counter() - start)
+
+    def stage(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    def timed_iter(self, iterable, name='data'):
+        """Yields from iterable, charging the time spent waiting for every item to stage `name`"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def profile_steps(self, trace_dir, skip=5, steps=5, cuda=False):
+        """Records a torch.profiler trace (tensorboard / chrome format, in trace_dir) of training steps skip+1 .. skip+steps
+        (after one warm-up step). Stage names appear as labelled regions in the trace."""
+        activities = [torch.profiler.ProfilerActivity.CPU] + ([torch.profiler.ProfilerActivity.CUDA] if cuda else [])
+        self.profiler = torch.profiler.profile(activities=activities,
+                                               schedule=torch.profiler.schedule(wait=max(skip - 1, 0), warmup=1, active=steps, repeat=1),
+                                               on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir))
+        self.profiler.start()
+
+    def step(self):
+        """Marks the end of a training step for the profiler window"""
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def stop_profiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+
+    def summary(self):
+        return {name: {'total_s': round(self.totals[name], 6), 'count': self.counts[name],
+                       'mean_ms': round(1e3*self.totals[name]/self.counts[name], 4)} for name in self.totals}
+
+    def emit(self, **fields):
+        """Appends fields (e.g. epoch=...) and the per-stage totals to the log file, prints them, and resets the totals"""
+        if not self.enabled:
+            return
+        record = dict(fields, stages=self.summary())
+        if self.log_file is not None:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        print('Stage times (s): ' + ', '.join(['{} {:.2f}'.format(name, t) for name, t in sorted(self.totals.items(), key=lambda kv: -kv[1])]))
+        self.reset()
+
 def compute_normalization(dataset):
 
     y_obs = torch.from_numpy(dataset['y_k_j']).float()
@@ -80,6 +167,60 @@ def batch_sample_covariance(vecs):
     covars = (1./(M - 1))*vecs.transpose(1,2).bmm(vecs)
     return covars
 
+def autocast(device, amp=None):
+    """Autocast context for model forward passes: amp='bf16' runs convolutions and linear layers in bfloat16"""
+    if amp is None:
+        return contextlib.nullcontext()
+    if amp != 'bf16':
+        raise ValueError('amp must be None or `bf16`.')
+    return torch.autocast(device.type, dtype=torch.bfloat16)
+
+def fp32_region(x):
+    """Disables autocast (if active) for numerically sensitive quaternion / Lie ops on x's device"""
+    if not hasattr(torch, 'autocast'):
+        return contextlib.nullcontext()
+    return torch.autocast(x.device.type, enabled=False)
+
+def to_fp32(x):
+    return x.float() if x.dtype in [torch.bfloat16, torch.float16] else x
+
+def hydranet_outputs(q_heads, covar_out, training):
+    """Outputs of the HydraNet models from the raw head outputs (list of H B x 4) and direct covariance head output (B x 3).
+    Training: all head quaternions (H*B x 4) and their inverse covariances. Otherwise: q_mean, Rinv, Rinv_direct."""
+    with fp32_region(covar_out):
+        q_out = [normalize_vecs(to_fp32(q)) for q in q_heads]
+        inv_vars = positive_fn(to_fp32(covar_out)) + 1e-8  # Add a small non-zero number to avoid divide by zero errors
+        # If we are training, we just return self_heads*batch_size vectors - otherwise we apply the quat mean
+
+        if training:
+            num_heads = len(q_out)
+            q_out = torch.cat(q_out, 0)
+            I = torch.diag(q_out.new_ones(3)).expand(q_out.shape[0], 3, 3)
+            inv_vars = inv_vars.repeat([num_heads, 1])
+            Rinv = I.mul(inv_vars.unsqueeze(2).expand(q_out.shape[0], 3, 3))
+            return q_out, Rinv
+        else:
+            return hydranet_quat_mean(torch.stack(q_out, 0), inv_vars)
+
+def hydranet_quat_mean(q_stack, inv_vars):
+    """Mean of the head outputs q_stack (H x B x 4) and its inverse covariance: the direct covariance (inverse variances
+    inv_vars, B x 3) plus the sample covariance of the heads about the mean. Returns q_mean, Rinv, Rinv_direct."""
+    num_heads = q_stack.shape[0]
+    q_mean = normalize_vecs(set_quat_sign(q_stack).mean(dim=0))
+    batch_size = q_mean.shape[0]
+    I = torch.diag(q_mean.new_ones(3)).expand(batch_size, 3, 3)
+    Rinv_direct = I.mul(inv_vars.unsqueeze(2).expand(batch_size, 3, 3))
+
+    if num_heads > 1:
+        # #Convert into a concatenated tensor: N*M x D (where N=batches, M= heads)
+        q_batch = q_stack.permute(1, 0, 2).contiguous().view(-1, 4)
+        q_batch_mean = q_mean.repeat([1, num_heads]).view(-1, 4)
+        phi_diff = quat_log_diff(q_batch, q_batch_mean).view(-1, num_heads, 3)
+        Rinv = (Rinv_direct.inverse() + batch_sample_covariance(phi_diff)).inverse()  # Outputs N x D - 1 x D - 1
+    else:
+        Rinv = Rinv_direct
+    return q_mean, Rinv, Rinv_direct
+
 #Quaternion difference of two unit quaternions
 def quat_norm_diff(q_a, q_b):
     if q_a.dim() < 2:
@@ -156,12 +297,11 @@ def quat_log(q):
     return phi.squeeze()
 
 def positive_fn(x):
+    #Softplus with a threshold: log(1 + eps + exp(x)) below large_num, identity above.
+    #Computed with torch.where on the clamped input (no masked gather / scatter); clamping keeps exp (and its gradient) finite
     large_num = 10
     eps = 1e-12
-    y = x.clone()
-    small_mask = x < large_num
-    y[small_mask] = torch.log(1. + eps + torch.exp(x[small_mask]))
-    return y
+    return torch.where(x < large_num, torch.log(1. + eps + torch.exp(x.clamp(max=large_num))), x)
 
 def quat_inv(q):
     #input: q: Nx4
@@ -208,10 +348,14 @@ def quat_log_diff(q1, q2):
 
 #input: Nx4
 #output: HNx4 where H is num_heads - each target is repeated
-def perturb_quat_for_hydranet(q, num_heads, q_sigma):
+def perturb_quat_for_hydranet(q, num_heads, q_sigma, generator=None):
+    #generator: optional CPU torch.Generator for the noise (leaves the global RNG untouched)
     if q_sigma > 0.:
         q = q.repeat((num_heads, 1))
-        dphi = q_sigma*torch.randn_like(q)[:, :3]
+        if generator is None:
+            dphi = q_sigma*torch.randn_like(q)[:, :3]
+        else:
+            dphi = q_sigma*torch.randn(q.shape, generator=generator, dtype=q.dtype).to(q.device)[:, :3]
         q = quat_compose(quat_exp(dphi), q)
         return q
     else:
@@ -311,7 +455,11 @@ def batch_logdet3(A):
 
 
 def nll_quat(q_est, q_gt, Rinv):
-    residual = quat_log_diff(q_est, q_gt).unsqueeze(2)
+    return nll_quat_from_residual(quat_log_diff(q_est, q_gt), Rinv)
+
+def nll_quat_from_residual(residual, Rinv):
+    #residual: Nx3 (e.g., quat_log_diff(q_est, q_gt), shared with the angular error)
+    residual = residual.view(-1, 3, 1)
     weighted_term = 0.5*residual.transpose(1,2).bmm(Rinv).bmm(residual)
     nll = -0.5*batch_logdet3(Rinv) + weighted_term.squeeze()
     return  nll